@@ -0,0 +1,14 @@
+"""
+Local benchmarks. Importing the package puts src/ and the fake Workers runtime
+(bench/runtime: workers, js, pyodide) on sys.path, so the worker runs under CPython.
+"""
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+RUNTIME_DIR = os.path.join(BENCH_DIR, "runtime")
+
+for path in (SRC_DIR, RUNTIME_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,63 @@
+"""
+Microbenchmark of the Firestore value codec on 1, 7 and 30 day itineraries,
+against the previous json.dumps-into-stringValue storage.
+
+    python bench/codec_bench.py [--number 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from repositories.firestore_codec import decode_itinerary, decode_value, encode_value  # noqa: E402
+
+
+def make_itinerary(duration_days):
+    return [
+        {
+            "day": day,
+            "theme": f"Theme of day {day}",
+            "activities": [
+                {
+                    "time": time_of_day,
+                    "description": f"Visit attraction {day}-{slot}, book ahead and plan two hours on site.",
+                    "location": f"Attraction {day}-{slot}",
+                }
+                for slot, time_of_day in enumerate(["Morning", "Afternoon", "Evening"])
+            ],
+        }
+        for day in range(1, duration_days + 1)
+    ]
+
+
+def per_call_us(statement, number):
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'days':>5} {'encode us':>10} {'decode us':>10} {'json enc us':>12} {'json dec us':>12} {'native B':>9} {'string B':>9}")
+    for duration_days in (1, 7, 30):
+        days = make_itinerary(duration_days)
+        native = encode_value(days)
+        string = {"stringValue": json.dumps(days)}
+        assert decode_value(native) == days == decode_itinerary(string)
+        print(
+            f"{duration_days:>5}"
+            f" {per_call_us(lambda: encode_value(days), args.number):>10.1f}"
+            f" {per_call_us(lambda: decode_value(native), args.number):>10.1f}"
+            f" {per_call_us(lambda: {'stringValue': json.dumps(days)}, args.number):>12.1f}"
+            f" {per_call_us(lambda: decode_itinerary(string), args.number):>12.1f}"
+            f" {len(json.dumps(native)):>9}"
+            f" {len(json.dumps(string)):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
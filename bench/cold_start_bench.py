@@ -0,0 +1,112 @@
+"""
+Cold-start benchmark: every sample is a fresh interpreter that imports the worker
+module and serves one request against zero-latency fakes, so the numbers are the
+import cost and the first-request cost of a new isolate.
+
+    python -m bench.cold_start_bench
+    python -m bench.cold_start_bench --runs 20 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from . import BENCH_DIR
+
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# runs in the child interpreter; prints one JSON line
+CHILD = """
+import json, sys, time
+import bench
+
+before = set(sys.modules)
+started = time.perf_counter()
+import worker
+imported = time.perf_counter()
+import_modules = len(set(sys.modules) - before)
+
+import asyncio
+import workers
+from bench.driver import BenchEnv, PROJECT_ID, COLLECTION, build_upstream, drain_background, fetch, parse_args
+from bench.fakes import completed_document
+
+args = parse_args(["--auth-latency", "0", "--firestore-latency", "0", "--llm-latency", "0"])
+upstream = build_upstream(args)
+workers.set_fetch_handler(upstream)
+document_id = upstream.firestore.add(COLLECTION, completed_document("Kyoto, Japan", 3), PROJECT_ID)
+request = {scenario!r}
+if request == "poll":
+    path, method, body = "/itinerary?id=" + document_id, "GET", None
+else:
+    path, method, body = "/create", "POST", {{"destination": "Kyoto, Japan", "durationDays": 3}}
+
+async def first_request():
+    started = time.perf_counter()
+    response = await fetch(worker.on_fetch, BenchEnv(), path, method, body)
+    elapsed = time.perf_counter() - started
+    await drain_background()
+    return response.status, elapsed
+
+before_request = set(sys.modules)
+status, request_seconds = asyncio.run(first_request())
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "import_modules": import_modules,
+    "first_request_ms": request_seconds * 1000,
+    "first_request_modules": len(set(sys.modules) - before_request),
+    "status": status,
+}}))
+"""
+
+
+def run_child(scenario):
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD.format(scenario=scenario)],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # the worker logs with print, the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(scenario, samples):
+    def median(key):
+        return round(statistics.median(sample[key] for sample in samples), 2)
+
+    return {
+        "scenario": scenario,
+        "runs": len(samples),
+        "import_ms": median("import_ms"),
+        "import_modules": median("import_modules"),
+        "first_request_ms": median("first_request_ms"),
+        "first_request_modules": median("first_request_modules"),
+        "statuses": sorted({sample["status"] for sample in samples}),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per scenario")
+    parser.add_argument("--scenario", nargs="+", choices=["poll", "create"], default=["poll", "create"])
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+    for scenario in args.scenario:
+        summary = summarize(scenario, [run_child(scenario) for _ in range(args.runs)])
+        if args.json:
+            print(json.dumps(summary), flush=True)
+        else:
+            print(
+                f"{scenario:<7} import={summary['import_ms']}ms ({summary['import_modules']} modules)"
+                f"  first request={summary['first_request_ms']}ms"
+                f" (+{summary['first_request_modules']} modules)  statuses={summary['statuses']}",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
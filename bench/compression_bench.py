@@ -0,0 +1,89 @@
+"""
+Size and CPU of the itinerary storage formats (native Firestore array, zlib
+bytesValue) and of the response content codings (gzip, brotli when the brotli
+package is installed) on 1 to 30 day itineraries. The generated itineraries
+repeat more than real ones, so real compression ratios are lower.
+
+    python bench/compression_bench.py [--number 500]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from repositories.firestore_codec import (  # noqa: E402
+    ITINERARY_FORMAT_NATIVE,
+    ITINERARY_FORMAT_ZLIB,
+    decode_itinerary_fields,
+    encode_itinerary,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from codec_bench import make_itinerary, per_call_us  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DURATIONS = (1, 3, 7, 14, 30)
+
+
+def storage_rows(number):
+    print("storage: Firestore JSON bytes of the itinerary fields, encode/decode us")
+    print(f"{'days':>5} {'native B':>9} {'zlib B':>8} {'ratio':>6} {'native enc':>11} {'zlib enc':>9} {'native dec':>11} {'zlib dec':>9}")
+    for duration_days in DURATIONS:
+        days = make_itinerary(duration_days)
+        native = encode_itinerary(days, ITINERARY_FORMAT_NATIVE)
+        compressed = encode_itinerary(days, ITINERARY_FORMAT_ZLIB)
+        assert decode_itinerary_fields(native) == days == decode_itinerary_fields(compressed)
+        native_size = len(json.dumps(native))
+        compressed_size = len(json.dumps(compressed))
+        print(
+            f"{duration_days:>5} {native_size:>9} {compressed_size:>8} {compressed_size / native_size:>6.2f}"
+            f" {per_call_us(lambda: encode_itinerary(days, ITINERARY_FORMAT_NATIVE), number):>11.1f}"
+            f" {per_call_us(lambda: encode_itinerary(days, ITINERARY_FORMAT_ZLIB), number):>9.1f}"
+            f" {per_call_us(lambda: decode_itinerary_fields(native), number):>11.1f}"
+            f" {per_call_us(lambda: decode_itinerary_fields(compressed), number):>9.1f}"
+        )
+
+
+def response_rows(number):
+    codings = [("gzip", lambda data: gzip.compress(data, 6))]
+    if brotli is not None:
+        codings.append(("br q4", lambda data: brotli.compress(data, quality=4)))
+        codings.append(("br q11", lambda data: brotli.compress(data, quality=11)))
+    else:
+        print("(brotli not installed, pip install brotli to include it)")
+    print("responses: body bytes and compress us per coding")
+    print(f"{'days':>5} {'identity B':>11}" + "".join(f" {name + ' B':>10} {name + ' us':>10}" for name, _ in codings))
+    for duration_days in DURATIONS:
+        body = json.dumps(
+            {
+                "success": "true",
+                "status": "completed",
+                "data": {"destination": "Paris", "duration_days": duration_days, "itinerary": make_itinerary(duration_days)},
+            }
+        ).encode("utf-8")
+        row = f"{duration_days:>5} {len(body):>11}"
+        for _, compress in codings:
+            row += f" {len(compress(body)):>10} {per_call_us(lambda: compress(body), number):>10.1f}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=500)
+    args = parser.parse_args()
+    storage_rows(args.number)
+    print()
+    response_rows(args.number)
+
+
+if __name__ == "__main__":
+    main()
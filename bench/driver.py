@@ -0,0 +1,349 @@
+"""
+End-to-end benchmark driver: runs the worker's on_fetch against the fake
+Firebase Auth, Firestore and OpenAI services and reports latency percentiles,
+throughput and upstream call counts per scenario.
+
+    python -m bench.driver
+    python -m bench.driver --scenario create poll_completed --concurrency 50 --requests 500
+    python -m bench.driver --llm-latency 800 --error-rate 0.05 --rate-limit-rate 0.02 --json
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+
+import workers
+
+from .fakes import (
+    FakeFirebaseAuth,
+    FakeFirestore,
+    FakeOpenAI,
+    FakeUpstream,
+    ServiceProfile,
+    completed_document,
+)
+
+PROJECT_ID = "bench"
+COLLECTION = "itineraries"
+
+
+class BenchEnv:
+    def __init__(self, **variables):
+        self.FIREBASE_EMAIL = "bench@example.com"
+        self.FIREBASE_PASSWORD = "bench-password"
+        self.FIREBASE_API_KEY = "bench-api-key"
+        self.FIREBASE_PROJECT_ID = PROJECT_ID
+        self.FIRESTORE_COLLECTION = COLLECTION
+        self.LLM_API_KEY = "bench-llm-key"
+        self.LLM_STREAMING = "true"
+        self.TRACE_SAMPLE_RATE = "0"
+        # budgets far above the load, so scenarios measure the code paths and not the
+        # admission control; pass --var LLM_TPM_LIMIT=30000 to bench that instead
+        self.LLM_RPM_LIMIT = "100000"
+        self.LLM_TPM_LIMIT = "100000000"
+        self.LLM_MAX_BACKLOG = "100000"
+        for name, value in variables.items():
+            setattr(self, name, value)
+
+
+class BenchContext:
+    def waitUntil(self, promise):
+        # the fake js.Promise already scheduled the task on the event loop
+        pass
+
+    def passThroughOnException(self):
+        pass
+
+
+class BenchRequest:
+    def __init__(self, path, method="GET", body=None, headers=None):
+        self.url = "https://bench.local" + path
+        self.method = method
+        self.headers = workers.Headers(headers)
+        self._body = body
+
+    async def json(self):
+        return self._body
+
+
+def reset_isolate():
+    """
+    Drop the per-isolate singletons, so every scenario starts like a cold isolate.
+    """
+    from repositories import itinerary_repository
+    from services import (
+        admission_controller,
+        dedup_registry,
+        demand_tracker,
+        destination_index,
+        itinerary_service,
+        job_notifier,
+        job_queue,
+        llm_router,
+    )
+    from utils import cache, http_client, token_manager
+
+    http_client._http_client = None
+    token_manager._token_managers.clear()
+    cache._itinerary_cache = None
+    dedup_registry._dedup_registry = dedup_registry.DedupRegistry()
+    destination_index._destination_index = destination_index.DestinationIndex()
+    demand_tracker._demand_tracker = None
+    job_notifier._job_notifier = job_notifier.JobNotifier()
+    admission_controller._admission_controller = None
+    job_queue._in_memory_queue = None
+    itinerary_repository._itinerary_repository = None
+    itinerary_service._itinerary_service = None
+    llm_router._llm_router = None
+
+
+async def drain_background(timeout=120):
+    """
+    Wait for background jobs (ctx.waitUntil tasks) to finish.
+    """
+    deadline = time.time() + timeout
+    current = asyncio.current_task()
+    while time.time() < deadline:
+        pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+        if not pending:
+            return
+        await asyncio.wait(pending, timeout=deadline - time.time())
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class ScenarioResult:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.statuses = collections.Counter()
+        self.elapsed = 0.0
+        self.upstream_calls = {}
+        self.notes = {}
+
+    def record(self, latency_ms, status):
+        self.latencies.append(latency_ms)
+        self.statuses[status] += 1
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            "scenario": self.name,
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / self.elapsed, 1) if self.elapsed else None,
+            "p50_ms": round(percentile(latencies, 0.50), 2) if latencies else None,
+            "p95_ms": round(percentile(latencies, 0.95), 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+            "statuses": dict(self.statuses),
+            "upstream_calls": self.upstream_calls,
+            **self.notes,
+        }
+
+
+async def run_load(result, count, concurrency, operation):
+    """
+    Run operation(index) count times with at most `concurrency` in flight;
+    operation returns the status to record, its latency is measured here.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index):
+        async with semaphore:
+            started = time.perf_counter()
+            status = await operation(index)
+            result.record((time.perf_counter() - started) * 1000, status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[run(index) for index in range(count)])
+    result.elapsed = time.perf_counter() - started
+
+
+async def fetch(on_fetch, env, path, method="GET", body=None, headers=None):
+    response = await on_fetch(BenchRequest(path, method, body, headers), env, BenchContext())
+    return response
+
+
+async def scenario_create(on_fetch, upstream, env, args, result):
+    """
+    POST /create with a different destination every time.
+    """
+
+    async def operation(index):
+        body = {"destination": f"City {index}", "durationDays": args.days}
+        return (await fetch(on_fetch, env, "/create", "POST", body)).status
+
+    await run_load(result, args.requests, args.concurrency, operation)
+
+
+async def scenario_create_duplicate(on_fetch, upstream, env, args, result):
+    """
+    POST /create for the same trip from every client: dedup should make one LLM job.
+    """
+
+    async def operation(index):
+        body = {"destination": "Lisbon, Portugal", "durationDays": args.days}
+        return (await fetch(on_fetch, env, "/create", "POST", body)).status
+
+    await run_load(result, args.requests, args.concurrency, operation)
+
+
+async def scenario_poll_completed(on_fetch, upstream, env, args, result):
+    """
+    GET /itinerary for completed documents, the cacheable read path.
+    """
+    ids = [
+        upstream.firestore.add(COLLECTION, completed_document(f"City {index}", args.days), PROJECT_ID)
+        for index in range(args.documents)
+    ]
+
+    async def operation(index):
+        return (await fetch(on_fetch, env, f"/itinerary?id={random.choice(ids)}")).status
+
+    await run_load(result, args.requests, args.concurrency, operation)
+
+
+async def scenario_poll_processing(on_fetch, upstream, env, args, result):
+    """
+    GET /itinerary for jobs still running, the most common poll response.
+    """
+    fields = {
+        "destination": {"stringValue": "Kyoto, Japan"},
+        "durationDays": {"integerValue": str(args.days)},
+        "status": {"stringValue": "processing"},
+    }
+    ids = [upstream.firestore.add(COLLECTION, dict(fields), PROJECT_ID) for _ in range(args.documents)]
+
+    async def operation(index):
+        return (await fetch(on_fetch, env, f"/itinerary?id={random.choice(ids)}")).status
+
+    await run_load(result, args.requests, args.concurrency, operation)
+
+
+async def scenario_create_poll(on_fetch, upstream, env, args, result):
+    """
+    A client creating a trip and polling it until it is done; latency is time to completion.
+    """
+    poll_counts = []
+
+    async def operation(index):
+        body = {"destination": f"Town {index}", "durationDays": args.days}
+        response = await fetch(on_fetch, env, "/create", "POST", body)
+        if response.status not in (200, 202):
+            return response.status
+        created = json.loads(response.body)
+        if created["status"] in ("completed", "derived"):
+            # already done, nothing to poll
+            poll_counts.append(0)
+            return "completed"
+        document_id = created["id"]
+        polls = 0
+        while True:
+            polls += 1
+            response = await fetch(on_fetch, env, f"/itinerary?id={document_id}")
+            status = json.loads(response.body).get("status")
+            if status in ("completed", "failed"):
+                poll_counts.append(polls)
+                return status
+            await asyncio.sleep(args.poll_interval / 1000)
+
+    await run_load(result, args.requests, args.concurrency, operation)
+    result.notes["mean_polls"] = round(sum(poll_counts) / len(poll_counts), 1) if poll_counts else None
+
+
+SCENARIOS = {
+    "create": scenario_create,
+    "create_duplicate": scenario_create_duplicate,
+    "poll_completed": scenario_poll_completed,
+    "poll_processing": scenario_poll_processing,
+    "create_poll": scenario_create_poll,
+}
+
+
+def build_upstream(args):
+    auth = FakeFirebaseAuth(ServiceProfile(args.auth_latency, args.auth_latency / 4))
+    firestore = FakeFirestore(
+        ServiceProfile(args.firestore_latency, args.firestore_latency / 4, error_rate=args.error_rate),
+        auth=auth,
+    )
+    openai = FakeOpenAI(
+        ServiceProfile(
+            args.llm_latency,
+            args.llm_latency / 4,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+        )
+    )
+    return FakeUpstream(auth, firestore, openai)
+
+
+async def run_scenario(name, args):
+    import worker
+
+    reset_isolate()
+    upstream = build_upstream(args)
+    workers.set_fetch_handler(upstream)
+    env = BenchEnv(**dict(variable.split("=", 1) for variable in args.var))
+    result = ScenarioResult(name)
+    await SCENARIOS[name](worker.on_fetch, upstream, env, args, result)
+    await drain_background()
+    result.upstream_calls = upstream.calls()
+    return result
+
+
+def format_summary(summary):
+    calls = ", ".join(
+        f"{service}={sum(count for operation, count in operations.items() if not operation.startswith(('chat_', 'injected_')))}"
+        for service, operations in summary["upstream_calls"].items()
+    )
+    return (
+        f"{summary['scenario']:<18} n={summary['requests']:<5} {summary['throughput_rps'] or 0:>8.1f} req/s"
+        f"  p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms"
+        f"  statuses={summary['statuses']}  upstream: {calls}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--days", type=int, default=3, help="trip length of created itineraries")
+    parser.add_argument("--documents", type=int, default=50, help="documents seeded for poll scenarios")
+    parser.add_argument("--poll-interval", type=float, default=50, help="ms between polls in create_poll")
+    parser.add_argument("--auth-latency", type=float, default=40)
+    parser.add_argument("--firestore-latency", type=float, default=15)
+    parser.add_argument("--llm-latency", type=float, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 rate of Firestore and OpenAI")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429 rate of OpenAI")
+    parser.add_argument("--var", action="append", default=[], help="extra env variable, NAME=VALUE")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON summary per scenario")
+    parser.add_argument("--verbose", action="store_true", help="show the worker's own logs")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    summaries = []
+    for name in args.scenario:
+        # the worker logs with print, keep it out of the report unless asked for
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            summary = (await run_scenario(name, args)).summary()
+        summaries.append(summary)
+        print(json.dumps(summary) if args.json else format_summary(summary), flush=True)
+    return summaries
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
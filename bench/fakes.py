@@ -0,0 +1,406 @@
+"""
+Fake Firebase Auth, Firestore REST and OpenAI endpoints for the bench runtime.
+Each service has a ServiceProfile with its latency, error rate and 429 rate,
+and counts the calls it receives per operation.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import random
+import secrets
+import time
+from urllib.parse import parse_qs, urlparse
+
+from workers import FetchResponse
+
+from repositories.firestore_codec import decode_value, encode_value
+from services.llm_providers import fake_completion
+
+
+class ServiceProfile:
+    def __init__(self, latency_ms=20.0, jitter_ms=5.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+    async def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        await asyncio.sleep(max(0.0, latency) / 1000)
+
+    def fault(self):
+        """
+        return an injected error response, or None.
+        """
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return json_response(
+                429, {"error": {"message": "rate limited"}}, {"Retry-After": str(self.retry_after)}
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            return json_response(503, {"error": {"message": "injected failure"}})
+        return None
+
+
+def json_response(status, body, headers=None):
+    headers = dict(headers or {})
+    headers.setdefault("Content-Type", "application/json")
+    return FetchResponse(status, headers, json.dumps(body).encode("utf-8"))
+
+
+class FakeService:
+    name = "service"
+
+    def __init__(self, profile=None):
+        self.profile = profile or ServiceProfile()
+        self.calls = collections.Counter()
+
+    async def __call__(self, url, method, headers, body):
+        operation = self.operation(url, method)
+        self.calls[operation] += 1
+        await self.profile.delay()
+        fault = self.profile.fault()
+        if fault is not None:
+            self.calls["injected_" + str(fault.status)] += 1
+            return fault
+        return await self.handle(operation, url, method, headers, body)
+
+
+class FakeFirebaseAuth(FakeService):
+    name = "auth"
+
+    def __init__(self, profile=None, token_ttl=3600):
+        super().__init__(profile)
+        self.token_ttl = token_ttl
+        self.valid_tokens = set()
+
+    def operation(self, url, method):
+        return "signIn" if "signInWithPassword" in url else "refresh"
+
+    def issue(self):
+        id_token = "id-" + secrets.token_hex(8)
+        self.valid_tokens.add(id_token)
+        return id_token, "refresh-" + secrets.token_hex(8)
+
+    async def handle(self, operation, url, method, headers, body):
+        id_token, refresh_token = self.issue()
+        if operation == "signIn":
+            return json_response(
+                200, {"idToken": id_token, "refreshToken": refresh_token, "expiresIn": str(self.token_ttl)}
+            )
+        return json_response(
+            200, {"id_token": id_token, "refresh_token": refresh_token, "expires_in": str(self.token_ttl)}
+        )
+
+
+class FakeFirestore(FakeService):
+    """
+    In-memory Firestore REST API: create, get (with field masks), patch, commit,
+    runQuery and batchGet over a single database.
+    """
+
+    name = "firestore"
+
+    def __init__(self, profile=None, auth=None):
+        super().__init__(profile)
+        self.auth = auth
+        self.documents = {}
+        self._ids = itertools.count(1)
+
+    def operation(self, url, method):
+        path = urlparse(url).path
+        for suffix in (":commit", ":runQuery", ":batchGet"):
+            if path.endswith(suffix):
+                return suffix[1:]
+        if method == "POST":
+            return "create"
+        return method.lower()
+
+    def now(self):
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + f".{int(time.time() * 1e6) % 1000000:06d}Z"
+
+    def put(self, name, fields):
+        existing = self.documents.get(name)
+        now = self.now()
+        self.documents[name] = {
+            "name": name,
+            "fields": fields,
+            "createTime": existing["createTime"] if existing else now,
+            "updateTime": now,
+        }
+        return self.documents[name]
+
+    def add(self, collection, fields, project_id="bench", document_id=None):
+        """
+        Seed a document. return its id.
+        """
+        document_id = document_id or f"doc{next(self._ids):06d}"
+        self.put(f"projects/{project_id}/databases/(default)/documents/{collection}/{document_id}", fields)
+        return document_id
+
+    async def handle(self, operation, url, method, headers, body):
+        if self.auth is not None:
+            token = headers.get("Authorization", "").replace("Bearer ", "")
+            if token not in self.auth.valid_tokens:
+                return json_response(401, {"error": {"status": "UNAUTHENTICATED"}})
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        name = parsed.path.split("/v1/", 1)[1]
+        # documents:runQuery and friends: the parent is the path without the method
+        if name.endswith(":" + operation):
+            name = name[: -len(operation) - 1]
+        payload = json.loads(body) if body else {}
+        return getattr(self, "handle_" + operation)(name, query, payload)
+
+    def handle_create(self, name, query, payload):
+        document_id = "".join(random.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(20))
+        return json_response(200, self.put(f"{name}/{document_id}", payload.get("fields", {})))
+
+    def handle_get(self, name, query, payload):
+        document = self.documents.get(name)
+        if document is None:
+            return json_response(404, {"error": {"status": "NOT_FOUND"}})
+        return json_response(200, self.project(document, query.get("mask.fieldPaths")))
+
+    def handle_patch(self, name, query, payload):
+        fields = payload.get("fields", {})
+        mask = query.get("updateMask.fieldPaths")
+        existing = self.documents.get(name)
+        merged = dict(existing["fields"]) if existing and mask else {}
+        for field in mask or fields:
+            if field in fields:
+                merged[field] = fields[field]
+            else:
+                merged.pop(field, None)
+        return json_response(200, self.put(name, merged))
+
+    def handle_commit(self, name, query, payload):
+        writes = payload.get("writes", [])
+        for write in writes:
+            document_name = write["update"]["name"]
+            precondition = write.get("currentDocument", {})
+            exists = document_name in self.documents
+            if "exists" in precondition and precondition["exists"] != exists:
+                status = 409 if exists else 404
+                return json_response(status, {"error": {"status": "FAILED_PRECONDITION"}})
+            if "updateTime" in precondition and (
+                not exists or self.documents[document_name]["updateTime"] != precondition["updateTime"]
+            ):
+                return json_response(400, {"error": {"status": "FAILED_PRECONDITION"}})
+        for write in writes:
+            document_name = write["update"]["name"]
+            fields = write["update"].get("fields", {})
+            mask = write.get("updateMask", {}).get("fieldPaths")
+            merged = dict(self.documents[document_name]["fields"]) if mask and document_name in self.documents else {}
+            for field in mask or fields:
+                if field in fields:
+                    merged[field] = fields[field]
+                else:
+                    merged.pop(field, None)
+            for transform in write.get("updateTransforms", []):
+                current = int(merged.get(transform["fieldPath"], {}).get("integerValue", 0))
+                merged[transform["fieldPath"]] = {
+                    "integerValue": current + int(transform["increment"]["integerValue"])
+                }
+            self.put(document_name, merged)
+        return json_response(200, {"writeResults": [{"updateTime": self.now()} for _ in writes]})
+
+    def handle_batchGet(self, name, query, payload):
+        rows = []
+        for document_name in payload.get("documents", []):
+            document = self.documents.get(document_name)
+            if document is None:
+                rows.append({"missing": document_name, "readTime": self.now()})
+            else:
+                rows.append({"found": self.project(document, payload.get("mask", {}).get("fieldPaths")), "readTime": self.now()})
+        return json_response(200, rows)
+
+    def handle_runQuery(self, name, query, payload):
+        structured_query = payload["structuredQuery"]
+        collection = structured_query["from"][0]["collectionId"]
+        prefix = f"{name}/{collection}/"
+        documents = [
+            document
+            for document_name, document in self.documents.items()
+            if document_name.startswith(prefix) and "/" not in document_name[len(prefix):]
+        ]
+        where = structured_query.get("where")
+        if where:
+            documents = [document for document in documents if self.matches(document, where)]
+
+        order_by = list(structured_query.get("orderBy", []))
+        if not any(order["field"]["fieldPath"] == "__name__" for order in order_by):
+            direction = order_by[-1].get("direction", "ASCENDING") if order_by else "ASCENDING"
+            order_by.append({"field": {"fieldPath": "__name__"}, "direction": direction})
+        for order in reversed(order_by):
+            documents.sort(
+                key=lambda document: sort_key(self.value(document, order["field"]["fieldPath"])),
+                reverse=order.get("direction", "ASCENDING") == "DESCENDING",
+            )
+
+        start_at = structured_query.get("startAt")
+        if start_at:
+            cursor = [sort_key(decode_value(value)) for value in start_at["values"]]
+            inclusive = start_at.get("before", False)
+
+            def after_cursor(document):
+                for order, cursor_value in zip(order_by, cursor):
+                    value = sort_key(self.value(document, order["field"]["fieldPath"]))
+                    if value != cursor_value:
+                        descending = order.get("direction", "ASCENDING") == "DESCENDING"
+                        return (value < cursor_value) if descending else (value > cursor_value)
+                return inclusive
+
+            documents = [document for document in documents if after_cursor(document)]
+
+        offset = structured_query.get("offset", 0)
+        limit = structured_query.get("limit")
+        if isinstance(limit, dict):
+            limit = limit.get("value")
+        documents = documents[offset: offset + limit if limit is not None else None]
+
+        fields = [field["fieldPath"] for field in structured_query.get("select", {}).get("fields", [])]
+        rows = [
+            {"document": self.project(document, fields or None), "readTime": self.now()}
+            for document in documents
+        ]
+        return json_response(200, rows or [{"readTime": self.now()}])
+
+    def value(self, document, field_path):
+        if field_path == "__name__":
+            return document["name"]
+        value = document["fields"].get(field_path)
+        return decode_value(value) if value is not None else None
+
+    def matches(self, document, where):
+        if "compositeFilter" in where:
+            results = [self.matches(document, condition) for condition in where["compositeFilter"]["filters"]]
+            return all(results) if where["compositeFilter"].get("op", "AND") == "AND" else any(results)
+        field_filter = where["fieldFilter"]
+        value = self.value(document, field_filter["field"]["fieldPath"])
+        if value is None:
+            return False
+        expected = decode_value(field_filter["value"])
+        op = field_filter["op"]
+        if op == "IN":
+            return value in expected
+        return {
+            "EQUAL": lambda: value == expected,
+            "NOT_EQUAL": lambda: value != expected,
+            "LESS_THAN": lambda: value < expected,
+            "LESS_THAN_OR_EQUAL": lambda: value <= expected,
+            "GREATER_THAN": lambda: value > expected,
+            "GREATER_THAN_OR_EQUAL": lambda: value >= expected,
+        }[op]()
+
+    def project(self, document, field_paths):
+        if not field_paths:
+            return document
+        return {
+            **document,
+            "fields": {key: value for key, value in document["fields"].items() if key in field_paths},
+        }
+
+
+def sort_key(value):
+    # None sorts first, like Firestore's null ordering
+    return (value is not None, value if value is not None else 0)
+
+
+class FakeOpenAI(FakeService):
+    """
+    Chat completions returning a valid itinerary for the destination, duration
+    and day range found in the prompt, as JSON or as an SSE stream.
+    """
+
+    name = "openai"
+
+    def __init__(self, profile=None, stream_chunk_ms=2.0, chunk_chars=40):
+        super().__init__(profile)
+        self.stream_chunk_ms = stream_chunk_ms
+        self.chunk_chars = chunk_chars
+
+    def operation(self, url, method):
+        return "chat"
+
+    async def handle(self, operation, url, method, headers, body):
+        payload = json.loads(body)
+        prompt = "\n".join(message["content"] for message in payload["messages"])
+        content = self.completion(prompt)
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+        if not payload.get("stream"):
+            self.calls["chat_json"] += 1
+            return json_response(200, {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": usage})
+        self.calls["chat_stream"] += 1
+        return FetchResponse(200, {"Content-Type": "text/event-stream"}, self.stream(content, usage))
+
+    async def stream(self, content, usage):
+        for start in range(0, len(content), self.chunk_chars):
+            await asyncio.sleep(self.stream_chunk_ms / 1000)
+            event = {"choices": [{"delta": {"content": content[start: start + self.chunk_chars]}}]}
+            yield f"data: {json.dumps(event)}\n\n".encode("utf-8")
+        yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8")
+        yield b"data: [DONE]\n\n"
+
+    def completion(self, prompt):
+        return fake_completion(prompt)
+
+
+class FakeUpstream:
+    """
+    Routes workers.fetch to the fake services by host.
+    """
+
+    def __init__(self, auth=None, firestore=None, openai=None):
+        self.auth = auth or FakeFirebaseAuth()
+        self.firestore = firestore or FakeFirestore(auth=self.auth)
+        self.openai = openai or FakeOpenAI()
+
+    async def __call__(self, url, method, headers, body):
+        host = urlparse(url).netloc
+        if host in ("identitytoolkit.googleapis.com", "securetoken.googleapis.com"):
+            return await self.auth(url, method, headers, body)
+        if host == "firestore.googleapis.com":
+            return await self.firestore(url, method, headers, body)
+        if host == "api.openai.com":
+            return await self.openai(url, method, headers, body)
+        return json_response(404, {"error": f"no fake for {host}"})
+
+    def calls(self):
+        return {
+            service.name: dict(service.calls)
+            for service in (self.auth, self.firestore, self.openai)
+        }
+
+    def reset_calls(self):
+        for service in (self.auth, self.firestore, self.openai):
+            service.calls.clear()
+
+
+def completed_document(destination, duration_days, created_at=None):
+    """
+    Fields of a completed itinerary document, for seeding the fake Firestore.
+    """
+    days = [
+        {
+            "day": day,
+            "theme": f"{destination} day {day}",
+            "activities": [{"time": "Morning", "description": f"Visit {destination} {day}", "location": destination}],
+        }
+        for day in range(1, duration_days + 1)
+    ]
+    now = created_at or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return {
+        "destination": encode_value(destination),
+        "durationDays": encode_value(duration_days),
+        "status": encode_value("completed"),
+        "itineraries": encode_value(days),
+        "createdAt": {"timestampValue": now},
+        "completedAt": {"timestampValue": now},
+    }
@@ -0,0 +1,61 @@
+"""
+Stand-in for the Pyodide `js` module: the few JS globals the worker touches.
+"""
+
+
+class Promise:
+    @staticmethod
+    def new(executor):
+        # the worker only wraps asyncio tasks, which already run on the event loop
+        executor(lambda value=None: None, lambda error=None: None)
+        return None
+
+
+class Object:
+    @staticmethod
+    def fromEntries(entries):
+        return dict(entries)
+
+
+class TextEncoder:
+    @staticmethod
+    def new():
+        return TextEncoder()
+
+    def encode(self, text):
+        return text.encode("utf-8")
+
+
+class _Writer:
+    def __init__(self, readable):
+        self._readable = readable
+
+    async def write(self, chunk):
+        self._readable.chunks.append(bytes(chunk))
+
+    async def close(self):
+        self._readable.closed = True
+
+
+class _Readable:
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+
+class _Writable:
+    def __init__(self, readable):
+        self._writer = _Writer(readable)
+
+    def getWriter(self):
+        return self._writer
+
+
+class TransformStream:
+    @staticmethod
+    def new():
+        return TransformStream()
+
+    def __init__(self):
+        self.readable = _Readable()
+        self.writable = _Writable(self.readable)
@@ -0,0 +1,126 @@
+"""
+Stand-in for the Cloudflare `workers` module, enough to run the worker under CPython.
+fetch() is answered by the handler installed with set_fetch_handler().
+"""
+import json
+
+_fetch_handler = None
+
+
+def set_fetch_handler(fetch_handler):
+    """
+    Route fetch() to `fetch_handler(url, method, headers, body)`, which returns a FetchResponse.
+    """
+    global _fetch_handler
+    _fetch_handler = fetch_handler
+
+
+def handler(function):
+    return function
+
+
+class Headers:
+    def __init__(self, headers=None):
+        self._headers = {}
+        for key, value in (headers or {}).items():
+            self.set(key, value)
+
+    def set(self, key, value):
+        self._headers[key.lower()] = str(value)
+
+    def get(self, key, default=None):
+        return self._headers.get(key.lower(), default)
+
+    def entries(self):
+        return list(self._headers.items())
+
+    def __contains__(self, key):
+        return key.lower() in self._headers
+
+    def __repr__(self):
+        return repr(self._headers)
+
+
+class _Bytes:
+    def __init__(self, data):
+        self._data = data
+
+    def to_bytes(self):
+        return self._data
+
+
+class _ReadResult:
+    def __init__(self, value):
+        self.done = value is None
+        self.value = _Bytes(value)
+
+
+class _Reader:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def read(self):
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return _ReadResult(None)
+        return _ReadResult(chunk)
+
+
+class _Body:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def getReader(self):
+        return _Reader(self._chunks)
+
+
+class _JSResponse:
+    def __init__(self, headers, body, chunks):
+        self.headers = headers
+        self._body = body
+        self.body = _Body(chunks)
+
+    async def arrayBuffer(self):
+        if self._body is None:
+            return _Bytes(b"".join([chunk async for chunk in self.body._chunks]))
+        return _Bytes(self._body)
+
+
+class FetchResponse:
+    """
+    What workers.fetch returns: status plus the JS response under js_object.
+    body is bytes, or an async iterator of byte chunks for streamed bodies.
+    """
+
+    def __init__(self, status=200, headers=None, body=b""):
+        self.status = status
+        self.headers = Headers(headers)
+        if isinstance(body, (bytes, bytearray)):
+            chunks = _once(bytes(body))
+            self.js_object = _JSResponse(self.headers, bytes(body), chunks)
+        else:
+            self.js_object = _JSResponse(self.headers, None, body)
+
+    async def json(self):
+        return json.loads((await self.js_object.arrayBuffer()).to_bytes())
+
+    async def text(self):
+        return (await self.js_object.arrayBuffer()).to_bytes().decode("utf-8")
+
+
+async def _once(data):
+    yield data
+
+
+class Response:
+    def __init__(self, body=None, status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = Headers(headers)
+
+
+async def fetch(url, method="GET", headers=None, body=None, **options):
+    if _fetch_handler is None:
+        raise RuntimeError("no fetch handler installed, call workers.set_fetch_handler()")
+    return await _fetch_handler(url, method, dict(headers or {}), body)
@@ -1,5 +1,17 @@
 from .itineraries_prompt import get_itineraries_prompt
+from .prompt_engine import (
+    build_itinerary_messages,
+    build_outline_messages,
+    compute_max_tokens,
+    compute_outline_max_tokens,
+    get_prompt_version,
+)
 
 __all__ = [
+    "build_itinerary_messages",
+    "build_outline_messages",
+    "compute_max_tokens",
+    "compute_outline_max_tokens",
     "get_itineraries_prompt",
-]
\ No newline at end of file
+    "get_prompt_version",
+]
@@ -0,0 +1,96 @@
+import hashlib
+from string import Template
+from .itineraries_prompt import get_itineraries_prompt
+
+# Everything in the itinerary prompt except the request itself. Sent as a fixed
+# system message so every request starts with the same cacheable prefix.
+SYSTEM_PROMPT = get_itineraries_prompt().split("**Destination:**")[0].strip().rstrip("-").strip()
+
+USER_TEMPLATE = Template("**Destination:** $destination\n**Duration:** $duration days")
+
+SCOPE_TEMPLATE = Template(
+    "\n\n## Scope:\nThis request covers only days $first_day to $last_day of the $duration-day trip. "
+    "Return exactly $count day objects numbered $first_day to $last_day."
+)
+
+OUTLINE_SCOPE = (
+    "\nThe whole trip follows this outline. Follow it for your days and do not "
+    "include attractions planned for the other days:\n"
+)
+
+NO_OUTLINE_SCOPE = "\nThe other days are planned separately, focus on attractions that fit these days only."
+
+OUTLINE_TEMPLATE = Template(
+    "Plan the outline of a $duration-day trip to $destination. "
+    "Give every day a distinct theme and 2-3 distinct highlight attractions, "
+    "never repeating an attraction across days, and keep nearby places on the same day. "
+    "Return only a JSON array, no other text: "
+    '[{"day": 1, "theme": "...", "highlights": ["...", "..."]}]'
+)
+
+# completion budget: a fixed allowance plus a per-day share, capped below gpt-4o's output limit
+BASE_COMPLETION_TOKENS = 150
+TOKENS_PER_DAY = 450
+OUTLINE_TOKENS_PER_DAY = 60
+MAX_COMPLETION_TOKENS = 16000
+
+PROMPT_VERSION = hashlib.sha256(
+    "\n".join(
+        [
+            SYSTEM_PROMPT,
+            USER_TEMPLATE.template,
+            SCOPE_TEMPLATE.template,
+            OUTLINE_SCOPE,
+            NO_OUTLINE_SCOPE,
+            OUTLINE_TEMPLATE.template,
+        ]
+    ).encode("utf-8")
+).hexdigest()[:12]
+
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def get_prompt_version():
+    """
+    Short hash of all prompt templates, changes whenever any prompt text changes.
+    """
+    return PROMPT_VERSION
+
+
+def compute_max_tokens(duration_days):
+    return min(MAX_COMPLETION_TOKENS, BASE_COMPLETION_TOKENS + TOKENS_PER_DAY * int(duration_days))
+
+
+def build_itinerary_messages(destination, duration_days, day_range=None, outline=None):
+    """
+    Build the chat messages for an itinerary: the fixed system message and a
+    small user message. day_range limits the request to (first_day, last_day)
+    of the trip, with the trip outline as context when there is one.
+    """
+    content = USER_TEMPLATE.substitute(destination=destination, duration=duration_days)
+    if day_range:
+        first_day, last_day = day_range
+        content += SCOPE_TEMPLATE.substitute(
+            first_day=first_day,
+            last_day=last_day,
+            duration=duration_days,
+            count=last_day - first_day + 1,
+        )
+        if outline:
+            content += OUTLINE_SCOPE + "\n".join(
+                f"- Day {day.get('day')}: {day.get('theme', '')} "
+                f"({', '.join(str(highlight) for highlight in day.get('highlights', []))})"
+                for day in outline
+            )
+        else:
+            content += NO_OUTLINE_SCOPE
+    return [SYSTEM_MESSAGE, {"role": "user", "content": content}]
+
+
+def build_outline_messages(destination, duration_days):
+    content = OUTLINE_TEMPLATE.substitute(destination=destination, duration=duration_days)
+    return [{"role": "user", "content": content}]
+
+
+def compute_outline_max_tokens(duration_days):
+    return min(MAX_COMPLETION_TOKENS, 100 + OUTLINE_TOKENS_PER_DAY * int(duration_days))
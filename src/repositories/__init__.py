@@ -1,3 +1,23 @@
-from .itinerary_repository import ItineraryRepository
+from .firestore_codec import (
+    decode_fields,
+    decode_itinerary,
+    decode_itinerary_fields,
+    decode_value,
+    encode_fields,
+    encode_itinerary,
+    encode_value,
+)
+from .itinerary_repository import InvalidPageToken, ItineraryRepository, get_itinerary_repository
 
-__all__ = ["ItineraryRepository"]
\ No newline at end of file
+__all__ = [
+    "InvalidPageToken",
+    "ItineraryRepository",
+    "decode_fields",
+    "decode_itinerary",
+    "decode_itinerary_fields",
+    "decode_value",
+    "encode_fields",
+    "encode_itinerary",
+    "encode_value",
+    "get_itinerary_repository",
+]
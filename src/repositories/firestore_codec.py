@@ -0,0 +1,144 @@
+import base64
+import json
+import zlib
+from datetime import datetime, timezone
+
+# itinerariesFormat of a stored itinerary: a JSON string (documents older than the
+# field), a native Firestore array, or zlib-compressed compact JSON in a bytesValue
+ITINERARY_FORMAT_JSON = 0
+ITINERARY_FORMAT_NATIVE = 1
+ITINERARY_FORMAT_ZLIB = 2
+# ITINERARY_STORAGE value -> format written
+ITINERARY_STORAGE_FORMATS = {"native": ITINERARY_FORMAT_NATIVE, "zlib": ITINERARY_FORMAT_ZLIB}
+COMPRESSION_LEVEL = 6
+
+
+def _encode_datetime(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return {"timestampValue": value.isoformat(timespec="microseconds") + "Z"}
+
+
+def _encode_list(value):
+    return {"arrayValue": {"values": [encode_value(item) for item in value]}}
+
+
+def _encode_dict(value):
+    return {"mapValue": {"fields": {key: encode_value(item) for key, item in value.items()}}}
+
+
+# dispatch on the exact type: bool is a subclass of int, so isinstance order would matter
+_ENCODERS = {
+    str: lambda value: {"stringValue": value},
+    bool: lambda value: {"booleanValue": value},
+    int: lambda value: {"integerValue": str(value)},
+    float: lambda value: {"doubleValue": value},
+    type(None): lambda value: {"nullValue": None},
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+    bytes: lambda value: {"bytesValue": base64.b64encode(value).decode("ascii")},
+    datetime: _encode_datetime,
+}
+
+
+def encode_value(value):
+    """
+    Convert a Python value to a Firestore typed value, e.g. 7 -> {"integerValue": "7"}.
+    """
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        for value_type, candidate in _ENCODERS.items():
+            if isinstance(value, value_type):
+                encoder = candidate
+                break
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__} as a Firestore value")
+    return encoder(value)
+
+
+def encode_fields(values):
+    """
+    Convert a dict of Python values to a Firestore document "fields" object.
+    """
+    return {key: encode_value(value) for key, value in values.items()}
+
+
+def _decode_timestamp(value):
+    # Firestore sends up to nanosecond precision, datetime keeps microseconds
+    date, _, fraction = value.rstrip("Z").partition(".")
+    parsed = datetime.strptime(date, "%Y-%m-%dT%H:%M:%S")
+    if fraction:
+        parsed = parsed.replace(microsecond=int(fraction[:6].ljust(6, "0")))
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+_DECODERS = {
+    "stringValue": lambda value: value,
+    "integerValue": int,
+    "doubleValue": float,
+    "booleanValue": lambda value: value,
+    "nullValue": lambda value: None,
+    "arrayValue": lambda value: [decode_value(item) for item in value.get("values", ())],
+    "mapValue": lambda value: decode_fields(value.get("fields", {})),
+    "timestampValue": _decode_timestamp,
+    "bytesValue": base64.b64decode,
+    "referenceValue": lambda value: value,
+    "geoPointValue": lambda value: value,
+}
+
+
+def decode_value(value):
+    """
+    Convert a Firestore typed value back to a Python value.
+    """
+    for kind, item in value.items():
+        return _DECODERS[kind](item)
+    return None
+
+
+def decode_fields(fields):
+    """
+    Convert a Firestore document "fields" object to a dict of Python values.
+    """
+    return {key: decode_value(value) for key, value in fields.items()}
+
+
+def encode_itinerary(days, format_version=ITINERARY_FORMAT_NATIVE):
+    """
+    Fields storing an itinerary: "itineraries" and its "itinerariesFormat".
+    """
+    if format_version == ITINERARY_FORMAT_ZLIB:
+        data = json.dumps(days, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        itineraries = encode_value(zlib.compress(data, COMPRESSION_LEVEL))
+    elif format_version == ITINERARY_FORMAT_NATIVE:
+        itineraries = encode_value(days)
+    else:
+        raise ValueError(f"Cannot write itinerary format {format_version}")
+    return {"itineraries": itineraries, "itinerariesFormat": encode_value(format_version)}
+
+
+def decode_itinerary(value, format_version=None):
+    """
+    Decode a stored itinerary: a native array, the JSON string older documents hold,
+    or compressed bytes (format_version from the itinerariesFormat field).
+    """
+    if value is None:
+        return None
+    if "stringValue" in value:
+        return json.loads(value["stringValue"])
+    if "bytesValue" in value:
+        if format_version not in (None, ITINERARY_FORMAT_ZLIB):
+            raise ValueError(f"Unknown itinerary format {format_version}")
+        return json.loads(zlib.decompress(base64.b64decode(value["bytesValue"])))
+    return decode_value(value)
+
+
+def decode_itinerary_fields(fields):
+    """
+    Decode the itinerary of a document's fields, None when it has none.
+    """
+    format_version = fields.get("itinerariesFormat")
+    return decode_itinerary(
+        fields.get("itineraries"), decode_value(format_version) if format_version is not None else None
+    )
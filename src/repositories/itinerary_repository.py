@@ -1,46 +1,104 @@
+import base64
+import hashlib
 import json
+import secrets
+import string
 import traceback
-from workers import handler, fetch, Response
+from utils.http_client import HttpError, get_http_client
+from utils.token_manager import get_token_manager
+from .firestore_codec import ITINERARY_STORAGE_FORMATS, encode_itinerary
+from .write_buffer import WriteBuffer
+
+
+AUTO_ID_ALPHABET = string.ascii_letters + string.digits
+# fields of a listed itinerary; the itinerary itself is only read on request
+LIST_FIELDS = [
+    "status",
+    "destination",
+    "durationDays",
+    "daysGenerated",
+    "error",
+    "createdAt",
+    "updatedAt",
+    "completedAt",
+    "derivedFrom",
+    "pregenerated",
+]
+ITINERARY_BODY_FIELDS = ["itineraries", "itinerariesFormat"]
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def generate_document_id():
+    """
+    Generate a 20 character id like Firestore's auto ids, for writes that need the name upfront.
+    """
+    return "".join(secrets.choice(AUTO_ID_ALPHABET) for _ in range(20))
 
 
 class ItineraryRepository:
-    
-    async def insert_document(self, id_token, project_id, collection, document):
+
+    def __init__(self, token_manager=None, http_client=None, itinerary_storage="native"):
+        if itinerary_storage not in ITINERARY_STORAGE_FORMATS:
+            raise ValueError(f"Unknown ITINERARY_STORAGE {itinerary_storage!r}")
+        self.token_manager = token_manager
+        self.http_client = http_client or get_http_client()
+        self.itinerary_format = ITINERARY_STORAGE_FORMATS[itinerary_storage]
+
+    def itinerary_fields(self, days):
         """
-        Insert a document into Firestore using the provided ID token.
+        Fields to write an itinerary in the configured storage format; reads accept every format.
         """
-        url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents/{collection}"
+        return encode_itinerary(days, self.itinerary_format)
 
+    async def _request(self, method, url, id_token, body=None, **options):
+        """
+        Send a Firestore request with the idToken. When a token manager is set and
+        Firestore answers 401, the token is invalidated and the call retried once.
+        """
         headers = {
             "Authorization": f"Bearer {id_token}",
             "Content-Type": "application/json",
         }
+        try:
+            return await self.http_client.request(method, url, headers=headers, body=body, **options)
+        except HttpError as e:
+            if e.status != 401 or self.token_manager is None:
+                raise
+            self.token_manager.invalidate(id_token)
+            id_token = await self.token_manager.get_id_token()
+            if not id_token:
+                raise
+        headers["Authorization"] = f"Bearer {id_token}"
+        return await self.http_client.request(method, url, headers=headers, body=body, **options)
+
+    async def insert_document(self, id_token, project_id, collection, document):
+        """
+        Insert a document into Firestore using the provided ID token.
+        """
+        url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents/{collection}"
 
         data = json.dumps(document, ensure_ascii=True).encode("utf-8")
 
         try:
-            resp = await fetch(
-                url,
-                method="POST",
-                headers=headers,
-                body=data,
+            # not idempotent: a retried POST would create a second document
+            resp = await self._request(
+                "POST", url, id_token, body=data, timeout=10, endpoint="firestore.insert"
             )
-            if resp.status != 200:
-                print("insert_document Error:", json.dumps(await resp.json()))
-                return None
-
-            identity_response = await resp.json()
-            print("Identity Response:", identity_response)
-            name = identity_response.get("name")
+            name = resp.json().get("name")
             if not name:
                 raise ValueError("Document ID not found in response")
             doc_id = name.split("/")[-1]  # Extract the document ID from the name
 
             return doc_id
+        except HttpError as e:
+            print("insert_document Error:", e.status, e.body)
+            return None
         except Exception as e:
             print("insert_document Error:", traceback.format_exc())
             raise
-            # return {"error": str(e)}
 
 
     async def update_document(self, id_token, project_id, collection, document_id, fields):
@@ -50,63 +108,338 @@ class ItineraryRepository:
         """
         url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents/{collection}/{document_id}"
 
-        headers = {
-            "Authorization": f"Bearer {id_token}",
-            "Content-Type": "application/json",
-        }
-
         data = json.dumps({"fields": fields}).encode("utf-8")
         field_paths = list(fields.keys())
         update_mask = "&".join([f"updateMask.fieldPaths={field}" for field in field_paths])
-        
+
         url_with_mask = f"{url}?{update_mask}"
-        
+
         try:
-            resp = await fetch(
-                url_with_mask,
-                method="PATCH",
-                headers=headers,
-                body=data,
+            resp = await self._request(
+                "PATCH", url_with_mask, id_token, body=data, timeout=10, endpoint="firestore.update"
             )
-            if resp.status != 200:
-                print("update_document Error:", await resp.json())
-                print(
-                    f"update_document parameters: \nupdates: {fields}\nurl: {url}\nheaders: {headers}"
-                )
-                return None
+            return resp.json()
+        except Exception as e:
+            print("update_document Error:", traceback.format_exc())
+            print(f"update_document parameters: \nfields: {field_paths}\nurl: {url}")
+            return None
 
-            identity_response = await resp.json()
 
-            return identity_response
-        except Exception as e:
-            print("update_document URLError:", traceback.format_exc())
-            return {"error": str(e)}
+    async def commit_updates(self, id_token, project_id, collection, updates):
+        """
+        Apply field updates to several existing documents in one atomic Firestore commit.
+        updates is a dict of document id to fields; only those fields are written (updateMask)
+        and a document that does not exist anymore is not recreated.
+        return True when the commit succeeded.
+        """
+        database = f"projects/{project_id}/databases/(default)"
+        url = f"https://firestore.googleapis.com/v1/{database}/documents:commit"
+
+        writes = [
+            {
+                "update": {
+                    "name": f"{database}/documents/{collection}/{document_id}",
+                    "fields": fields,
+                },
+                "updateMask": {"fieldPaths": list(fields.keys())},
+                "currentDocument": {"exists": True},
+            }
+            for document_id, fields in updates.items()
+        ]
+        data = json.dumps({"writes": writes}, ensure_ascii=True).encode("utf-8")
 
+        try:
+            # setting the same field values twice is harmless, so retries are safe
+            await self._request(
+                "POST", url, id_token, body=data, timeout=10, idempotent=True, endpoint="firestore.commit"
+            )
+            return True
+        except HttpError as e:
+            print("commit_updates Error:", e.status, e.body)
+            return False
 
-    async def get_document(self, id_token, project_id, collection, document_id):
+    async def claim_document(self, id_token, project_id, collection, document_id, fields, update_time):
         """
-        Retrieve a document from Firestore using the provided ID token.
+        Write fields to a document only if it is unchanged since update_time
+        (currentDocument.updateTime precondition), so of two writers racing for
+        the same version only one wins.
+        return True when the write won, False when the document changed or is gone.
         """
-        url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents/{collection}/{document_id}"
+        database = f"projects/{project_id}/databases/(default)"
+        url = f"https://firestore.googleapis.com/v1/{database}/documents:commit"
 
-        headers = {
-            "Authorization": f"Bearer {id_token}",
-            "Content-Type": "application/json",
+        write = {
+            "update": {
+                "name": f"{database}/documents/{collection}/{document_id}",
+                "fields": fields,
+            },
+            "updateMask": {"fieldPaths": list(fields.keys())},
+            "currentDocument": {"updateTime": update_time},
         }
+        data = json.dumps({"writes": [write]}, ensure_ascii=True).encode("utf-8")
+
+        try:
+            # a retry after a lost response fails the precondition against our own write,
+            # so claims are not retried
+            await self._request(
+                "POST", url, id_token, body=data, timeout=10, idempotent=False, endpoint="firestore.claim"
+            )
+            return True
+        except HttpError as e:
+            if e.status in (400, 404, 409):
+                return False
+            raise
+
+    async def increment_documents(self, id_token, project_id, collection, updates):
+        """
+        Add to counter fields of several documents with one commit, creating the
+        documents that do not exist. updates is a list of (document_id, fields, increments)
+        tuples: fields are set, each increments[field] is added server-side to the field.
+        return True when the commit succeeded.
+        """
+        database = f"projects/{project_id}/databases/(default)"
+        url = f"https://firestore.googleapis.com/v1/{database}/documents:commit"
+
+        writes = [
+            {
+                "update": {
+                    "name": f"{database}/documents/{collection}/{document_id}",
+                    "fields": fields,
+                },
+                "updateMask": {"fieldPaths": list(fields.keys())},
+                "updateTransforms": [
+                    {"fieldPath": field, "increment": {"integerValue": amount}}
+                    for field, amount in increments.items()
+                ],
+            }
+            for document_id, fields, increments in updates
+        ]
+        data = json.dumps({"writes": writes}, ensure_ascii=True).encode("utf-8")
+
+        try:
+            # increments are not idempotent: a retry after a lost response would count twice
+            await self._request(
+                "POST", url, id_token, body=data, timeout=10, idempotent=False, endpoint="firestore.increment"
+            )
+            return True
+        except HttpError as e:
+            print("increment_documents Error:", e.status, e.body)
+            return False
+
+    def write_buffer(self, id_token, project_id, collection):
+        """
+        return a WriteBuffer that coalesces updates to documents of the collection.
+        """
+        return WriteBuffer(self, id_token, project_id, collection)
+
+
+    async def get_document(self, id_token, project_id, collection, document_id, field_paths=None):
+        """
+        Retrieve a document from Firestore using the provided ID token.
+        field_paths limits the returned fields (mask.fieldPaths); fields missing in the document are omitted.
+        return None when the document does not exist; other failures raise HttpError.
+        """
+        url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents/{collection}/{document_id}"
+        if field_paths:
+            url += "?" + "&".join(f"mask.fieldPaths={field}" for field in field_paths)
 
         try:
-            resp = await fetch(
-                url,
-                method="GET",
-                headers=headers,
+            resp = await self._request(
+                "GET", url, id_token, timeout=10, hedge=True, endpoint="firestore.get"
             )
-            if resp.status != 200:
-                print("get_document Error:", resp.body)
+            return resp.json()
+        except HttpError as e:
+            if e.status == 404:
                 return None
+            print("get_document Error:", e.status, e.body)
+            raise
+
+
+    async def run_query(self, id_token, project_id, collection, structured_query):
+        """
+        Run a Firestore structured query against the collection.
+        structured_query is the structuredQuery body without the "from" clause.
+        return the list of matching documents.
+        """
+        url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents:runQuery"
 
-            itinerary_response = await resp.json()
+        query = dict(structured_query)
+        query["from"] = [{"collectionId": collection}]
+        data = json.dumps({"structuredQuery": query}).encode("utf-8")
 
-            return itinerary_response
+        try:
+            # read-only, so safe to retry
+            resp = await self._request(
+                "POST", url, id_token, body=data, timeout=15, idempotent=True, endpoint="firestore.runQuery"
+            )
+            return [row["document"] for row in resp.json() if "document" in row]
         except Exception as e:
-            print("get_document URLError:", traceback.format_exc())
-            return {"error": str(e)}
\ No newline at end of file
+            print("run_query Error:", traceback.format_exc())
+            raise
+
+
+    async def list_documents(
+        self,
+        id_token,
+        project_id,
+        collection,
+        status=None,
+        destination_key=None,
+        since=None,
+        page_size=50,
+        page_token=None,
+        include_itinerary=False,
+    ):
+        """
+        One page of the documents of the collection, newest first, filtered on status,
+        destinationKey and createdAt >= since (a timestampValue string). Only LIST_FIELDS
+        are read, plus the itinerary with include_itinerary.
+        page_token is the token returned with the previous page; it only resumes a
+        listing with the same filters, else InvalidPageToken is raised.
+        return (documents, next_page_token), next_page_token None on the last page.
+        """
+        filters = {"status": status, "destinationKey": destination_key, "since": since}
+        fingerprint = hashlib.sha1(json.dumps(filters, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+        conditions = [
+            {"fieldFilter": {"field": {"fieldPath": field}, "op": "EQUAL", "value": {"stringValue": value}}}
+            for field, value in (("status", status), ("destinationKey", destination_key))
+            if value is not None
+        ]
+        if since is not None:
+            conditions.append(
+                {
+                    "fieldFilter": {
+                        "field": {"fieldPath": "createdAt"},
+                        "op": "GREATER_THAN_OR_EQUAL",
+                        "value": {"timestampValue": since},
+                    }
+                }
+            )
+        fields = LIST_FIELDS + ITINERARY_BODY_FIELDS if include_itinerary else LIST_FIELDS
+        query = {
+            "select": {"fields": [{"fieldPath": field} for field in fields]},
+            "orderBy": [
+                {"field": {"fieldPath": "createdAt"}, "direction": "DESCENDING"},
+                {"field": {"fieldPath": "__name__"}, "direction": "DESCENDING"},
+            ],
+            # one document more than the page tells whether there is a next page
+            "limit": page_size + 1,
+        }
+        if len(conditions) == 1:
+            query["where"] = conditions[0]
+        elif conditions:
+            query["where"] = {"compositeFilter": {"op": "AND", "filters": conditions}}
+        if page_token:
+            created_at, document_id = self.decode_page_token(page_token, fingerprint)
+            database = f"projects/{project_id}/databases/(default)"
+            query["startAt"] = {
+                "values": [
+                    {"timestampValue": created_at},
+                    {"referenceValue": f"{database}/documents/{collection}/{document_id}"},
+                ],
+                "before": False,
+            }
+
+        documents = await self.run_query(id_token, project_id, collection, query)
+        if len(documents) <= page_size:
+            return documents, None
+        documents = documents[:page_size]
+        last = documents[-1]
+        next_page_token = self.encode_page_token(
+            last["fields"]["createdAt"]["timestampValue"], last["name"].split("/")[-1], fingerprint
+        )
+        return documents, next_page_token
+
+    @staticmethod
+    def encode_page_token(created_at, document_id, fingerprint):
+        """
+        Opaque token of a listing position: the cursor of the last document of the
+        page and a fingerprint of the listing's filters.
+        """
+        data = json.dumps([created_at, document_id, fingerprint], separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_page_token(page_token, fingerprint):
+        try:
+            data = base64.urlsafe_b64decode(page_token + "=" * (-len(page_token) % 4))
+            created_at, document_id, token_fingerprint = json.loads(data)
+        except Exception:
+            raise InvalidPageToken("Invalid pageToken")
+        if token_fingerprint != fingerprint:
+            raise InvalidPageToken("pageToken belongs to a listing with other filters")
+        return created_at, document_id
+
+    async def batch_insert_documents(self, id_token, project_id, collection, documents):
+        """
+        Insert several documents in a single atomic Firestore commit.
+        return the list of new document ids, in the order of documents, or None if the commit failed.
+        """
+        database = f"projects/{project_id}/databases/(default)"
+        url = f"https://firestore.googleapis.com/v1/{database}/documents:commit"
+
+        document_ids = [generate_document_id() for _ in documents]
+        writes = [
+            {
+                "update": {
+                    "name": f"{database}/documents/{collection}/{document_id}",
+                    "fields": document["fields"],
+                },
+                "currentDocument": {"exists": False},
+            }
+            for document_id, document in zip(document_ids, documents)
+        ]
+        data = json.dumps({"writes": writes}, ensure_ascii=True).encode("utf-8")
+
+        try:
+            await self._request(
+                "POST", url, id_token, body=data, timeout=15, endpoint="firestore.commit"
+            )
+            return document_ids
+        except HttpError as e:
+            print("batch_insert_documents Error:", e.status, e.body)
+            return None
+
+
+    async def batch_get_documents(self, id_token, project_id, collection, document_ids):
+        """
+        Retrieve several documents with one Firestore batchGet.
+        return a dict of document id to document, None for missing documents.
+        """
+        database = f"projects/{project_id}/databases/(default)"
+        url = f"https://firestore.googleapis.com/v1/{database}/documents:batchGet"
+
+        names = [f"{database}/documents/{collection}/{document_id}" for document_id in document_ids]
+        data = json.dumps({"documents": names}).encode("utf-8")
+
+        try:
+            # read-only, so safe to retry
+            resp = await self._request(
+                "POST", url, id_token, body=data, timeout=15, idempotent=True, endpoint="firestore.batchGet"
+            )
+        except HttpError as e:
+            print("batch_get_documents Error:", e.status, e.body)
+            raise
+
+        documents = {document_id: None for document_id in document_ids}
+        for row in resp.json():
+            if "found" in row:
+                documents[row["found"]["name"].split("/")[-1]] = row["found"]
+        return documents
+
+
+_itinerary_repository = None
+
+
+def get_itinerary_repository(env):
+    """
+    Return the isolate-wide repository, signing in with the token manager of env.
+    ITINERARY_STORAGE = "zlib" stores new itineraries compressed.
+    """
+    global _itinerary_repository
+    if _itinerary_repository is None:
+        _itinerary_repository = ItineraryRepository(
+            get_token_manager(env), itinerary_storage=getattr(env, "ITINERARY_STORAGE", "native")
+        )
+    return _itinerary_repository
@@ -0,0 +1,74 @@
+import asyncio
+import traceback
+
+
+class WriteBuffer:
+    """
+    Merges field updates per document and writes them with a single Firestore commit.
+    update() only buffers; later values of a field replace earlier ones, so a
+    document gets one write per flush however many updates it received.
+    flush() writes everything now, flush_later() writes progress in the background
+    and is skipped while a write is still in flight: its fields stay buffered and
+    go out with the next flush.
+    """
+
+    def __init__(self, repository, id_token, project_id, collection):
+        self.repository = repository
+        self.id_token = id_token
+        self.project_id = project_id
+        self.collection = collection
+        self._pending = {}
+        self._task = None
+        self.commits = 0
+        self.deferred = 0
+
+    def update(self, document_id, fields):
+        self._pending.setdefault(document_id, {}).update(fields)
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def flush(self):
+        """
+        Wait for a background write in flight, then commit the buffered updates.
+        return True when nothing is left to write.
+        """
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        return await self._commit()
+
+    def flush_later(self, on_flushed=None):
+        """
+        Commit the buffered updates in the background, calling on_flushed() once written.
+        return False when a write is already in flight and the updates were deferred.
+        """
+        if self._task is not None and not self._task.done():
+            self.deferred += 1
+            return False
+
+        async def run():
+            if await self._commit() and on_flushed is not None:
+                on_flushed()
+
+        self._task = asyncio.ensure_future(run())
+        return True
+
+    async def _commit(self):
+        if not self._pending:
+            return True
+        updates, self._pending = self._pending, {}
+        try:
+            committed = await self.repository.commit_updates(
+                self.id_token, self.project_id, self.collection, updates
+            )
+        except Exception:
+            print("WriteBuffer Error:", traceback.format_exc())
+            committed = False
+        if not committed:
+            # keep the fields for the next flush unless newer values were buffered meanwhile
+            for document_id, fields in updates.items():
+                newer = self._pending.get(document_id, {})
+                self._pending[document_id] = {**fields, **newer}
+            return False
+        self.commits += 1
+        return True
@@ -1,3 +1,94 @@
-from .itinerary_service import ItineraryService
+import importlib
 
-__all__ = ["ItineraryService"]
\ No newline at end of file
+# names are imported from their module on first access: the poll path only needs
+# the job notifier, and importing itinerary_service (prompts, planner, parsers)
+# up front would make every cold start pay for the job path
+_EXPORTS = {
+    "AdmissionController": "admission_controller",
+    "BacklogFullError": "admission_controller",
+    "TokenBucket": "admission_controller",
+    "get_admission_controller": "admission_controller",
+    "DedupRegistry": "dedup_registry",
+    "get_dedup_registry": "dedup_registry",
+    "make_dedup_key": "dedup_registry",
+    "CountMinSketch": "demand_tracker",
+    "DemandTracker": "demand_tracker",
+    "get_demand_tracker": "demand_tracker",
+    "DestinationIndex": "destination_index",
+    "TrigramIndex": "destination_index",
+    "canonical_destination": "destination_index",
+    "get_destination_index": "destination_index",
+    "normalize_destination": "destination_index",
+    "ItineraryService": "itinerary_service",
+    "get_itinerary_service": "itinerary_service",
+    "AnthropicProvider": "llm_providers",
+    "FakeLLMProvider": "llm_providers",
+    "LLMProvider": "llm_providers",
+    "OpenAICompatibleProvider": "llm_providers",
+    "build_providers": "llm_providers",
+    "LLMRouter": "llm_router",
+    "LLMUnavailableError": "llm_router",
+    "ProviderHealth": "llm_router",
+    "get_llm_router": "llm_router",
+    "JobReaper": "job_reaper",
+    "Pregenerator": "pregenerator",
+    "RetryPolicy": "retry_policy",
+    "classify_error": "retry_policy",
+    "JobNotifier": "job_notifier",
+    "get_job_notifier": "job_notifier",
+    "CloudflareJobQueue": "job_queue",
+    "CloudflareMessage": "job_queue",
+    "InMemoryJobQueue": "job_queue",
+    "JobConsumer": "job_queue",
+    "get_job_queue": "job_queue",
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = [
+    "AdmissionController",
+    "BacklogFullError",
+    "TokenBucket",
+    "get_admission_controller",
+    "DedupRegistry",
+    "get_dedup_registry",
+    "make_dedup_key",
+    "CountMinSketch",
+    "DemandTracker",
+    "get_demand_tracker",
+    "DestinationIndex",
+    "TrigramIndex",
+    "canonical_destination",
+    "get_destination_index",
+    "normalize_destination",
+    "ItineraryService",
+    "get_itinerary_service",
+    "AnthropicProvider",
+    "FakeLLMProvider",
+    "LLMProvider",
+    "OpenAICompatibleProvider",
+    "build_providers",
+    "LLMRouter",
+    "LLMUnavailableError",
+    "ProviderHealth",
+    "get_llm_router",
+    "JobReaper",
+    "Pregenerator",
+    "RetryPolicy",
+    "classify_error",
+    "JobNotifier",
+    "get_job_notifier",
+    "CloudflareJobQueue",
+    "CloudflareMessage",
+    "InMemoryJobQueue",
+    "JobConsumer",
+    "get_job_queue",
+]
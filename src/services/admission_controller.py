@@ -0,0 +1,190 @@
+import asyncio
+import time
+
+# (requests per minute, tokens per minute) per model
+DEFAULT_MODEL_LIMITS = {
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000),
+}
+FALLBACK_LIMITS = (500, 30000)
+
+
+def estimate_tokens(prompt, max_tokens):
+    """
+    Rough cost of a request against the tokens-per-minute budget:
+    about four characters per prompt token, plus the whole completion budget.
+    prompt is a string or a list of chat messages.
+    """
+    if not isinstance(prompt, str):
+        prompt = "".join(message["content"] for message in prompt)
+    return len(prompt) // 4 + 1 + max_tokens
+
+
+class BacklogFullError(Exception):
+    """
+    Raised when the LLM backlog is too long to accept more work.
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"LLM backlog is full, retry after {retry_after}s")
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until `amount` tokens are available. Amounts above the capacity
+        only wait for a full bucket, so oversized requests still get through.
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.refill_per_second)
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def give(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdmissionController:
+    """
+    Admits LLM requests against per-model requests-per-minute and tokens-per-minute
+    budgets. Callers wait in FIFO order until both buckets cover their estimated cost.
+    A 429 from the provider pauses the model for its Retry-After.
+    """
+
+    def __init__(self, limits=None, max_backlog=20):
+        self.limits = dict(DEFAULT_MODEL_LIMITS)
+        self.limits.update(limits or {})
+        self.max_backlog = max_backlog
+        self._buckets = {}
+        self._locks = {}
+        self._paused_until = {}
+        self.waiting = 0
+        self.waiting_tokens = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+
+    def _model_buckets(self, model):
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            requests_per_minute, tokens_per_minute = self.limits.get(model, FALLBACK_LIMITS)
+            buckets = (
+                TokenBucket(requests_per_minute, requests_per_minute / 60),
+                TokenBucket(tokens_per_minute, tokens_per_minute / 60),
+            )
+            self._buckets[model] = buckets
+            self._locks[model] = asyncio.Lock()
+        return buckets
+
+    def wait_time(self, model, cost):
+        request_bucket, token_bucket = self._model_buckets(model)
+        return max(
+            request_bucket.wait_time(1),
+            token_bucket.wait_time(cost),
+            self._paused_until.get(model, 0) - time.time(),
+        )
+
+    async def acquire(self, model, prompt, max_tokens):
+        """
+        Wait until the request fits the model's budget and take its share.
+        return the estimated token cost, to pass to settle() once usage is known.
+        """
+        cost = estimate_tokens(prompt, max_tokens)
+        request_bucket, token_bucket = self._model_buckets(model)
+        started = time.time()
+        self.waiting += 1
+        self.waiting_tokens += cost
+        try:
+            async with self._locks[model]:
+                while True:
+                    wait = self.wait_time(model, cost)
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                request_bucket.take(1)
+                token_bucket.take(cost)
+        finally:
+            self.waiting -= 1
+            self.waiting_tokens -= cost
+        self.admitted += 1
+        self.total_wait += time.time() - started
+        return cost
+
+    def settle(self, model, estimated_tokens, used_tokens):
+        """
+        Return the unused part of the estimate once the provider reported usage.
+        """
+        if used_tokens is not None and used_tokens < estimated_tokens:
+            self._model_buckets(model)[1].give(estimated_tokens - used_tokens)
+
+    def on_rate_limited(self, model, retry_after=None):
+        """
+        The provider answered 429: pause admissions for the model.
+        """
+        self.rate_limited += 1
+        pause = retry_after if retry_after is not None else 5
+        self._paused_until[model] = max(self._paused_until.get(model, 0), time.time() + pause)
+
+    def check_backlog(self, model="gpt-4o"):
+        """
+        Raise BacklogFullError when max_backlog or more requests already wait.
+        """
+        if self.waiting < self.max_backlog:
+            return
+        requests_per_minute, tokens_per_minute = self.limits.get(model, FALLBACK_LIMITS)
+        # time for the budgets to work through the requests already waiting
+        backlog_seconds = max(
+            self.waiting * 60 / requests_per_minute,
+            self.waiting_tokens * 60 / tokens_per_minute,
+        )
+        retry_after = max(1, int(max(backlog_seconds, self.wait_time(model, 0)) + 0.999))
+        raise BacklogFullError(retry_after)
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "waiting_tokens": self.waiting_tokens,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "mean_wait_s": round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+        }
+
+
+_admission_controller = None
+
+
+def get_admission_controller(env):
+    """
+    Return the isolate-wide admission controller. LLM_RPM_LIMIT and LLM_TPM_LIMIT
+    override the gpt-4o budget, LLM_MAX_BACKLOG the number of waiting requests
+    above which POST /create is refused.
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        requests_per_minute, tokens_per_minute = DEFAULT_MODEL_LIMITS["gpt-4o"]
+        limits = {
+            "gpt-4o": (
+                int(getattr(env, "LLM_RPM_LIMIT", requests_per_minute)),
+                int(getattr(env, "LLM_TPM_LIMIT", tokens_per_minute)),
+            )
+        }
+        _admission_controller = AdmissionController(
+            limits, max_backlog=int(getattr(env, "LLM_MAX_BACKLOG", 20))
+        )
+    return _admission_controller
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import time
+from .destination_index import canonical_destination
+
+
+def make_dedup_key(destination, duration_days, prompt_version):
+    """
+    Content address of an itinerary request: hash of the canonical
+    (destination, durationDays, prompt version) tuple.
+    """
+    raw = f"{canonical_destination(destination)}|{int(duration_days)}|{prompt_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class DedupRegistry:
+    """
+    In-isolate index of itinerary jobs by dedup key.
+    In-flight jobs are coalesced onto the same document id and completed jobs
+    are reused while they are younger than `freshness_window` seconds.
+    """
+
+    def __init__(self, freshness_window=24 * 60 * 60, in_flight_window=10 * 60, max_entries=1024):
+        self.freshness_window = freshness_window
+        self.in_flight_window = in_flight_window
+        self.max_entries = max_entries
+        self._creating = {}
+        self._in_flight = {}
+        self._completed = {}
+        self.in_flight_hits = 0
+        self.fresh_hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """
+        return the document id to reuse for key, or None when a new job is needed.
+        """
+        now = time.time()
+        entry = self._in_flight.get(key)
+        if entry and now - entry[1] < self.in_flight_window:
+            self.in_flight_hits += 1
+            return entry[0]
+        entry = self._completed.get(key)
+        if entry and now - entry[1] < self.freshness_window:
+            self.fresh_hits += 1
+            return entry[0]
+        return None
+
+    def is_completed(self, key, document_id):
+        """
+        Whether document_id is the fresh completed result of key, not a job in flight.
+        """
+        entry = self._completed.get(key)
+        return entry is not None and entry[0] == document_id
+
+    def creating(self, key):
+        """
+        return the future of a creation for key that has not inserted its document yet.
+        """
+        return self._creating.get(key)
+
+    def begin_creation(self, key):
+        future = asyncio.get_event_loop().create_future()
+        self._creating[key] = future
+        return future
+
+    def end_creation(self, key, future, result=None, error=None):
+        if self._creating.get(key) is future:
+            del self._creating[key]
+        if error is not None:
+            future.set_exception(error)
+            # mark retrieved so an unawaited failure is not reported as never retrieved
+            future.exception()
+        else:
+            future.set_result(result)
+
+    def record_in_flight_hit(self):
+        self.in_flight_hits += 1
+
+    def record_fresh_hit(self):
+        self.fresh_hits += 1
+
+    def record_miss(self):
+        self.misses += 1
+
+    def mark_in_flight(self, key, document_id):
+        self._in_flight[key] = (document_id, time.time())
+        self._evict(self._in_flight)
+
+    def mark_completed(self, key, document_id, completed_at=None):
+        self._in_flight.pop(key, None)
+        self._completed[key] = (document_id, completed_at or time.time())
+        self._evict(self._completed)
+
+    def mark_failed(self, key):
+        self._in_flight.pop(key, None)
+
+    def _evict(self, entries):
+        while len(entries) > self.max_entries:
+            entries.pop(next(iter(entries)))
+
+    def stats(self):
+        dedup_hits = self.in_flight_hits + self.fresh_hits
+        return {
+            "dedup_hits": dedup_hits,
+            "in_flight_hits": self.in_flight_hits,
+            "fresh_hits": self.fresh_hits,
+            "misses": self.misses,
+            # every dedup hit is a gpt-4o call that never happened
+            "llm_calls_saved": dedup_hits,
+        }
+
+
+_dedup_registry = DedupRegistry()
+
+
+def get_dedup_registry():
+    return _dedup_registry
@@ -0,0 +1,328 @@
+import re
+import time
+import unicodedata
+
+# spellings of a trailing country, by normalized name: the country stays in the key
+COUNTRY_ALIASES = {
+    "us": "united states",
+    "usa": "united states",
+    "u s a": "united states",
+    "united states of america": "united states",
+    "uk": "united kingdom",
+    "great britain": "united kingdom",
+    "czechia": "czech republic",
+    "korea": "south korea",
+    "uae": "united arab emirates",
+    "holland": "netherlands",
+    "italia": "italy",
+    "espana": "spain",
+    "deutschland": "germany",
+    "nippon": "japan",
+}
+
+# cities whose trailing country is dropped, as no other well-known destination
+# has their name: "Kyoto, Japan" is "kyoto", while "Cordoba, Argentina" and
+# "Cordoba, Spain" keep their country, and so does "Paris, Texas"
+CITY_COUNTRIES = {
+    "amsterdam": "netherlands",
+    "athens": "greece",
+    "bangkok": "thailand",
+    "barcelona": "spain",
+    "beijing": "china",
+    "berlin": "germany",
+    "budapest": "hungary",
+    "buenos aires": "argentina",
+    "cairo": "egypt",
+    "cape town": "south africa",
+    "copenhagen": "denmark",
+    "dubai": "united arab emirates",
+    "dublin": "ireland",
+    "edinburgh": "united kingdom",
+    "florence": "italy",
+    "hanoi": "vietnam",
+    "ho chi minh city": "vietnam",
+    "istanbul": "turkey",
+    "kyoto": "japan",
+    "lisbon": "portugal",
+    "london": "united kingdom",
+    "los angeles": "united states",
+    "madrid": "spain",
+    "marrakech": "morocco",
+    "milan": "italy",
+    "mumbai": "india",
+    "munich": "germany",
+    "new york": "united states",
+    "osaka": "japan",
+    "paris": "france",
+    "prague": "czech republic",
+    "reykjavik": "iceland",
+    "rio de janeiro": "brazil",
+    "rome": "italy",
+    "san francisco": "united states",
+    "seoul": "south korea",
+    "seville": "spain",
+    "singapore": "singapore",
+    "stockholm": "sweden",
+    "sydney": "australia",
+    "tokyo": "japan",
+    "venice": "italy",
+    "vienna": "austria",
+}
+
+# other names and spellings of the same destination, by normalized name
+DESTINATION_ALIASES = {
+    "nyc": "new york",
+    "new york city": "new york",
+    "new york, ny": "new york",
+    "manhattan": "new york",
+    "la": "los angeles",
+    "sf": "san francisco",
+    "san francisco, ca": "san francisco",
+    "roma": "rome",
+    "firenze": "florence",
+    "venezia": "venice",
+    "milano": "milan",
+    "napoli": "naples",
+    "munchen": "munich",
+    "koln": "cologne",
+    "wien": "vienna",
+    "praha": "prague",
+    "lisboa": "lisbon",
+    "sevilla": "seville",
+    "kobenhavn": "copenhagen",
+    "bombay": "mumbai",
+    "peking": "beijing",
+    "saigon": "ho chi minh city",
+    "bangkok, krung thep": "bangkok",
+}
+
+# Dice coefficient of trigram sets above which two destinations may be the same place
+MATCH_THRESHOLD = 0.75
+# fuzzy matches must also be typos: keys shorter than this never match fuzzily, and
+# longer ones allow one edit, two from LONG_KEY_CHARS characters
+MIN_FUZZY_CHARS = 6
+LONG_KEY_CHARS = 12
+# completed itineraries older than this are not reused
+REUSE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def normalize_destination(destination):
+    """
+    Case-fold and collapse whitespace so "Paris", " paris " and "PARIS" share a key.
+    """
+    return " ".join(str(destination).casefold().split()).strip(" .,;")
+
+
+def canonical_destination(destination, aliases=None):
+    """
+    Canonical key of a destination: normalized, without accents and punctuation
+    and resolved through the alias tables, so "Paris, France", "paris" and "PARIS "
+    are all "paris". A trailing country is kept, with its spelling normalized,
+    unless CITY_COUNTRIES lists it as the country of the city.
+    """
+    name = unicodedata.normalize("NFKD", normalize_destination(destination))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r"[^\w\s,]", " ", name)
+    parts = [" ".join(part.split()) for part in name.split(",")]
+    parts = [part for part in parts if part]
+    aliases = DESTINATION_ALIASES if aliases is None else aliases
+    name = ", ".join(parts)
+    if name in aliases:
+        return aliases[name]
+    if len(parts) > 1:
+        country = COUNTRY_ALIASES.get(parts[-1], parts[-1])
+        city = ", ".join(parts[:-1])
+        city = aliases.get(city, city)
+        if CITY_COUNTRIES.get(city) == country:
+            return city
+        return f"{city}, {country}"
+    return name
+
+
+def edit_distance(a, b, limit):
+    """
+    Edit distance of a and b counting a swap of adjacent letters as one edit
+    (optimal string alignment), or limit + 1 once it is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def max_typo_edits(key, candidate):
+    """
+    Edits two keys may differ by to be the same destination misspelled.
+    """
+    length = min(len(key), len(candidate))
+    if length < MIN_FUZZY_CHARS:
+        return 0
+    return 1 if length < LONG_KEY_CHARS else 2
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[index: index + 3] for index in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Fuzzy lookup of keys by the Dice coefficient of their character trigrams,
+    which tolerates typos and small spelling differences ("barcelone", "barcelona").
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._postings = {}
+
+    def add(self, key):
+        if key in self._keys:
+            return
+        grams = trigrams(key)
+        self._keys[key] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def search(self, key, threshold=MATCH_THRESHOLD):
+        """
+        return [(similarity, key)] of the indexed keys at least `threshold` similar, best first.
+        """
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        matches = []
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(grams) + len(self._keys[candidate]))
+            if similarity >= threshold:
+                matches.append((similarity, candidate))
+        matches.sort(reverse=True)
+        return matches
+
+
+class DestinationIndex:
+    """
+    In-isolate index of completed itineraries by canonical destination.
+    match() finds an itinerary of the same destination, exactly or through the
+    trigram index for a typo of one or two letters, with at least the requested
+    number of days, from which the answer can be derived without an LLM call.
+    Counts lookups and reuses for the reuse-rate metric.
+    """
+
+    def __init__(self, threshold=MATCH_THRESHOLD, max_age=REUSE_MAX_AGE, aliases=None):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.aliases = aliases
+        self.trigram_index = TrigramIndex()
+        self._entries = {}
+        self._document_ids = set()
+        self.refreshed_at = 0.0
+        self.lookups = 0
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.derived = 0
+
+    def add(self, destination, duration_days, document_id, completed_at, prompt_version):
+        if document_id in self._document_ids:
+            return
+        key = canonical_destination(destination, self.aliases)
+        self._document_ids.add(document_id)
+        self._entries.setdefault(key, []).append(
+            {
+                "documentId": document_id,
+                "destination": destination,
+                "durationDays": int(duration_days),
+                "completedAt": completed_at,
+                "promptVersion": prompt_version,
+            }
+        )
+        self.trigram_index.add(key)
+
+    def __len__(self):
+        return len(self._document_ids)
+
+    def _best_entry(self, key, duration_days, prompt_version, now):
+        """
+        The itinerary wasting the fewest days, newest first among equal lengths.
+        """
+        entries = [
+            entry
+            for entry in self._entries.get(key, ())
+            if entry["durationDays"] >= duration_days
+            and entry["promptVersion"] == prompt_version
+            and now - entry["completedAt"] < self.max_age
+        ]
+        if not entries:
+            return None
+        return min(entries, key=lambda entry: (entry["durationDays"], -entry["completedAt"]))
+
+    def match(self, destination, duration_days, prompt_version):
+        """
+        return (entry, similarity) of the itinerary to derive the request from, or None.
+        """
+        self.lookups += 1
+        now = time.time()
+        key = canonical_destination(destination, self.aliases)
+        entry = self._best_entry(key, duration_days, prompt_version, now)
+        if entry:
+            self.exact_hits += 1
+            return entry, 1.0
+        numbers = re.findall(r"\d+", key)
+        for similarity, candidate in self.trigram_index.search(key, self.threshold):
+            # a typo never changes a number: "district 1" is not "district 11"
+            if candidate == key or re.findall(r"\d+", candidate) != numbers:
+                continue
+            # similar names are not typos of each other: "parish" is not "paris"
+            edits = max_typo_edits(key, candidate)
+            if not edits or edit_distance(key, candidate, edits) > edits:
+                continue
+            entry = self._best_entry(candidate, duration_days, prompt_version, now)
+            if entry:
+                self.fuzzy_hits += 1
+                return entry, similarity
+        return None
+
+    def record_derived(self):
+        self.derived += 1
+
+    def stats(self):
+        return {
+            "destinations": len(self._entries),
+            "itineraries": len(self._document_ids),
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "derived": self.derived,
+            # share of new requests answered from an existing itinerary, without the LLM
+            "reuse_rate": round(self.derived / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+def select_days(days, duration_days):
+    """
+    The first duration_days days of a longer itinerary, renumbered from 1.
+    Longer trips front-load the main sights, so their opening days are a trip of their own.
+    """
+    return [{**day, "day": number} for number, day in enumerate(days[:duration_days], 1)]
+
+
+_destination_index = DestinationIndex()
+
+
+def get_destination_index():
+    return _destination_index
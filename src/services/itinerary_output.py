@@ -0,0 +1,84 @@
+from utils.json_stream import JSONArrayStreamParser
+
+
+class ItineraryParseError(ValueError):
+    """
+    The LLM answered, but no valid itinerary could be read from its output.
+    """
+
+
+def validate_day(day):
+    """
+    Check one day object against the itinerary schema:
+    {"day": int, "theme": str, "activities": [{"time", "description", "location"}]}.
+    return the cleaned day, or None when it does not fit the schema.
+    Missing themes, times and locations are tolerated as empty strings,
+    a day without any described activity is not.
+    """
+    if not isinstance(day, dict):
+        return None
+    activities = []
+    for activity in day.get("activities") or []:
+        if not isinstance(activity, dict):
+            return None
+        description = activity.get("description")
+        if not isinstance(description, str) or not description.strip():
+            return None
+        activities.append(
+            {
+                "time": str(activity.get("time") or ""),
+                "description": description,
+                "location": str(activity.get("location") or ""),
+            }
+        )
+    if not activities:
+        return None
+    try:
+        number = int(day.get("day"))
+    except (TypeError, ValueError):
+        number = None
+    return {"day": number, "theme": str(day.get("theme") or ""), "activities": activities}
+
+
+class ItineraryOutputParser:
+    """
+    Extracts itinerary days from LLM output, whole or fed incrementally while streaming.
+    Only the valid leading days are kept: parsing stops at the first element that
+    is malformed or breaks the schema, so every kept day is in its right position.
+    `complete` tells whether the array was closed with every element valid.
+    """
+
+    def __init__(self):
+        self._parser = JSONArrayStreamParser()
+        self.days = []
+        self.rejected = False
+
+    def feed(self, text):
+        """
+        return the valid days completed by this chunk.
+        """
+        if self.rejected:
+            return []
+        days = []
+        for element in self._parser.feed(text):
+            day = validate_day(element)
+            if day is None:
+                self.rejected = True
+                break
+            days.append(day)
+        self.days.extend(days)
+        return days
+
+    @property
+    def complete(self):
+        return self._parser.finished and not self._parser.failed and not self.rejected
+
+
+def parse_itinerary_output(content):
+    """
+    Parse a whole LLM message.
+    return (days, complete): the valid leading days and whether nothing was lost.
+    """
+    parser = ItineraryOutputParser()
+    parser.feed(content or "")
+    return parser.days, parser.complete
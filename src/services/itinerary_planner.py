@@ -0,0 +1,222 @@
+import asyncio
+import json
+import traceback
+from prompts import (
+    build_itinerary_messages,
+    build_outline_messages,
+    compute_max_tokens,
+    compute_outline_max_tokens,
+)
+from utils.json_stream import JSONArrayStreamParser
+from utils.tracing import span
+from .itinerary_output import ItineraryParseError, parse_itinerary_output
+
+# trips longer than this are generated in parallel day ranges
+CHUNK_DAYS = 3
+
+
+def split_day_ranges(duration_days, chunk_days=CHUNK_DAYS, first_day=1):
+    """
+    Split days first_day..duration_days into inclusive (first_day, last_day) ranges of at most chunk_days.
+    """
+    return [
+        (start, min(start + chunk_days - 1, duration_days))
+        for start in range(first_day, duration_days + 1, chunk_days)
+    ]
+
+
+def trip_max_tokens(duration_days, chunk_days=CHUNK_DAYS):
+    """
+    Completion tokens a whole trip may take: the single call of a short trip, or
+    the outline and the call of every day range of a longer one.
+    """
+    if duration_days <= chunk_days:
+        return compute_max_tokens(duration_days)
+    return compute_outline_max_tokens(duration_days) + sum(
+        compute_max_tokens(last_day - first_day + 1)
+        for first_day, last_day in split_day_ranges(duration_days, chunk_days)
+    )
+
+
+def parse_days(content):
+    """
+    Parse the JSON array of days out of an LLM message, ignoring fences and chatter.
+    """
+    parser = JSONArrayStreamParser()
+    days = parser.feed(content)
+    if not parser.finished:
+        raise ItineraryParseError("LLM output does not contain a complete JSON array")
+    return days
+
+
+def merge_days(days_by_number, duration_days):
+    """
+    Order the generated days and renumber them from 1.
+    """
+    days = []
+    for number in range(1, duration_days + 1):
+        day = days_by_number[number]
+        day["day"] = number
+        days.append(day)
+    return days
+
+
+def leading_days(days_by_number):
+    """
+    The days generated so far without a gap from day 1, numbered like merge_days.
+    """
+    days = []
+    while len(days) + 1 in days_by_number:
+        day = days_by_number[len(days) + 1]
+        day["day"] = len(days) + 1
+        days.append(day)
+    return days
+
+
+def outline_from_days(days):
+    """
+    Outline of already generated days, so the missing ones do not repeat them.
+    """
+    return [
+        {
+            "day": number,
+            "theme": day.get("theme", ""),
+            "highlights": [activity["location"] for activity in day["activities"] if activity["location"]][:3],
+        }
+        for number, day in enumerate(days, 1)
+    ]
+
+
+class ItineraryPlanner:
+    """
+    Generates long trips as concurrent LLM calls over day ranges.
+    A short outline call first gives every range the themes and highlights of
+    the whole trip, so ranges do not repeat each other's attractions.
+    Valid days of a truncated or partly broken answer are kept and only the
+    days still missing are requested again, up to max_attempts.
+    on_progress, when given, is called with the days by number each time a
+    range is done, so they can be persisted before the whole trip is.
+    """
+
+    def __init__(self, chat_completion, concurrency=3, chunk_days=CHUNK_DAYS, max_attempts=3):
+        self.chat_completion = chat_completion
+        self.concurrency = concurrency
+        self.chunk_days = chunk_days
+        self.max_attempts = max_attempts
+
+    async def generate(self, destination, duration_days, llm_api_key, on_progress=None):
+        """
+        return the merged list of days for the whole trip.
+        """
+        outline = await self.generate_outline(destination, duration_days, llm_api_key)
+        days_by_number = await self.generate_ranges(
+            destination,
+            duration_days,
+            split_day_ranges(duration_days, self.chunk_days),
+            outline,
+            llm_api_key,
+            on_progress=on_progress,
+        )
+        return merge_days(days_by_number, duration_days)
+
+    async def fill_missing(self, destination, duration_days, days, llm_api_key, on_progress=None):
+        """
+        Complete a trip of which only the first days were salvaged from the LLM output.
+        Only the missing days are requested, with the salvaged days as outline.
+        return the merged list of days for the whole trip.
+        """
+        days = days[:duration_days]
+        known = {number: day for number, day in enumerate(days, 1)}
+        if len(known) < duration_days:
+            print(f"Requesting days {len(known) + 1}-{duration_days}, {len(known)} days salvaged")
+            known = await self.generate_ranges(
+                destination,
+                duration_days,
+                split_day_ranges(duration_days, self.chunk_days, first_day=len(known) + 1),
+                outline_from_days(days),
+                llm_api_key,
+                known,
+                on_progress,
+            )
+        return merge_days(known, duration_days)
+
+    async def generate_ranges(
+        self, destination, duration_days, day_ranges, outline, llm_api_key, known=None, on_progress=None
+    ):
+        """
+        Generate the given day ranges concurrently.
+        return a dict of day number to day, including the `known` days.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        days_by_number = dict(known or {})
+
+        async def run_chunk(day_range):
+            async with semaphore:
+                messages = build_itinerary_messages(destination, duration_days, day_range, outline)
+                first_day, last_day = day_range
+                response = await self.chat_completion(
+                    messages,
+                    llm_api_key,
+                    temperature=0.7,
+                    max_tokens=compute_max_tokens(last_day - first_day + 1),
+                )
+                if not response or not response.get("choices"):
+                    raise ValueError(f"No valid response from LLM for days {first_day}-{last_day}")
+                content = response["choices"][0]["message"]["content"]
+                with span("itinerary.parse", bytes=len(content), first_day=first_day) as parse_span:
+                    days, _ = parse_itinerary_output(content)
+                    parse_span.set(days=len(days))
+                if not days:
+                    raise ItineraryParseError(f"No valid day in LLM output for days {first_day}-{last_day}")
+                days = days[: last_day - first_day + 1]
+                for offset, day in enumerate(days):
+                    days_by_number[first_day + offset] = day
+                if on_progress is not None:
+                    on_progress(days_by_number)
+                return days
+
+        pending = day_ranges
+        error = None
+        for attempt in range(self.max_attempts):
+            outcomes = await asyncio.gather(
+                *[run_chunk(day_range) for day_range in pending], return_exceptions=True
+            )
+            missing = []
+            for day_range, outcome in zip(pending, outcomes):
+                first_day, last_day = day_range
+                if isinstance(outcome, Exception):
+                    print(f"Chunk {day_range} failed on attempt {attempt + 1}: {outcome}")
+                    error = outcome
+                    missing.append(day_range)
+                    continue
+                if first_day + len(outcome) <= last_day:
+                    print(f"Chunk {day_range} returned {len(outcome)} days on attempt {attempt + 1}")
+                    missing.append((first_day + len(outcome), last_day))
+            pending = missing
+            if not pending:
+                break
+        if pending:
+            # chained, so the retry policy of the job sees why the chunks failed
+            raise ValueError(f"Itinerary days {pending} failed after {self.max_attempts} attempts") from error
+
+        return days_by_number
+
+    async def generate_outline(self, destination, duration_days, llm_api_key):
+        """
+        Ask for one theme and a few highlights per day.
+        return the outline list, or None when it could not be generated.
+        """
+        try:
+            response = await self.chat_completion(
+                build_outline_messages(destination, duration_days),
+                llm_api_key,
+                temperature=0.7,
+                max_tokens=compute_outline_max_tokens(duration_days),
+            )
+            if not response or not response.get("choices"):
+                return None
+            return parse_days(response["choices"][0]["message"]["content"])
+        except Exception:
+            print("generate_outline Error:", traceback.format_exc())
+            return None
+
@@ -1,26 +1,62 @@
 import time
-from workers import handler, fetch, Response
-import os, json
-import urllib.request as urlreq
-from urllib.error import HTTPError, URLError
-import ssl
 import traceback
-from pyodide.ffi import create_once_callable, to_js
 import asyncio
-from js import Promise
-from repositories import ItineraryRepository
-from utils import GCPAuthHelper, URLHelper
-from pathlib import Path
-from prompts import get_itineraries_prompt
+from repositories import decode_itinerary_fields, decode_value, encode_value, get_itinerary_repository
+from utils import get_token_manager, parse_timestamp, utc_timestamp
+from utils.js_helper import python_coroutine_to_js_promise
+from utils.tracing import get_sample_rate, span, start_trace
+from prompts import build_itinerary_messages, compute_max_tokens, get_prompt_version
+from .admission_controller import get_admission_controller
+from .dedup_registry import get_dedup_registry, make_dedup_key
+from .demand_tracker import demand_period, get_demand_tracker
+from .destination_index import canonical_destination, get_destination_index, select_days
+from .itinerary_output import ItineraryOutputParser, ItineraryParseError, parse_itinerary_output
+from .itinerary_planner import CHUNK_DAYS, ItineraryPlanner, leading_days
+from .job_notifier import get_job_notifier
+from .job_queue import JobConsumer, get_dead_letter_queue, get_job_queue
+from .job_reaper import STALE_SECONDS, JobReaper
+from .pregenerator import OFF_PEAK_HOURS, REFRESH_AGE, TOKEN_BUDGET, TOP_K, Pregenerator
+from .retry_policy import (
+    AUTH_REFRESH,
+    BACKGROUND_DEADLINE,
+    FATAL,
+    BASE_DELAY,
+    MAX_ATTEMPTS,
+    MAX_DELAY,
+    WAIT_UNTIL_DEADLINE,
+    RetryPolicy,
+)
+from .llm_router import get_llm_router
+from .llm_usage import start_llm_usage
+
+# progressive persistence while streaming: write every N new days or every T seconds
+PROGRESS_BATCH_DAYS = 2
+PROGRESS_INTERVAL_SECONDS = 3
+# destination index: completed itineraries loaded from Firestore, and how often
+DESTINATION_INDEX_SIZE = 1000
+DESTINATION_INDEX_REFRESH_SECONDS = 10 * 60
 
 
 class ItineraryService:
+    """
+    Creates itinerary jobs and runs them. One instance is shared by the requests of
+    an isolate (see get_itinerary_service), so the per-request ctx is passed to the
+    methods that schedule background work.
+    """
 
-    def __init__(self, env, ctx):
-        self.itinerary_repository = ItineraryRepository()
-        self.gcp_auth_helper = GCPAuthHelper()
+    def __init__(self, env):
+        self.itinerary_repository = get_itinerary_repository(env)
+        self.dedup_registry = get_dedup_registry()
+        self.destination_index = get_destination_index()
+        self.job_notifier = get_job_notifier()
+        self.job_queue = get_job_queue(env)
+        self.admission_controller = get_admission_controller(env)
+        self.llm_router = get_llm_router(env)
+        self.demand_tracker = get_demand_tracker(env)
+        self.demand_collection = getattr(env, "DEMAND_COLLECTION", "itinerary_demand")
+        # days stored with status partial, by running job
+        self.days_saved = {}
         self.env = env
-        self.ctx = ctx
 
     async def create_itinerary(
         self,
@@ -30,44 +66,595 @@ class ItineraryService:
         project_id: str,
         collection: str,
         llm_api_key: str,
+        ctx,
     ):
         """
         Create an itinerary document in Firestore.
+        Identical requests are deduplicated on (destination, durationDays, prompt version):
+        a job already in flight or a fresh completed result is returned instead of a new job.
+        Otherwise a completed itinerary of the same destination with at least as many
+        days is turned into a new completed document, without calling the LLM.
+        return (document_id, status): "created" for a new job, "deduplicated" for a job
+        already in flight, "completed" for a fresh completed result, "derived".
+        """
+        self.record_demand(destination, duration_days, id_token, project_id, ctx)
+        dedup_key = make_dedup_key(destination, duration_days, get_prompt_version())
+        document_id = self.dedup_registry.lookup(dedup_key)
+        if document_id:
+            return document_id, self.reuse_status(dedup_key, document_id)
+        creating = self.dedup_registry.creating(dedup_key)
+        if creating:
+            self.dedup_registry.record_in_flight_hit()
+            document_id, status = await asyncio.shield(creating)
+            return document_id, "deduplicated" if status == "created" else status
+
+        creation = self.dedup_registry.begin_creation(dedup_key)
+        try:
+            document_id = await self.find_reusable_document(
+                dedup_key, id_token, project_id, collection
+            )
+            status = self.reuse_status(dedup_key, document_id)
+            if not document_id:
+                derived = await self.derive_itinerary(
+                    destination, duration_days, id_token, project_id, collection
+                )
+                if derived:
+                    document_id = await self.insert_derived_itinerary(
+                        dedup_key, destination, duration_days, *derived, id_token, project_id, collection
+                    )
+                    status = "derived"
+            if not document_id:
+                self.admission_controller.check_backlog()
+                self.dedup_registry.record_miss()
+                document_id = await self.start_itinerary_job(
+                    dedup_key, destination, duration_days, id_token, project_id, collection, llm_api_key, ctx
+                )
+                status = "created"
+        except Exception as e:
+            self.dedup_registry.end_creation(dedup_key, creation, error=e)
+            raise
+        self.dedup_registry.end_creation(dedup_key, creation, (document_id, status))
+        return document_id, status
+
+    def reuse_status(self, dedup_key, document_id):
+        return "completed" if self.dedup_registry.is_completed(dedup_key, document_id) else "deduplicated"
+
+    async def start_itinerary_job(
+        self,
+        dedup_key: str,
+        destination: str,
+        duration_days: int,
+        id_token: str,
+        project_id: str,
+        collection: str,
+        llm_api_key: str,
+        ctx,
+    ):
+        """
+        Insert a processing document and run process_job for it in the background.
         """
-        params = {
+        document_id = await self.itinerary_repository.insert_document(
+            id_token, project_id, collection, self.build_processing_document(destination, duration_days, dedup_key)
+        )
+        if not document_id:
+            raise Exception("Failed to create itinerary document")
+
+        await self.dispatch_jobs(
+            [(document_id, dedup_key, destination, duration_days)],
+            id_token, project_id, collection, llm_api_key, ctx,
+        )
+        return document_id
+
+    async def create_itineraries_batch(
+        self,
+        items: list,
+        id_token: str,
+        project_id: str,
+        collection: str,
+        llm_api_key: str,
+        ctx,
+    ):
+        """
+        Create several itineraries with a single Firestore commit.
+        items is a list of (destination, durationDays) tuples. Duplicates, inside the batch
+        or of jobs known to this isolate, reuse the existing document, and items derived
+        from a longer itinerary are inserted completed.
+        return one result dict per item with its id and status "created", "derived" or "deduplicated".
+        """
+        results = []
+        new_jobs = {}
+        for destination, duration_days in items:
+            self.record_demand(destination, duration_days, id_token, project_id, ctx)
+            dedup_key = make_dedup_key(destination, duration_days, get_prompt_version())
+            document_id = self.dedup_registry.lookup(dedup_key)
+            if document_id:
+                results.append({"id": document_id, "status": "deduplicated"})
+            elif dedup_key in new_jobs:
+                self.dedup_registry.record_in_flight_hit()
+                results.append({"dedupKey": dedup_key, "status": "deduplicated"})
+            else:
+                self.dedup_registry.record_miss()
+                new_jobs[dedup_key] = (destination, duration_days)
+                results.append({"dedupKey": dedup_key, "status": "created"})
+
+        document_ids = {}
+        derived = {}
+        if new_jobs:
+            derivations = await asyncio.gather(
+                *[
+                    self.derive_itinerary(destination, duration_days, id_token, project_id, collection)
+                    for destination, duration_days in new_jobs.values()
+                ]
+            )
+            derived = {
+                dedup_key: derivation
+                for dedup_key, derivation in zip(new_jobs.keys(), derivations)
+                if derivation
+            }
+            if len(derived) < len(new_jobs):
+                self.admission_controller.check_backlog()
+            documents = []
+            for dedup_key, (destination, duration_days) in new_jobs.items():
+                if dedup_key in derived:
+                    documents.append(
+                        self.build_derived_document(destination, duration_days, dedup_key, *derived[dedup_key])
+                    )
+                else:
+                    documents.append(self.build_processing_document(destination, duration_days, dedup_key))
+            inserted_ids = await self.itinerary_repository.batch_insert_documents(
+                id_token, project_id, collection, documents
+            )
+            if not inserted_ids:
+                raise Exception("Failed to create itinerary documents")
+            document_ids = dict(zip(new_jobs.keys(), inserted_ids))
+            for dedup_key in derived:
+                self.dedup_registry.mark_completed(dedup_key, document_ids[dedup_key])
+                self.destination_index.record_derived()
+            jobs = [
+                (document_ids[dedup_key], dedup_key, destination, duration_days)
+                for dedup_key, (destination, duration_days) in new_jobs.items()
+                if dedup_key not in derived
+            ]
+            if jobs:
+                await self.dispatch_jobs(jobs, id_token, project_id, collection, llm_api_key, ctx)
+
+        for result in results:
+            dedup_key = result.pop("dedupKey", None)
+            if dedup_key:
+                result["id"] = document_ids[dedup_key]
+                if dedup_key in derived and result["status"] == "created":
+                    result["status"] = "derived"
+        return results
+
+    def build_processing_document(self, destination, duration_days, dedup_key):
+        return {
             "fields": {
                 "destination": {"stringValue": destination},
                 "durationDays": {"integerValue": duration_days},
                 "status": {"stringValue": "processing"},
+                "destinationKey": {"stringValue": canonical_destination(destination)},
+                "dedupKey": {"stringValue": dedup_key},
+                "promptVersion": {"stringValue": get_prompt_version()},
                 "createdAt": {
                     "timestampValue": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
                 },
             }
         }
+
+    def build_derived_document(self, destination, duration_days, dedup_key, days, source_id):
+        document = self.build_processing_document(destination, duration_days, dedup_key)
+        document["fields"].update(
+            {
+                "status": {"stringValue": "completed"},
+                **self.itinerary_repository.itinerary_fields(days),
+                "derivedFrom": {"stringValue": source_id},
+                "completedAt": {
+                    "timestampValue": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                },
+            }
+        )
+        return document
+
+    async def insert_derived_itinerary(
+        self, dedup_key, destination, duration_days, days, source_id, id_token, project_id, collection
+    ):
         document_id = await self.itinerary_repository.insert_document(
-            id_token, project_id, collection, params
+            id_token,
+            project_id,
+            collection,
+            self.build_derived_document(destination, duration_days, dedup_key, days, source_id),
         )
-        self.ctx.passThroughOnException()
-        process_params = {
-            "destination": destination,
-            "durationDays": duration_days,
-        }
-        self.ctx.waitUntil(
-            self.python_coroutine_to_js_promise(
-                self.process_job(
+        if not document_id:
+            raise Exception("Failed to create itinerary document")
+        self.dedup_registry.mark_completed(dedup_key, document_id)
+        self.destination_index.record_derived()
+        return document_id
+
+    async def refresh_destination_index(self, id_token, project_id, collection):
+        """
+        Load the completed itineraries of the current prompt version into the
+        destination index, at most every DESTINATION_INDEX_REFRESH_SECONDS.
+        Jobs completed by this isolate are added as they finish.
+        """
+        if time.time() - self.destination_index.refreshed_at < DESTINATION_INDEX_REFRESH_SECONDS:
+            return
+        # claimed before the query, so concurrent creates do not all run it
+        self.destination_index.refreshed_at = time.time()
+        prompt_version = get_prompt_version()
+        try:
+            documents = await self.itinerary_repository.run_query(
+                id_token,
+                project_id,
+                collection,
+                {
+                    "select": {
+                        "fields": [
+                            {"fieldPath": "destination"},
+                            {"fieldPath": "durationDays"},
+                            {"fieldPath": "completedAt"},
+                            {"fieldPath": "derivedFrom"},
+                        ]
+                    },
+                    "where": {
+                        "compositeFilter": {
+                            "op": "AND",
+                            "filters": [
+                                {
+                                    "fieldFilter": {
+                                        "field": {"fieldPath": "status"},
+                                        "op": "EQUAL",
+                                        "value": {"stringValue": "completed"},
+                                    }
+                                },
+                                {
+                                    "fieldFilter": {
+                                        "field": {"fieldPath": "promptVersion"},
+                                        "op": "EQUAL",
+                                        "value": {"stringValue": prompt_version},
+                                    }
+                                },
+                            ],
+                        }
+                    },
+                    "limit": DESTINATION_INDEX_SIZE,
+                },
+            )
+        except Exception:
+            print("refresh_destination_index Error:", traceback.format_exc())
+            return
+        for document in documents:
+            fields = document.get("fields", {})
+            # derived itineraries are shorter copies of an indexed one
+            if "derivedFrom" in fields or "completedAt" not in fields or "destination" not in fields:
+                continue
+            self.destination_index.add(
+                fields["destination"]["stringValue"],
+                decode_value(fields["durationDays"]),
+                document["name"].split("/")[-1],
+                parse_timestamp(fields["completedAt"]["timestampValue"]),
+                prompt_version,
+            )
+
+    async def derive_itinerary(self, destination, duration_days, id_token, project_id, collection):
+        """
+        Find a completed itinerary of the same destination, exactly or by fuzzy match,
+        with at least duration_days days, and select the days of the new trip from it.
+        return (days, source document id), or None when nothing can be reused.
+        """
+        try:
+            await self.refresh_destination_index(id_token, project_id, collection)
+            match = self.destination_index.match(destination, int(duration_days), get_prompt_version())
+            if not match:
+                return None
+            entry, similarity = match
+            document = await self.itinerary_repository.get_document(
+                id_token, project_id, collection, entry["documentId"], field_paths=["status", "itineraries", "itinerariesFormat"]
+            )
+        except Exception:
+            # reuse is best effort, never block a create on it
+            print("derive_itinerary Error:", traceback.format_exc())
+            return None
+        fields = (document or {}).get("fields", {})
+        if fields.get("status", {}).get("stringValue") != "completed":
+            return None
+        days = decode_itinerary_fields(fields)
+        if not isinstance(days, list) or len(days) < int(duration_days):
+            return None
+        print(
+            f"Deriving {duration_days} days of {destination!r} from {entry['documentId']}"
+            f" ({entry['durationDays']} days of {entry['destination']!r}, similarity {similarity:.2f})"
+        )
+        return select_days(days, int(duration_days)), entry["documentId"]
+
+    async def dispatch_jobs(
+        self,
+        jobs: list,
+        id_token: str,
+        project_id: str,
+        collection: str,
+        llm_api_key: str,
+        ctx,
+    ):
+        """
+        Hand freshly inserted jobs, (document_id, dedup_key, destination, duration_days)
+        tuples, to the job queue, or run process_job for each under ctx.waitUntil
+        when no queue is configured.
+        """
+        # only jobs run by this isolate notify its waiters: the waiters of jobs sent
+        # to JOB_QUEUE poll Firestore, as the consumer runs them in another isolate
+        runs_here = self.job_queue is None or hasattr(self.job_queue, "drain")
+        for document_id, dedup_key, destination, duration_days in jobs:
+            self.dedup_registry.mark_in_flight(dedup_key, document_id)
+            if runs_here:
+                self.job_notifier.register(document_id)
+
+        if self.job_queue is not None:
+            # queue messages carry no credentials, the consumer signs in itself
+            await self.job_queue.send_batch(
+                [
+                    {
+                        "jobId": document_id,
+                        "projectId": project_id,
+                        "collection": collection,
+                        "destination": destination,
+                        "durationDays": duration_days,
+                        "dedupKey": dedup_key,
+                    }
+                    for document_id, dedup_key, destination, duration_days in jobs
+                ]
+            )
+            if hasattr(self.job_queue, "drain"):
+                # the in-memory queue is consumed by this isolate
+                ctx.waitUntil(
+                    self.python_coroutine_to_js_promise(
+                        self.job_queue.drain(self.job_consumer().handle_batch)
+                    )
+                )
+            return
+
+        ctx.passThroughOnException()
+        for document_id, dedup_key, destination, duration_days in jobs:
+            process_params = {
+                "destination": destination,
+                "durationDays": duration_days,
+                "dedupKey": dedup_key,
+            }
+            ctx.waitUntil(
+                self.python_coroutine_to_js_promise(
+                    self.process_job(
+                        document_id,
+                        id_token,
+                        project_id,
+                        collection,
+                        llm_api_key,
+                        process_params,
+                    )
+                )
+            )
+
+    def record_demand(self, destination, duration_days, id_token, project_id, ctx):
+        """
+        Count a request for the pre-generation of popular itineraries, and flush the
+        counts of the isolate in the background once per DEMAND_FLUSH_SECONDS.
+        """
+        self.demand_tracker.record(destination, duration_days)
+        if self.demand_tracker.flush_due():
+            ctx.waitUntil(self.python_coroutine_to_js_promise(self.flush_demand(id_token, project_id)))
+
+    async def flush_demand(self, id_token, project_id):
+        """
+        Add the counts of the demand tracker to this week's demand documents, one per
+        (destination, duration) pair. Counts of a failed flush go with the next one.
+        """
+        candidates = self.demand_tracker.flush()
+        if not candidates:
+            return
+        period = demand_period()
+        now = utc_timestamp()
+        updates = [
+            (
+                f"{period}_{key}",
+                {
+                    "destination": {"stringValue": candidate["destination"]},
+                    "destinationKey": {"stringValue": canonical_destination(candidate["destination"])},
+                    "durationDays": {"integerValue": candidate["durationDays"]},
+                    "period": {"stringValue": period},
+                    "lastRequestedAt": {"timestampValue": now},
+                },
+                {"count": candidate["count"]},
+            )
+            for key, candidate in candidates.items()
+        ]
+        try:
+            flushed = await self.itinerary_repository.increment_documents(
+                id_token, project_id, self.demand_collection, updates
+            )
+        except Exception:
+            print("flush_demand Error:", traceback.format_exc())
+            flushed = False
+        if not flushed:
+            self.demand_tracker.restore(candidates)
+
+    def pregenerator(self):
+        return Pregenerator(
+            self,
+            top_k=int(getattr(self.env, "DEMAND_TOP_K", TOP_K)),
+            token_budget=int(getattr(self.env, "DEMAND_PREGEN_TOKEN_BUDGET", TOKEN_BUDGET)),
+            off_peak_hours=getattr(self.env, "DEMAND_OFF_PEAK_HOURS", OFF_PEAK_HOURS),
+            refresh_age=int(getattr(self.env, "DEMAND_REFRESH_SECONDS", REFRESH_AGE)),
+            concurrency=int(getattr(self.env, "DEMAND_PREGEN_CONCURRENCY", 2)),
+        )
+
+    def job_consumer(self):
+        return JobConsumer(
+            self.run_queued_job,
+            concurrency=int(getattr(self.env, "QUEUE_CONSUMER_CONCURRENCY", 4)),
+            max_attempts=int(getattr(self.env, "QUEUE_MAX_ATTEMPTS", 3)),
+            on_dead_letter=self.fail_queued_job,
+            dead_letter_queue=get_dead_letter_queue(self.env),
+        )
+
+    def job_reaper(self):
+        return JobReaper(
+            self,
+            stale_seconds=int(getattr(self.env, "REAPER_STALE_SECONDS", STALE_SECONDS)),
+            concurrency=int(getattr(self.env, "REAPER_CONCURRENCY", 4)),
+            max_resumes=int(getattr(self.env, "REAPER_MAX_RESUMES", 2)),
+            max_jobs=int(getattr(self.env, "REAPER_MAX_JOBS", 20)),
+        )
+
+    async def run_jobs(
+        self,
+        jobs: list,
+        id_token: str,
+        project_id: str,
+        collection: str,
+        llm_api_key: str,
+        ctx,
+        concurrency: int,
+    ):
+        """
+        Run jobs of a scheduled handler (resumed or pre-generated), (document_id, dedup_key,
+        destination, duration_days) tuples. With a job queue they are sent to it like new
+        jobs; otherwise they run here, `concurrency` at a time, and the call returns when
+        all are done.
+        """
+        if self.job_queue is not None:
+            await self.dispatch_jobs(jobs, id_token, project_id, collection, llm_api_key, ctx)
+            return
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(document_id, dedup_key, destination, duration_days):
+            async with semaphore:
+                await self.process_job(
                     document_id,
                     id_token,
                     project_id,
                     collection,
                     llm_api_key,
-                    process_params,
+                    {"destination": destination, "durationDays": duration_days, "dedupKey": dedup_key},
+                    deadline_seconds=self.background_deadline(),
                 )
-            )
+
+        for document_id, dedup_key, _, _ in jobs:
+            if dedup_key:
+                self.dedup_registry.mark_in_flight(dedup_key, document_id)
+            self.job_notifier.register(document_id)
+        await asyncio.gather(*[run(*job) for job in jobs])
+
+    async def run_queued_job(self, body: dict):
+        """
+        Queue consumer entry point: run process_job for one queued message body.
+        Errors that are not fatal are raised, for the consumer to retry the message
+        and dead-letter it after QUEUE_MAX_ATTEMPTS. A redelivered message of a job
+        that already finished, or whose document is gone, is acked without work.
+        """
+        id_token = await get_token_manager(self.env).get_id_token()
+        if not id_token:
+            raise Exception("Failed to authenticate queue consumer")
+        document = await self.itinerary_repository.get_document(
+            id_token,
+            body["projectId"],
+            body["collection"],
+            body["jobId"],
+            field_paths=["status", "attempts", "daysGenerated"],
+        )
+        fields = (document or {}).get("fields", {})
+        status = fields.get("status", {}).get("stringValue")
+        if document is None or status in ("completed", "failed"):
+            print(f"Queued job {body['jobId']} skipped: {status or 'document missing'}")
+            return
+        await self.process_job(
+            body["jobId"],
+            id_token,
+            body["projectId"],
+            body["collection"],
+            self.env.LLM_API_KEY,
+            {
+                "destination": body["destination"],
+                "durationDays": body["durationDays"],
+                "dedupKey": body.get("dedupKey"),
+                "daysGenerated": int(fields.get("daysGenerated", {}).get("integerValue", 0)),
+            },
+            # the in-memory queue is drained under waitUntil
+            deadline_seconds=None if hasattr(self.job_queue, "drain") else self.background_deadline(),
+            requeue=True,
+            previous_attempts=decode_value(fields["attempts"]) if "attempts" in fields else None,
         )
-        if not document_id:
-            raise Exception("Failed to create itinerary document")
 
-        return document_id
+    async def fail_queued_job(self, body: dict, error: Exception):
+        """
+        Mark the document of a dead-lettered message as failed so clients stop waiting.
+        """
+        id_token = await get_token_manager(self.env).get_id_token()
+        updates = {
+            "status": {"stringValue": "failed"},
+            "error": {"stringValue": f"job dead-lettered: {error}"},
+            "updatedAt": {
+                "timestampValue": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            },
+            "completedAt": {"timestampValue": utc_timestamp()},
+        }
+        await self.itinerary_repository.update_document(
+            id_token, body["projectId"], body["collection"], body["jobId"], updates
+        )
+        if body.get("dedupKey"):
+            self.dedup_registry.mark_failed(body["dedupKey"])
+        self.job_notifier.notify(body["jobId"])
+
+    async def find_reusable_document(self, dedup_key, id_token, project_id, collection):
+        """
+        Look in Firestore for a job with the same dedup key started by another isolate.
+        return the id of a fresh completed or recent processing document, or None.
+        """
+        try:
+            documents = await self.itinerary_repository.run_query(
+                id_token,
+                project_id,
+                collection,
+                {
+                    "select": {
+                        "fields": [
+                            {"fieldPath": "status"},
+                            {"fieldPath": "createdAt"},
+                            {"fieldPath": "completedAt"},
+                        ]
+                    },
+                    "where": {
+                        "fieldFilter": {
+                            "field": {"fieldPath": "dedupKey"},
+                            "op": "EQUAL",
+                            "value": {"stringValue": dedup_key},
+                        }
+                    },
+                    "limit": 10,
+                },
+            )
+        except Exception:
+            # deduplication is best effort, never block a create on it
+            print("find_reusable_document Error:", traceback.format_exc())
+            return None
+        now = time.time()
+        in_flight_id = None
+        for document in documents:
+            fields = document.get("fields", {})
+            status = fields.get("status", {}).get("stringValue")
+            document_id = document["name"].split("/")[-1]
+            if status == "completed" and "completedAt" in fields:
+                completed_at = parse_timestamp(fields["completedAt"]["timestampValue"])
+                if now - completed_at < self.dedup_registry.freshness_window:
+                    self.dedup_registry.record_fresh_hit()
+                    self.dedup_registry.mark_completed(dedup_key, document_id, completed_at)
+                    return document_id
+            elif status in ("processing", "partial") and "createdAt" in fields:
+                created_at = parse_timestamp(fields["createdAt"]["timestampValue"])
+                if now - created_at < self.dedup_registry.in_flight_window:
+                    in_flight_id = document_id
+        if in_flight_id:
+            self.dedup_registry.record_in_flight_hit()
+            self.dedup_registry.mark_in_flight(dedup_key, in_flight_id)
+        return in_flight_id
 
     async def process_job(
         self,
@@ -77,142 +664,293 @@ class ItineraryService:
         collection: str,
         llm_api_key: str,
         params: dict,
+        deadline_seconds: float = None,
+        requeue: bool = False,
+        previous_attempts: list = None,
     ):
         """
-        with 3 retry chat complete and update document with result itineraries, updated timestamp, retry count. if failed, update with error message in error field.
-        params contains destination and durationDays.
+        Generate the itinerary of a job and update its document with the result, or
+        with status failed and the reason in the error field. Attempts follow the
+        retry policy: failures are classified, backed off and bounded by the job
+        deadline (deadline_seconds, default the waitUntil budget), and each one is
+        recorded in the attempts field, after previous_attempts of earlier deliveries.
+        With requeue, a job given up on for an error that is not fatal is left
+        unfinished and the error raised, so the job queue redelivers or dead-letters it.
+        params contains destination and durationDays, optionally dedupKey and
+        daysGenerated, the days an earlier run already stored.
         job_id is the document id in Firestore.
         """
-        itinerary_repository = ItineraryRepository()
+        # every write of the job goes through the buffer: failed attempts only
+        # stage their fields, the terminal state is written with a single commit
+        write_buffer = self.itinerary_repository.write_buffer(id_token, project_id, collection)
         print("process_job start")
-        base_prompt = get_itineraries_prompt()
-        prompt = base_prompt.replace("{{destination}}", params["destination"]).replace(
-            "{{duration}}", str(params["durationDays"])
-        )
-        for i in range(3):
+        destination = params["destination"]
+        duration_days = int(params["durationDays"])
+        trace = start_trace("job", get_sample_rate(self.env), job_id=job_id, duration_days=duration_days)
+        llm_usage = start_llm_usage()
+        policy = self.retry_policy(deadline_seconds, previous_attempts)
+        self.days_saved[job_id] = int(params.get("daysGenerated") or 0)
+        attempt = 0
+        error = None
+        while True:
+            attempt += 1
+            started = time.time()
             try:
-                print(f"Attempt {i + 1} to generate itinerary")
-                response = await self.chat_completion(
-                    prompt, llm_api_key, model="gpt-4o", temperature=0.7, max_tokens=500
-                )
-                if (
-                    not response
-                    or "choices" not in response
-                    or len(response["choices"]) == 0
-                ):
-                    print(f"Invalid response from LLM: {response}")
-                    raise ValueError("No valid response from LLM")
-
-                itineraries = response["choices"][0]["message"]["content"]
-                print("Itineraries generated successfully:", itineraries)
-                itineraries = json.dumps(
-                    json.loads(itineraries.replace("json", "").replace("```", ""))
-                )
+                print(f"Attempt {attempt} to generate itinerary")
+                with span("llm.attempt", attempt=attempt):
+                    days = await policy.run(
+                        self.generate_days(job_id, destination, duration_days, llm_api_key, write_buffer)
+                    )
                 updates = {
-                    "itineraries": {"stringValue": itineraries},
+                    **self.itinerary_repository.itinerary_fields(days),
                     "status": {"stringValue": "completed"},
-                    "updatedAt": {
-                        "timestampValue": time.strftime(
-                            "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
-                        )
-                    },
-                    "completedAt": {
-                        "timestampValue": time.strftime(
-                            "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
-                        )
-                    },
-                    "retry_count": {"integerValue": i},
+                    "daysGenerated": {"integerValue": len(days)},
+                    "updatedAt": {"timestampValue": utc_timestamp()},
+                    "completedAt": {"timestampValue": utc_timestamp()},
+                    "retry_count": {"integerValue": attempt - 1},
+                    "llmUsage": encode_value(llm_usage.to_dict()),
                 }
-                await itinerary_repository.update_document(
-                    id_token, project_id, collection, job_id, updates
+                if policy.attempts:
+                    updates["attempts"] = encode_value(policy.attempts)
+                write_buffer.update(job_id, updates)
+                await write_buffer.flush()
+                self.days_saved.pop(job_id, None)
+                if params.get("dedupKey"):
+                    self.dedup_registry.mark_completed(params["dedupKey"], job_id)
+                self.destination_index.add(
+                    destination, duration_days, job_id, time.time(), get_prompt_version()
                 )
+                self.job_notifier.notify(job_id)
                 print("Document updated successfully")
+                if trace:
+                    trace.end(status="completed", attempts=attempt, llm=llm_usage.to_dict())
                 return
             except Exception as e:
-                print(f"Error on attempt {i + 1}: {traceback.format_exc()}")
-                updates = {
-                    "updatedAt": {
-                        "timestampValue": time.strftime(
-                            "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+                print(f"Error on attempt {attempt}: {traceback.format_exc()}")
+                error = e
+                error_class, delay = policy.on_failure(attempt, e, time.time() - started)
+                if delay is None:
+                    if requeue and error_class != FATAL:
+                        write_buffer.update(
+                            job_id,
+                            {
+                                "updatedAt": {"timestampValue": utc_timestamp()},
+                                "attempts": encode_value(policy.attempts),
+                            },
                         )
-                    },
-                    "retry_count": {"integerValue": i},
+                        await write_buffer.flush()
+                        self.days_saved.pop(job_id, None)
+                        print(f"Job {job_id} handed back to the queue ({policy.reason})")
+                        if trace:
+                            trace.end(status="requeued", attempts=attempt, reason=policy.reason, llm=llm_usage.to_dict())
+                        raise
+                    break
+                if error_class == AUTH_REFRESH:
+                    token_manager = get_token_manager(self.env)
+                    token_manager.invalidate(write_buffer.id_token)
+                    try:
+                        id_token = await token_manager.get_id_token()
+                    except Exception:
+                        # Firebase Auth is down: the next attempt signs in again
+                        print("process_job sign-in Error:", traceback.format_exc())
+                        id_token = None
+                    if id_token:
+                        write_buffer.id_token = id_token
+                updates = {
+                    "updatedAt": {"timestampValue": utc_timestamp()},
+                    "retry_count": {"integerValue": attempt},
+                    "attempts": encode_value(policy.attempts),
                 }
-                backoff_time = 2**i
-                await itinerary_repository.update_document(
-                    id_token, project_id, collection, job_id, updates
-                )
-                print(f"Waiting for {backoff_time} seconds before retrying...")
-                await asyncio.sleep(backoff_time)
+                # progress only: written during the backoff, merged into the next write if still in flight
+                write_buffer.update(job_id, updates)
+                write_buffer.flush_later()
+                print(f"{error_class} error, waiting for {delay:.1f} seconds before retrying...")
+                await asyncio.sleep(delay)
         updates = {
-            "updatedAt": {
-                "timestampValue": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-            },
+            "updatedAt": {"timestampValue": utc_timestamp()},
             "status": {"stringValue": "failed"},
-            "error": {"stringValue": "3 retry exceed and failed"},
-            "completedAt": {
-                "timestampValue": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-            },
+            "error": {"stringValue": f"{policy.reason}: {policy.attempts[-1]['class']}: {policy.attempts[-1]['error']}"},
+            "retry_count": {"integerValue": attempt - 1},
+            "attempts": encode_value(policy.attempts),
+            "llmUsage": encode_value(llm_usage.to_dict()),
+            "completedAt": {"timestampValue": utc_timestamp()},
         }
-        await itinerary_repository.update_document(
-            id_token, project_id, collection, job_id, updates
+        write_buffer.update(job_id, updates)
+        await write_buffer.flush()
+        self.days_saved.pop(job_id, None)
+        if params.get("dedupKey"):
+            self.dedup_registry.mark_failed(params["dedupKey"])
+        self.job_notifier.notify(job_id)
+        print(f"Document request failed ({policy.reason}), updated with error: {error!r}")
+        if trace:
+            trace.end(status="failed", attempts=attempt, reason=policy.reason, llm=llm_usage.to_dict())
+
+    def retry_policy(self, deadline_seconds=None, previous_attempts=None):
+        """
+        Retry policy of one job. Jobs run under waitUntil get JOB_DEADLINE_SECONDS,
+        callers with more wall time (queue consumers, scheduled handlers) pass theirs.
+        """
+        if deadline_seconds is None:
+            deadline_seconds = float(getattr(self.env, "JOB_DEADLINE_SECONDS", WAIT_UNTIL_DEADLINE))
+        return RetryPolicy(
+            deadline_seconds=deadline_seconds,
+            max_attempts=int(getattr(self.env, "JOB_MAX_ATTEMPTS", MAX_ATTEMPTS)),
+            base_delay=float(getattr(self.env, "RETRY_BASE_SECONDS", BASE_DELAY)),
+            max_delay=float(getattr(self.env, "RETRY_MAX_SECONDS", MAX_DELAY)),
+            history=previous_attempts,
+        )
+
+    def background_deadline(self):
+        """
+        Job deadline of queue consumers and scheduled handlers.
+        """
+        return float(getattr(self.env, "JOB_BACKGROUND_DEADLINE_SECONDS", BACKGROUND_DEADLINE))
+
+    async def generate_days(self, job_id, destination, duration_days, llm_api_key, write_buffer):
+        """
+        One attempt at generating the itinerary. Trips generated in day ranges
+        persist their leading days with status partial as the ranges finish.
+        return the list of days for the whole trip.
+        """
+
+        def on_progress(days_by_number):
+            self.save_partial(job_id, leading_days(days_by_number), write_buffer)
+
+        if duration_days > CHUNK_DAYS:
+            return await self.itinerary_planner().generate(
+                destination, duration_days, llm_api_key, on_progress=on_progress
+            )
+
+        messages = build_itinerary_messages(destination, duration_days)
+        max_tokens = compute_max_tokens(duration_days)
+        if self.streaming_enabled():
+            days = await self.generate_itinerary_streaming(
+                job_id, messages, max_tokens, llm_api_key, write_buffer
+            )
+        else:
+            response = await self.chat_completion(
+                messages, llm_api_key, temperature=0.7, max_tokens=max_tokens
+            )
+            if not response or not response.get("choices"):
+                print("Invalid response from LLM, no choices")
+                raise ValueError("No valid response from LLM")
+
+            content = response["choices"][0]["message"]["content"]
+            with span("itinerary.parse", bytes=len(content)) as parse_span:
+                days, complete = parse_itinerary_output(content)
+                parse_span.set(days=len(days), complete=complete)
+            if not days:
+                raise ItineraryParseError("No valid itinerary day in LLM output")
+        # salvaged days are kept, only the missing ones are requested again
+        return await self.itinerary_planner().fill_missing(
+            destination, duration_days, days, llm_api_key, on_progress=on_progress
         )
-        print("Document request failed after 3 retries, updated with error")
 
     async def chat_completion(
         self,
-        prompt: str,
+        messages: list,
         api_key: str,
-        model: str = "gpt-4o",
         temperature: float = 0.7,
         max_tokens: int = 2000,
     ):
-        url = "https://api.openai.com/v1/chat/completions"
-        payload = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-        }
-        data = json.dumps(payload).encode("utf‑8")
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-            # add a custom UA if needed — OpenAI doesn't enforce one
-        }
-
-        resp = await fetch(
-            url,
-            method="POST",
-            headers=headers,
-            body=data,
+        """
+        Chat completion from the first healthy provider of the LLM router.
+        Raises LLMUnavailableError when every provider failed.
+        """
+        return await self.llm_router.complete(
+            messages, api_key, temperature=temperature, max_tokens=max_tokens
         )
-        if resp.status != 200:
-            print("chat_completion Error:", resp.json())
-            return None
 
-        identity_response = await resp.json()
+    def itinerary_planner(self):
+        concurrency = int(getattr(self.env, "LLM_CHUNK_CONCURRENCY", 3))
+        return ItineraryPlanner(self.chat_completion, concurrency=concurrency)
+
+    def streaming_enabled(self):
+        return str(getattr(self.env, "LLM_STREAMING", "false")).lower() == "true"
+
+    async def generate_itinerary_streaming(
+        self,
+        job_id: str,
+        messages: list,
+        max_tokens: int,
+        llm_api_key: str,
+        write_buffer,
+    ):
+        """
+        Generate the itinerary from the streaming API. Each day is parsed as soon as its
+        JSON object closes and completed days are persisted in throttled batches with
+        status partial, so clients can read them before the whole trip exists.
+        Progress writes run in the background through write_buffer and are merged
+        while one is in flight, so the stream is never waiting on Firestore.
+        return the valid days, which may be fewer than requested when the stream was cut.
+        """
+        parser = ItineraryOutputParser()
+        days = []
+        persisted = 0
+        last_flush = time.time()
+        async for delta in self.chat_completion_stream(
+            messages, llm_api_key, temperature=0.7, max_tokens=max_tokens
+        ):
+            days.extend(parser.feed(delta))
+            pending = len(days) - persisted
+            if pending and (
+                persisted == 0
+                or pending >= PROGRESS_BATCH_DAYS
+                or time.time() - last_flush >= PROGRESS_INTERVAL_SECONDS
+            ):
+                self.save_partial(job_id, days, write_buffer)
+                persisted = len(days)
+                last_flush = time.time()
+
+        if not parser.complete:
+            if not days:
+                raise ItineraryParseError("LLM stream ended without a valid itinerary day")
+            print(f"LLM stream ended after {len(days)} valid days without closing the itinerary")
+        return days
 
-        return identity_response
+    def save_partial(self, job_id, days, write_buffer):
+        """
+        Persist the days generated so far with status partial, in the background.
+        Skipped unless the job has more days than it stored: an attempt restarting
+        after a failed one does not overwrite its days with fewer.
+        """
+        if len(days) <= self.days_saved.get(job_id, 0):
+            return
+        self.days_saved[job_id] = len(days)
+        updates = {
+            **self.itinerary_repository.itinerary_fields(days),
+            "status": {"stringValue": "partial"},
+            "daysGenerated": {"integerValue": len(days)},
+            "updatedAt": {"timestampValue": utc_timestamp()},
+        }
+        write_buffer.update(job_id, updates)
+        write_buffer.flush_later(lambda: self.job_notifier.notify(job_id))
+
+    def chat_completion_stream(
+        self,
+        messages: list,
+        api_key: str,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+    ):
+        """
+        Stream a chat completion, yielding content deltas as they arrive.
+        """
+        return self.llm_router.stream(messages, api_key, temperature=temperature, max_tokens=max_tokens)
 
     def python_coroutine_to_js_promise(self, coro):
         """Convert Python coroutine to JavaScript Promise"""
+        return python_coroutine_to_js_promise(coro)
 
-        async def wrapper():
-            try:
-                result = await coro
-                return result
-            except Exception as e:
-                print(f"💥 [WRAPPER] Error in background task: {e}")
-                raise e
-
-        # Create a JavaScript Promise that resolves the Python coroutine
-        return Promise.new(
-            lambda resolve, reject: asyncio.create_task(wrapper()).add_done_callback(
-                lambda task: (
-                    resolve(None)
-                    if task.exception() is None
-                    else reject(task.exception())
-                )
-            )
-        )
+
+_itinerary_service = None
+
+
+def get_itinerary_service(env):
+    """
+    Return the isolate-wide itinerary service, built on the first request.
+    """
+    global _itinerary_service
+    if _itinerary_service is None:
+        _itinerary_service = ItineraryService(env)
+    return _itinerary_service
@@ -0,0 +1,58 @@
+import asyncio
+
+
+class JobNotifier:
+    """
+    In-isolate change notifications for jobs run by this isolate's process_job.
+    Each notify bumps the job's version, so a waiter that read the document at
+    version v is woken by any later change, even one that happened before it waited.
+    """
+
+    def __init__(self, max_jobs=1024):
+        self.max_jobs = max_jobs
+        self._versions = {}
+        self._events = {}
+
+    def register(self, job_id):
+        self._versions[job_id] = 0
+        while len(self._versions) > self.max_jobs:
+            stale = next(iter(self._versions))
+            del self._versions[stale]
+            self._events.pop(stale, None)
+
+    def is_local(self, job_id):
+        return job_id in self._versions
+
+    def version(self, job_id):
+        return self._versions.get(job_id, 0)
+
+    def notify(self, job_id):
+        if job_id not in self._versions:
+            return
+        self._versions[job_id] += 1
+        event = self._events.pop(job_id, None)
+        if event:
+            event.set()
+
+    async def wait(self, job_id, since_version, timeout):
+        """
+        Wait until the job changes after since_version.
+        return True when it changed, False on timeout.
+        """
+        if self.version(job_id) > since_version:
+            return True
+        event = self._events.get(job_id)
+        if event is None:
+            event = self._events[job_id] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+_job_notifier = JobNotifier()
+
+
+def get_job_notifier():
+    return _job_notifier
@@ -0,0 +1,191 @@
+import asyncio
+import itertools
+import math
+import time
+import traceback
+
+
+class CloudflareJobQueue:
+    """
+    Producer for a Cloudflare Queues binding.
+    """
+
+    def __init__(self, binding):
+        self.binding = binding
+
+    async def send(self, body):
+        await self.send_batch([body])
+
+    async def send_batch(self, bodies):
+        from js import Object
+        from pyodide.ffi import to_js
+
+        messages = [{"body": body} for body in bodies]
+        await self.binding.sendBatch(to_js(messages, dict_converter=Object.fromEntries))
+
+
+class CloudflareMessage:
+    """
+    Adapter giving a Cloudflare Queues message the plain Python surface JobConsumer uses.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.id = message.id
+        self.body = message.body.to_py() if hasattr(message.body, "to_py") else message.body
+        self.attempts = message.attempts
+
+    def ack(self):
+        self.message.ack()
+
+    def retry(self, options=None):
+        from js import Object
+        from pyodide.ffi import to_js
+
+        self.message.retry(to_js(options or {}, dict_converter=Object.fromEntries))
+
+
+class InMemoryMessage:
+    """
+    Same surface as a Cloudflare Queues message: body, attempts, ack() and retry().
+    """
+
+    def __init__(self, message_id, body, attempts=1):
+        self.id = message_id
+        self.body = body
+        self.attempts = attempts
+        self.acked = False
+        self.retry_delay = None
+
+    def ack(self):
+        self.acked = True
+
+    def retry(self, options=None):
+        self.retry_delay = (options or {}).get("delaySeconds", 0)
+
+
+class InMemoryJobQueue:
+    """
+    Local queue for development and tests. Messages are delivered in batches of
+    up to max_batch_size to the handler passed to drain(), like a Queues consumer.
+    Messages neither acked nor retried are redelivered, like in Cloudflare Queues.
+    """
+
+    def __init__(self, max_batch_size=10):
+        self.max_batch_size = max_batch_size
+        self._ids = itertools.count(1)
+        self._pending = []
+        self._draining = False
+
+    async def send(self, body):
+        await self.send_batch([body])
+
+    async def send_batch(self, bodies):
+        now = time.time()
+        for body in bodies:
+            self._pending.append((now, InMemoryMessage(str(next(self._ids)), body)))
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def drain(self, handler):
+        """
+        Deliver batches to handler until the queue is empty.
+        """
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while self._pending:
+                now = time.time()
+                ready = [entry for entry in self._pending if entry[0] <= now][: self.max_batch_size]
+                if not ready:
+                    await asyncio.sleep(min(available_at for available_at, _ in self._pending) - now)
+                    continue
+                for entry in ready:
+                    self._pending.remove(entry)
+                messages = [message for _, message in ready]
+                await handler(messages)
+                for message in messages:
+                    if not message.acked:
+                        redelivery = InMemoryMessage(message.id, message.body, message.attempts + 1)
+                        self._pending.append((time.time() + (message.retry_delay or 0), redelivery))
+        finally:
+            self._draining = False
+
+
+class JobConsumer:
+    """
+    Runs a batch of queued jobs with at most `concurrency` at a time.
+    Failed jobs are retried with a growing delay, or the Retry-After of the error
+    when longer; after max_attempts they are handed to on_dead_letter, forwarded
+    to the dead letter queue if any, and acked.
+    """
+
+    def __init__(self, process, concurrency=4, max_attempts=3, on_dead_letter=None, dead_letter_queue=None, retry_delay=10):
+        self.process = process
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.on_dead_letter = on_dead_letter
+        self.dead_letter_queue = dead_letter_queue
+        self.retry_delay = retry_delay
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    async def handle_batch(self, messages):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def handle(message):
+            async with semaphore:
+                body = message.body
+                try:
+                    await self.process(body)
+                    self.processed += 1
+                    message.ack()
+                except Exception as e:
+                    print("JobConsumer Error:", traceback.format_exc())
+                    if message.attempts >= self.max_attempts:
+                        await self.dead_letter(body, e)
+                        message.ack()
+                    else:
+                        self.retried += 1
+                        delay = max(self.retry_delay * message.attempts, getattr(e, "retry_after", None) or 0)
+                        message.retry({"delaySeconds": int(math.ceil(delay))})
+
+        await asyncio.gather(*[handle(message) for message in messages])
+
+    async def dead_letter(self, body, error):
+        self.dead_lettered += 1
+        try:
+            if self.dead_letter_queue is not None:
+                await self.dead_letter_queue.send({"body": body, "error": str(error)})
+            if self.on_dead_letter is not None:
+                await self.on_dead_letter(body, error)
+        except Exception:
+            print("JobConsumer dead_letter Error:", traceback.format_exc())
+
+
+_in_memory_queue = None
+
+
+def get_job_queue(env):
+    """
+    Return the job queue producer: the JOB_QUEUE binding when configured,
+    the isolate's in-memory queue when JOB_QUEUE_MODE is "memory", else None
+    (jobs then run directly under ctx.waitUntil).
+    """
+    global _in_memory_queue
+    binding = getattr(env, "JOB_QUEUE", None)
+    if binding is not None:
+        return CloudflareJobQueue(binding)
+    if str(getattr(env, "JOB_QUEUE_MODE", "")).lower() == "memory":
+        if _in_memory_queue is None:
+            _in_memory_queue = InMemoryJobQueue()
+        return _in_memory_queue
+    return None
+
+
+def get_dead_letter_queue(env):
+    binding = getattr(env, "JOB_DLQ", None)
+    return CloudflareJobQueue(binding) if binding is not None else None
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import time
+import traceback
+from utils import parse_timestamp, utc_timestamp
+
+# a job without progress for this long is considered abandoned by its isolate
+STALE_SECONDS = 15 * 60
+# scan: documents per runQuery page and pages per sweep
+PAGE_SIZE = 100
+MAX_PAGES = 20
+# jobs claimed per sweep and run at once; sized so the last one starts well within its lease
+MAX_JOBS = 20
+CONCURRENCY = 4
+# times a job is resumed before it is failed for good
+MAX_RESUMES = 2
+
+SCAN_FIELDS = [
+    "status",
+    "destination",
+    "durationDays",
+    "dedupKey",
+    "createdAt",
+    "updatedAt",
+    "leaseUntil",
+    "reapCount",
+]
+
+
+class SweepStats:
+    def __init__(self):
+        self.started = time.time()
+        self.pages = 0
+        self.scanned = 0
+        self.stale = 0
+        self.claimed = 0
+        self.conflicts = 0
+        self.failed = 0
+        self.errors = 0
+        self.resumed = 0
+
+    def to_dict(self):
+        elapsed = time.time() - self.started
+        return {
+            "pages": self.pages,
+            "scanned": self.scanned,
+            "stale": self.stale,
+            "claimed": self.claimed,
+            "conflicts": self.conflicts,
+            "failed": self.failed,
+            "errors": self.errors,
+            "resumed": self.resumed,
+            "duration_ms": int(elapsed * 1000),
+            "scanned_per_s": round(self.scanned / elapsed, 1) if elapsed else None,
+        }
+
+
+class JobReaper:
+    """
+    Finds jobs left in processing or partial by an isolate that was evicted while
+    running them, and resumes them. Candidates come from a paginated runQuery over
+    createdAt with a projection of the job fields. A job is claimed with a write
+    conditioned on the document's updateTime, which also sets a lease
+    (leaseUntil), so of two sweeps seeing the same job only one resumes it, and
+    the next sweeps skip it while the lease runs. A job that stalled more than
+    max_resumes times is failed instead.
+    """
+
+    def __init__(
+        self,
+        itinerary_service,
+        stale_seconds=STALE_SECONDS,
+        concurrency=CONCURRENCY,
+        max_resumes=MAX_RESUMES,
+        max_jobs=MAX_JOBS,
+        page_size=PAGE_SIZE,
+        max_pages=MAX_PAGES,
+    ):
+        self.itinerary_service = itinerary_service
+        self.itinerary_repository = itinerary_service.itinerary_repository
+        self.stale_seconds = stale_seconds
+        self.concurrency = concurrency
+        self.max_resumes = max_resumes
+        self.max_jobs = max_jobs
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+    async def scan(self, id_token, project_id, collection, stale_before, stats):
+        """
+        Yield pages of unfinished documents created before stale_before, oldest first.
+        """
+        cursor = None
+        for _ in range(self.max_pages):
+            query = {
+                "select": {"fields": [{"fieldPath": field} for field in SCAN_FIELDS]},
+                "where": {
+                    "compositeFilter": {
+                        "op": "AND",
+                        "filters": [
+                            {
+                                "fieldFilter": {
+                                    "field": {"fieldPath": "status"},
+                                    "op": "IN",
+                                    "value": {
+                                        "arrayValue": {
+                                            "values": [
+                                                {"stringValue": "processing"},
+                                                {"stringValue": "partial"},
+                                            ]
+                                        }
+                                    },
+                                }
+                            },
+                            {
+                                "fieldFilter": {
+                                    "field": {"fieldPath": "createdAt"},
+                                    "op": "LESS_THAN",
+                                    "value": {"timestampValue": utc_timestamp(stale_before)},
+                                }
+                            },
+                        ],
+                    }
+                },
+                "orderBy": [
+                    {"field": {"fieldPath": "createdAt"}, "direction": "ASCENDING"},
+                    {"field": {"fieldPath": "__name__"}, "direction": "ASCENDING"},
+                ],
+                "limit": self.page_size,
+            }
+            if cursor:
+                # resume after the last document of the previous page
+                query["startAt"] = {"values": cursor, "before": False}
+            documents = await self.itinerary_repository.run_query(id_token, project_id, collection, query)
+            if not documents:
+                return
+            stats.pages += 1
+            stats.scanned += len(documents)
+            yield documents
+            if len(documents) < self.page_size:
+                return
+            last = documents[-1]
+            cursor = [last["fields"]["createdAt"], {"referenceValue": last["name"]}]
+
+    def is_stale(self, fields, now):
+        """
+        No progress written and no lease held for stale_seconds.
+        """
+        if "leaseUntil" in fields and parse_timestamp(fields["leaseUntil"]["timestampValue"]) > now:
+            return False
+        if "updatedAt" in fields and parse_timestamp(fields["updatedAt"]["timestampValue"]) > now - self.stale_seconds:
+            return False
+        return "destination" in fields and "durationDays" in fields
+
+    async def claim(self, id_token, project_id, collection, document, now):
+        """
+        Take the lease of a stale job, or fail it after max_resumes resumes.
+        return "claimed", "failed" or "conflict" when another sweep got there first.
+        """
+        fields = document["fields"]
+        reap_count = int(fields.get("reapCount", {}).get("integerValue", 0))
+        if reap_count >= self.max_resumes:
+            updates = {
+                "status": {"stringValue": "failed"},
+                "error": {"stringValue": f"job stalled {reap_count + 1} times"},
+                "updatedAt": {"timestampValue": utc_timestamp(now)},
+                "completedAt": {"timestampValue": utc_timestamp(now)},
+            }
+            outcome = "failed"
+        else:
+            updates = {
+                "leaseUntil": {"timestampValue": utc_timestamp(now + self.stale_seconds)},
+                "reapCount": {"integerValue": reap_count + 1},
+                "updatedAt": {"timestampValue": utc_timestamp(now)},
+            }
+            outcome = "claimed"
+        won = await self.itinerary_repository.claim_document(
+            id_token, project_id, collection, document["name"].split("/")[-1], updates, document["updateTime"]
+        )
+        return outcome if won else "conflict"
+
+    async def sweep(self, id_token, project_id, collection, llm_api_key, ctx):
+        """
+        Claim up to max_jobs stale jobs, claims running concurrency at a time, then
+        resume them. Logs and returns the counters of the sweep.
+        """
+        stats = SweepStats()
+        now = time.time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        jobs = []
+
+        async def claim(document):
+            async with semaphore:
+                return await self.claim(id_token, project_id, collection, document, now)
+
+        try:
+            async for documents in self.scan(id_token, project_id, collection, now - self.stale_seconds, stats):
+                stale = [document for document in documents if self.is_stale(document.get("fields", {}), now)]
+                stale = stale[: self.max_jobs - len(jobs)]
+                stats.stale += len(stale)
+                outcomes = await asyncio.gather(*[claim(document) for document in stale], return_exceptions=True)
+                for document, outcome in zip(stale, outcomes):
+                    fields = document["fields"]
+                    document_id = document["name"].split("/")[-1]
+                    dedup_key = fields.get("dedupKey", {}).get("stringValue")
+                    if isinstance(outcome, Exception):
+                        print("JobReaper claim Error:", document_id, repr(outcome))
+                        stats.errors += 1
+                    elif outcome == "conflict":
+                        stats.conflicts += 1
+                    elif outcome == "failed":
+                        stats.failed += 1
+                        if dedup_key:
+                            self.itinerary_service.dedup_registry.mark_failed(dedup_key)
+                        self.itinerary_service.job_notifier.notify(document_id)
+                    else:
+                        stats.claimed += 1
+                        jobs.append(
+                            (
+                                document_id,
+                                dedup_key,
+                                fields["destination"]["stringValue"],
+                                int(fields["durationDays"]["integerValue"]),
+                            )
+                        )
+                if len(jobs) >= self.max_jobs:
+                    break
+        except Exception:
+            print("JobReaper scan Error:", traceback.format_exc())
+            stats.errors += 1
+
+        if jobs:
+            await self.itinerary_service.run_jobs(
+                jobs, id_token, project_id, collection, llm_api_key, ctx, self.concurrency
+            )
+            stats.resumed = len(jobs)
+
+        summary = stats.to_dict()
+        print(json.dumps({"type": "reaper", **summary}))
+        return summary
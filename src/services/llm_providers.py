@@ -0,0 +1,325 @@
+import asyncio
+import json
+import re
+from utils.sse import SSEDecoder
+
+# used when LLM_PROVIDERS is not set: the original single gpt-4o backend
+DEFAULT_PROVIDERS = [{"name": "openai", "type": "openai", "model": "gpt-4o"}]
+DEFAULT_TIMEOUT = 120
+DEFAULT_STREAM_TIMEOUT = 30
+
+
+class LLMProvider:
+    """
+    One chat model behind one API. complete() returns an OpenAI style completion
+    ({"choices": [{"message": {"content"}}], "usage"}), stream() yields
+    (content, usage) pairs, usage being set on the event that carries it.
+    timeout bounds a completion, stream_timeout the wait for the stream headers.
+    """
+
+    type = None
+
+    def __init__(
+        self,
+        name,
+        model,
+        http_client=None,
+        api_key_var=None,
+        timeout=DEFAULT_TIMEOUT,
+        stream_timeout=DEFAULT_STREAM_TIMEOUT,
+        latency_target_ms=None,
+    ):
+        self.name = name
+        self.model = model
+        self.http_client = http_client
+        self.api_key_var = api_key_var
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
+        # rolling latency above this demotes the provider behind the healthy ones
+        self.latency_target_ms = latency_target_ms or timeout * 1000 / 2
+
+    def api_key(self, env, default):
+        """
+        The key of this provider: env.<apiKeyVar> when configured, else LLM_API_KEY.
+        """
+        if self.api_key_var:
+            return getattr(env, self.api_key_var, None) or default
+        return default
+
+    async def complete(self, messages, api_key, temperature, max_tokens):
+        raise NotImplementedError
+
+    def stream(self, messages, api_key, temperature, max_tokens):
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    Chat Completions API of OpenAI and of the services mirroring it
+    (Azure OpenAI, Groq, Together, vLLM, ...), selected by base_url.
+    """
+
+    type = "openai"
+
+    def __init__(self, name, model, base_url="https://api.openai.com/v1", **options):
+        super().__init__(name, model, **options)
+        self.url = base_url.rstrip("/") + "/chat/completions"
+
+    def headers(self, api_key):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        }
+
+    async def complete(self, messages, api_key, temperature, max_tokens):
+        resp = await self.http_client.request(
+            "POST",
+            self.url,
+            headers=self.headers(api_key),
+            json_body={
+                "model": self.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            },
+            timeout=self.timeout,
+            endpoint=f"{self.name}.chat",
+        )
+        return resp.json()
+
+    async def stream(self, messages, api_key, temperature, max_tokens):
+        resp = await self.http_client.request(
+            "POST",
+            self.url,
+            headers=self.headers(api_key),
+            json_body={
+                "model": self.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True,
+                # the last event then carries the token usage of the whole completion
+                "stream_options": {"include_usage": True},
+            },
+            timeout=self.stream_timeout,
+            endpoint=f"{self.name}.chat.stream",
+            stream=True,
+        )
+        decoder = SSEDecoder()
+        async for chunk in resp.iter_bytes():
+            for event in decoder.feed(chunk):
+                if event == "[DONE]":
+                    return
+                event = json.loads(event)
+                choices = event.get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content or event.get("usage"):
+                    yield content, event.get("usage")
+
+
+class AnthropicProvider(LLMProvider):
+    """
+    Anthropic Messages API. The system message moves to the top-level system
+    field and responses and usage are converted to the OpenAI shape.
+    """
+
+    type = "anthropic"
+    API_VERSION = "2023-06-01"
+
+    def __init__(self, name, model, base_url="https://api.anthropic.com/v1", **options):
+        super().__init__(name, model, **options)
+        self.url = base_url.rstrip("/") + "/messages"
+
+    def headers(self, api_key):
+        return {
+            "Content-Type": "application/json",
+            "x-api-key": api_key,
+            "anthropic-version": self.API_VERSION,
+        }
+
+    def payload(self, messages, temperature, max_tokens):
+        system = "\n\n".join(message["content"] for message in messages if message["role"] == "system")
+        payload = {
+            "model": self.model,
+            "messages": [message for message in messages if message["role"] != "system"],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if system:
+            payload["system"] = system
+        return payload
+
+    @staticmethod
+    def usage(input_tokens, output_tokens):
+        return {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+    async def complete(self, messages, api_key, temperature, max_tokens):
+        resp = await self.http_client.request(
+            "POST",
+            self.url,
+            headers=self.headers(api_key),
+            json_body=self.payload(messages, temperature, max_tokens),
+            timeout=self.timeout,
+            endpoint=f"{self.name}.messages",
+        )
+        message = resp.json()
+        usage = message.get("usage") or {}
+        content = "".join(block.get("text", "") for block in message.get("content", []) if block.get("type") == "text")
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": self.usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0)),
+        }
+
+    async def stream(self, messages, api_key, temperature, max_tokens):
+        resp = await self.http_client.request(
+            "POST",
+            self.url,
+            headers=self.headers(api_key),
+            json_body={**self.payload(messages, temperature, max_tokens), "stream": True},
+            timeout=self.stream_timeout,
+            endpoint=f"{self.name}.messages.stream",
+            stream=True,
+        )
+        decoder = SSEDecoder()
+        input_tokens = 0
+        async for chunk in resp.iter_bytes():
+            for event in decoder.feed(chunk):
+                event = json.loads(event)
+                kind = event.get("type")
+                if kind == "message_start":
+                    input_tokens = event.get("message", {}).get("usage", {}).get("input_tokens", 0)
+                elif kind == "content_block_delta":
+                    text = event.get("delta", {}).get("text")
+                    if text:
+                        yield text, None
+                elif kind == "message_delta":
+                    output_tokens = event.get("usage", {}).get("output_tokens", 0)
+                    yield None, self.usage(input_tokens, output_tokens)
+                elif kind == "message_stop":
+                    return
+                elif kind == "error":
+                    raise ValueError(f"{self.name} stream error: {event.get('error')}")
+
+
+def fake_completion(prompt):
+    """
+    Deterministic answer to an itinerary or outline prompt: the destination,
+    duration and day range are read back from the prompt.
+    """
+    destination = re.search(r"\*\*Destination:\*\* (.+)", prompt)
+    destination = destination.group(1).strip() if destination else "Somewhere"
+    outline = re.search(r"Plan the outline of a (\d+)-day trip to (.+?)\.", prompt)
+    if outline:
+        days = int(outline.group(1))
+        return json.dumps(
+            [
+                {"day": day, "theme": f"Theme {day}", "highlights": [f"Sight {day}a", f"Sight {day}b"]}
+                for day in range(1, days + 1)
+            ]
+        )
+    scope = re.search(r"covers only days (\d+) to (\d+)", prompt)
+    if scope:
+        first_day, last_day = int(scope.group(1)), int(scope.group(2))
+    else:
+        duration = re.search(r"\*\*Duration:\*\* (\d+)", prompt)
+        first_day, last_day = 1, int(duration.group(1)) if duration else 1
+    days = [
+        {
+            "day": day,
+            "theme": f"{destination} day {day}",
+            "activities": [
+                {
+                    "time": time_of_day,
+                    "description": f"Explore {destination} spot {day}-{slot}, allow about two hours.",
+                    "location": f"{destination} spot {day}-{slot}",
+                }
+                for slot, time_of_day in enumerate(("Morning", "Afternoon", "Evening"))
+            ],
+        }
+        for day in range(first_day, last_day + 1)
+    ]
+    return "```json\n" + json.dumps(days, indent=2) + "\n```"
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Local provider for development and tests: answers every prompt with
+    fake_completion after latency_ms, or fails every call when `failing` is set,
+    without any network access.
+    """
+
+    type = "fake"
+
+    def __init__(self, name, model="fake", latency_ms=0, failing=False, chunk_chars=40, **options):
+        super().__init__(name, model, **options)
+        self.latency_ms = latency_ms
+        self.failing = failing
+        self.chunk_chars = chunk_chars
+        self.calls = 0
+
+    async def _answer(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        if self.failing:
+            raise ValueError(f"{self.name} is configured to fail")
+        prompt = "\n".join(message["content"] for message in messages)
+        content = fake_completion(prompt)
+        return content, {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+
+    async def complete(self, messages, api_key, temperature, max_tokens):
+        content, usage = await self._answer(messages)
+        return {"choices": [{"message": {"role": "assistant", "content": content}}], "usage": usage}
+
+    async def stream(self, messages, api_key, temperature, max_tokens):
+        content, usage = await self._answer(messages)
+        for start in range(0, len(content), self.chunk_chars):
+            yield content[start: start + self.chunk_chars], None
+        yield None, usage
+
+
+PROVIDER_TYPES = {
+    provider.type: provider for provider in (OpenAICompatibleProvider, AnthropicProvider, FakeLLMProvider)
+}
+
+
+def build_providers(env, http_client):
+    """
+    Build the providers listed in LLM_PROVIDERS, a JSON list in priority order:
+    [{"name", "type": "openai" | "anthropic" | "fake", "model", "baseUrl",
+      "apiKeyVar", "timeout", "streamTimeout", "latencyTargetMs", ...}].
+    """
+    config = getattr(env, "LLM_PROVIDERS", None)
+    entries = json.loads(config) if isinstance(config, str) and config.strip() else config or DEFAULT_PROVIDERS
+    if hasattr(entries, "to_py"):
+        entries = entries.to_py()
+
+    providers = []
+    for entry in entries:
+        entry = dict(entry)
+        provider_type = entry.pop("type", "openai")
+        if provider_type not in PROVIDER_TYPES:
+            raise ValueError(f"Unknown LLM provider type {provider_type!r}")
+        options = {
+            "http_client": http_client,
+            "api_key_var": entry.pop("apiKeyVar", None),
+            "timeout": float(entry.pop("timeout", DEFAULT_TIMEOUT)),
+            "stream_timeout": float(entry.pop("streamTimeout", DEFAULT_STREAM_TIMEOUT)),
+            "latency_target_ms": entry.pop("latencyTargetMs", None),
+        }
+        if "baseUrl" in entry:
+            options["base_url"] = entry.pop("baseUrl")
+        if provider_type == "fake":
+            options["latency_ms"] = float(entry.pop("latencyMs", 0))
+            options["failing"] = bool(entry.pop("failing", False))
+        name = entry.pop("name", None) or provider_type
+        model = entry.pop("model", "fake" if provider_type == "fake" else "gpt-4o")
+        providers.append(PROVIDER_TYPES[provider_type](name, model, **options))
+    return providers
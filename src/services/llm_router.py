@@ -0,0 +1,319 @@
+import asyncio
+import collections
+import contextvars
+import time
+from utils.http_client import HttpError, get_http_client
+from .admission_controller import get_admission_controller
+from .llm_providers import build_providers
+from .llm_usage import record_llm_usage
+
+# rolling health: outcomes kept per provider and weight of the newest latency
+HEALTH_WINDOW = 20
+LATENCY_SMOOTHING = 0.2
+# error rate over the window above which a provider counts as degraded
+DEGRADED_ERROR_RATE = 0.5
+# circuit breaker: consecutive failures that open it, seconds before a probe call
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30
+# share of the time left before the job deadline given to a provider that has
+# another one behind it, so a timed out call still leaves time for the fallback
+PRIMARY_SHARE = 2 / 3
+
+# deadline (epoch seconds) of the job running in the current task, see RetryPolicy.run
+_call_deadline = contextvars.ContextVar("llm_call_deadline", default=None)
+
+
+def set_call_deadline(deadline):
+    return _call_deadline.set(deadline)
+
+
+def reset_call_deadline(token):
+    _call_deadline.reset(token)
+
+
+class LLMUnavailableError(Exception):
+    """
+    No provider answered: every candidate failed or had its circuit open.
+    errors are the provider errors; retry_after the shortest wait any of them asked
+    for or, when no provider was called, the time until the first circuit half-opens.
+    """
+
+    def __init__(self, errors, retry_after=None):
+        self.errors = errors
+        self.retry_after = retry_after
+        super().__init__(
+            "No LLM provider answered: " + ("; ".join(repr(error) for error in errors) or "all circuits open")
+        )
+
+
+class ProviderHealth:
+    """
+    Rolling latency and error rate of one provider, and its circuit breaker.
+    The breaker opens after FAILURE_THRESHOLD consecutive failures; after
+    OPEN_SECONDS a single probe call is let through (half-open), which closes
+    it on success and reopens it on failure.
+    """
+
+    def __init__(self, window=HEALTH_WINDOW, failure_threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.outcomes = collections.deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.latency_ms = None
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+
+    @property
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def available(self):
+        """
+        Whether a call may go to the provider now. An open breaker whose
+        cooldown is over becomes half-open.
+        """
+        if self.state == "open" and time.time() - self.opened_at >= self.open_seconds:
+            self.state = "half_open"
+        return self.state == "closed" or (self.state == "half_open" and not self.probing)
+
+    def begin_call(self):
+        """
+        return False when the call must be skipped: the circuit is open or its
+        probe call is already in flight.
+        """
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self.probing = True
+        return True
+
+    def cancel_call(self):
+        """
+        A call given up before it reached the provider: its probe, if it was one,
+        is no longer in flight.
+        """
+        self.probing = False
+
+    def record_success(self, latency_ms):
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if self.latency_ms is None:
+            self.latency_ms = latency_ms
+        else:
+            self.latency_ms += LATENCY_SMOOTHING * (latency_ms - self.latency_ms)
+        self.state = "closed"
+        self.probing = False
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.time()
+            self.probing = False
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "latencyMs": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "errorRate": round(self.error_rate, 3),
+            "calls": len(self.outcomes),
+        }
+
+
+class LLMRouter:
+    """
+    Sends chat requests to the configured providers (see build_providers).
+    Providers are tried in priority order, healthy ones first: a provider whose
+    rolling latency is above its latency target or whose error rate is above
+    DEGRADED_ERROR_RATE goes behind the others, and one with an open circuit is
+    skipped. A failed or timed out call falls back to the next provider, usually
+    a faster or cheaper model. Under a job deadline, calls are cut short so the
+    fallback still fits before it (see call_timeout).
+    """
+
+    def __init__(self, env, providers, admission_controller):
+        self.env = env
+        self.providers = providers
+        self.admission_controller = admission_controller
+        self.health = {provider.name: ProviderHealth() for provider in providers}
+        self.fallbacks = 0
+
+    def degraded(self, provider):
+        health = self.health[provider.name]
+        return health.error_rate > DEGRADED_ERROR_RATE or (
+            health.latency_ms is not None and health.latency_ms > provider.latency_target_ms
+        )
+
+    def candidates(self):
+        """
+        Providers to try for the next request, in order.
+        """
+        ranked = sorted(
+            enumerate(self.providers),
+            key=lambda item: (self.degraded(item[1]), item[0]),
+        )
+        return [provider for _, provider in ranked if self.health[provider.name].available()]
+
+    def call_timeout(self, provider, has_fallback):
+        """
+        Seconds a call to provider may take, or None without a job deadline: its
+        timeout, capped by the time left before the deadline of the current task,
+        PRIMARY_SHARE of it when another provider may follow.
+        """
+        deadline = _call_deadline.get()
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if has_fallback:
+            remaining *= PRIMARY_SHARE
+        return min(provider.timeout, remaining)
+
+    def on_failure(self, provider, error):
+        health = self.health[provider.name]
+        health.record_failure()
+        if isinstance(error, HttpError) and error.status == 429:
+            self.admission_controller.on_rate_limited(provider.model, error.retry_after)
+        print(f"LLM provider {provider.name} ({provider.model}) failed: {error!r}")
+        if health.state == "open":
+            print(f"LLM provider {provider.name} circuit open for {health.open_seconds}s")
+
+    async def complete(self, messages, api_key, temperature=0.7, max_tokens=2000):
+        """
+        return the completion of the first provider that answers.
+        Raises LLMUnavailableError when all failed.
+        """
+        errors = []
+        candidates = self.candidates()
+        for index, provider in enumerate(candidates):
+            timeout = self.call_timeout(provider, index < len(candidates) - 1)
+            if timeout is not None and timeout <= 0:
+                break
+            if not self.health[provider.name].begin_call():
+                continue
+            if errors:
+                self.fallbacks += 1
+            estimated_tokens = await self.acquire(provider, messages, max_tokens)
+            started = time.time()
+            usage = None
+            try:
+                call = provider.complete(messages, provider.api_key(self.env, api_key), temperature, max_tokens)
+                completion = await (asyncio.wait_for(call, timeout) if timeout is not None else call)
+                usage = completion.get("usage") or {}
+            except Exception as e:
+                self.on_failure(provider, e)
+                errors.append(e)
+                continue
+            except BaseException:
+                # cancelled, e.g. by the job deadline: a half-open probe must not stay in flight
+                self.health[provider.name].record_failure()
+                raise
+            finally:
+                self.admission_controller.settle(provider.model, estimated_tokens, (usage or {}).get("total_tokens"))
+            latency_ms = (time.time() - started) * 1000
+            self.health[provider.name].record_success(latency_ms)
+            record_llm_usage(usage, latency_ms, provider.name)
+            return completion
+        print("No LLM provider answered")
+        raise self.unavailable(errors)
+
+    async def stream(self, messages, api_key, temperature=0.7, max_tokens=2000):
+        """
+        Yield the content deltas of the first provider whose stream starts.
+        A provider failing before its first delta falls back to the next one;
+        once content was yielded its errors are raised, as the caller already
+        consumed part of the answer. Raises LLMUnavailableError when no stream started.
+        """
+        errors = []
+        candidates = self.candidates()
+        for index, provider in enumerate(candidates):
+            timeout = self.call_timeout(provider, index < len(candidates) - 1)
+            if timeout is not None and timeout <= 0:
+                break
+            if not self.health[provider.name].begin_call():
+                continue
+            if errors:
+                self.fallbacks += 1
+            estimated_tokens = await self.acquire(provider, messages, max_tokens)
+            started = time.time()
+            usage = None
+            streamed = False
+            try:
+                deltas = provider.stream(messages, provider.api_key(self.env, api_key), temperature, max_tokens)
+                while True:
+                    step = deltas.__anext__()
+                    if timeout is not None and not streamed:
+                        # the stream must start before the call timeout
+                        step = asyncio.wait_for(step, started + timeout - time.time())
+                    try:
+                        content, event_usage = await step
+                    except StopAsyncIteration:
+                        break
+                    usage = event_usage or usage
+                    if content:
+                        streamed = True
+                        yield content
+            except Exception as e:
+                self.on_failure(provider, e)
+                if streamed:
+                    raise
+                errors.append(e)
+                continue
+            except BaseException:
+                # cancelled or closed by the caller: a half-open probe must not stay in flight
+                self.health[provider.name].record_failure()
+                raise
+            finally:
+                self.admission_controller.settle(provider.model, estimated_tokens, (usage or {}).get("total_tokens"))
+                record_llm_usage(usage, (time.time() - started) * 1000, provider.name)
+            self.health[provider.name].record_success((time.time() - started) * 1000)
+            return
+        raise self.unavailable(errors)
+
+    async def acquire(self, provider, messages, max_tokens):
+        """
+        Wait for the admission controller's budget for a call to provider.
+        """
+        try:
+            return await self.admission_controller.acquire(provider.model, messages, max_tokens)
+        except BaseException:
+            self.health[provider.name].cancel_call()
+            raise
+
+    def unavailable(self, errors):
+        retry_after = [error.retry_after for error in errors if getattr(error, "retry_after", None) is not None]
+        if not errors:
+            # every circuit is open: the first one to let a probe through
+            now = time.time()
+            retry_after = [
+                max(0.0, health.opened_at + health.open_seconds - now)
+                for health in self.health.values()
+                if health.state == "open"
+            ]
+        return LLMUnavailableError(errors, min(retry_after) if retry_after else None)
+
+    def snapshot(self):
+        return {
+            "fallbacks": self.fallbacks,
+            "providers": {
+                provider.name: {"model": provider.model, **self.health[provider.name].snapshot()}
+                for provider in self.providers
+            },
+        }
+
+
+_llm_router = None
+
+
+def get_llm_router(env):
+    """
+    Return the isolate-wide router over the providers of LLM_PROVIDERS, so
+    provider health is shared by all jobs of the isolate.
+    """
+    global _llm_router
+    if _llm_router is None:
+        _llm_router = LLMRouter(env, build_providers(env, get_http_client()), get_admission_controller(env))
+    return _llm_router
@@ -0,0 +1,53 @@
+import contextvars
+
+# usage of the job running in the current task, shared with the tasks it spawns
+_current_usage = contextvars.ContextVar("llm_usage", default=None)
+
+
+class LLMUsage:
+    """
+    Token counts and latency of the LLM calls made for one job.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.latency_ms = 0.0
+        self.providers = {}
+
+    def record(self, usage, latency_ms, provider=None):
+        usage = usage or {}
+        self.calls += 1
+        if provider:
+            self.providers[provider] = self.providers.get(provider, 0) + 1
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+        self.total_tokens += usage.get("total_tokens", 0)
+        self.latency_ms += latency_ms
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "promptTokens": self.prompt_tokens,
+            "completionTokens": self.completion_tokens,
+            "totalTokens": self.total_tokens,
+            "latencyMs": int(self.latency_ms),
+            "providers": dict(self.providers),
+        }
+
+
+def start_llm_usage():
+    """
+    Start collecting LLM usage for the current task and the tasks it creates.
+    """
+    usage = LLMUsage()
+    _current_usage.set(usage)
+    return usage
+
+
+def record_llm_usage(usage, latency_ms, provider=None):
+    current = _current_usage.get()
+    if current is not None:
+        current.record(usage, latency_ms, provider)
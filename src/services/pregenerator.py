@@ -0,0 +1,210 @@
+import json
+import time
+import traceback
+from utils import parse_timestamp
+from prompts import get_prompt_version
+from .dedup_registry import make_dedup_key
+from .demand_tracker import demand_period
+from .itinerary_planner import trip_max_tokens
+
+# pairs pre-generated per sweep, and the completion tokens a sweep may spend on them
+TOP_K = 20
+TOKEN_BUDGET = 60000
+# UTC hours [start, end) in which sweeps pre-generate; may wrap past midnight ("22-4")
+OFF_PEAK_HOURS = "2-6"
+# an itinerary older than this is generated again, ahead of the dedup freshness window
+REFRESH_AGE = 18 * 60 * 60
+CONCURRENCY = 2
+# Firestore IN filters take at most 30 values
+IN_FILTER_LIMIT = 30
+
+
+def parse_hours(hours):
+    start, _, end = str(hours).partition("-")
+    return int(start) % 24, int(end or start) % 24
+
+
+class Pregenerator:
+    """
+    Generates the itineraries most requested recently before anyone asks for them,
+    so create_itinerary finds them completed through the dedup lookup. Demand
+    comes from the weekly counters flushed by the isolates' DemandTrackers; the
+    current and the previous week are summed. Pairs whose itinerary is fresh or
+    being generated are skipped, and a sweep stops at its token budget, estimated
+    from the completion limits of the calls each trip takes: the outline and
+    every day range of a long trip. Only runs in the off-peak hours, when the LLM
+    rate limits have room to spare.
+    """
+
+    def __init__(
+        self,
+        itinerary_service,
+        top_k=TOP_K,
+        token_budget=TOKEN_BUDGET,
+        off_peak_hours=OFF_PEAK_HOURS,
+        refresh_age=REFRESH_AGE,
+        concurrency=CONCURRENCY,
+    ):
+        self.itinerary_service = itinerary_service
+        self.itinerary_repository = itinerary_service.itinerary_repository
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.off_peak_hours = parse_hours(off_peak_hours)
+        self.refresh_age = refresh_age
+        self.concurrency = concurrency
+
+    def off_peak(self, now):
+        start, end = self.off_peak_hours
+        hour = time.gmtime(now).tm_hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    async def top_demand(self, id_token, project_id, now):
+        """
+        return the top_k [{destination, durationDays, count}] of this and last week, most requested first.
+        """
+        periods = [demand_period(now), demand_period(now - 7 * 24 * 60 * 60)]
+        documents = await self.itinerary_repository.run_query(
+            id_token,
+            project_id,
+            self.itinerary_service.demand_collection,
+            {
+                "select": {
+                    "fields": [
+                        {"fieldPath": "destination"},
+                        {"fieldPath": "destinationKey"},
+                        {"fieldPath": "durationDays"},
+                        {"fieldPath": "count"},
+                    ]
+                },
+                "where": {
+                    "fieldFilter": {
+                        "field": {"fieldPath": "period"},
+                        "op": "IN",
+                        "value": {"arrayValue": {"values": [{"stringValue": period} for period in periods]}},
+                    }
+                },
+                "orderBy": [{"field": {"fieldPath": "count"}, "direction": "DESCENDING"}],
+                # a pair may be heavy in one week only, so read past top_k of each
+                "limit": self.top_k * 4,
+            },
+        )
+        demand = {}
+        for document in documents:
+            fields = document.get("fields", {})
+            pair = (fields["destinationKey"]["stringValue"], int(fields["durationDays"]["integerValue"]))
+            entry = demand.setdefault(
+                pair,
+                {
+                    "destination": fields["destination"]["stringValue"],
+                    "durationDays": pair[1],
+                    "count": 0,
+                },
+            )
+            entry["count"] += int(fields.get("count", {}).get("integerValue", 0))
+        return sorted(demand.values(), key=lambda entry: entry["count"], reverse=True)[: self.top_k]
+
+    async def covered_keys(self, dedup_keys, id_token, project_id, collection, now):
+        """
+        return the dedup keys with an itinerary younger than refresh_age or still in flight.
+        """
+        covered = set()
+        in_flight_window = self.itinerary_service.dedup_registry.in_flight_window
+        for start in range(0, len(dedup_keys), IN_FILTER_LIMIT):
+            chunk = dedup_keys[start: start + IN_FILTER_LIMIT]
+            documents = await self.itinerary_repository.run_query(
+                id_token,
+                project_id,
+                collection,
+                {
+                    "select": {
+                        "fields": [
+                            {"fieldPath": "dedupKey"},
+                            {"fieldPath": "status"},
+                            {"fieldPath": "createdAt"},
+                            {"fieldPath": "completedAt"},
+                        ]
+                    },
+                    "where": {
+                        "fieldFilter": {
+                            "field": {"fieldPath": "dedupKey"},
+                            "op": "IN",
+                            "value": {"arrayValue": {"values": [{"stringValue": key} for key in chunk]}},
+                        }
+                    },
+                },
+            )
+            for document in documents:
+                fields = document.get("fields", {})
+                status = fields.get("status", {}).get("stringValue")
+                if status == "completed" and "completedAt" in fields:
+                    if now - parse_timestamp(fields["completedAt"]["timestampValue"]) < self.refresh_age:
+                        covered.add(fields["dedupKey"]["stringValue"])
+                elif status in ("processing", "partial") and "createdAt" in fields:
+                    if now - parse_timestamp(fields["createdAt"]["timestampValue"]) < in_flight_window:
+                        covered.add(fields["dedupKey"]["stringValue"])
+        return covered
+
+    async def sweep(self, id_token, project_id, collection, llm_api_key, ctx, force=False):
+        """
+        Pre-generate the most requested itineraries that are missing or stale.
+        force runs outside the off-peak hours. Logs and returns the counters of the sweep.
+        """
+        started = time.time()
+        summary = {"ran": False, "candidates": 0, "covered": 0, "generated": 0, "estimated_tokens": 0}
+        if not force and not self.off_peak(started):
+            return summary
+        summary["ran"] = True
+
+        try:
+            await self.itinerary_service.flush_demand(id_token, project_id)
+            top = await self.top_demand(id_token, project_id, started)
+            prompt_version = get_prompt_version()
+            for entry in top:
+                entry["dedupKey"] = make_dedup_key(entry["destination"], entry["durationDays"], prompt_version)
+            covered = await self.covered_keys(
+                [entry["dedupKey"] for entry in top], id_token, project_id, collection, started
+            )
+            summary["candidates"] = len(top)
+            summary["covered"] = len(covered)
+
+            selected = []
+            for entry in top:
+                if entry["dedupKey"] in covered:
+                    continue
+                estimated_tokens = trip_max_tokens(entry["durationDays"])
+                if summary["estimated_tokens"] + estimated_tokens > self.token_budget:
+                    summary["budget_exhausted"] = True
+                    break
+                summary["estimated_tokens"] += estimated_tokens
+                selected.append(entry)
+
+            if selected:
+                documents = []
+                for entry in selected:
+                    document = self.itinerary_service.build_processing_document(
+                        entry["destination"], entry["durationDays"], entry["dedupKey"]
+                    )
+                    document["fields"]["pregenerated"] = {"booleanValue": True}
+                    documents.append(document)
+                document_ids = await self.itinerary_repository.batch_insert_documents(
+                    id_token, project_id, collection, documents
+                )
+                if not document_ids:
+                    raise Exception("Failed to create pre-generated itinerary documents")
+                jobs = [
+                    (document_id, entry["dedupKey"], entry["destination"], entry["durationDays"])
+                    for document_id, entry in zip(document_ids, selected)
+                ]
+                await self.itinerary_service.run_jobs(
+                    jobs, id_token, project_id, collection, llm_api_key, ctx, self.concurrency
+                )
+                summary["generated"] = len(jobs)
+        except Exception:
+            print("Pregenerator sweep Error:", traceback.format_exc())
+            summary["error"] = True
+
+        summary["duration_ms"] = int((time.time() - started) * 1000)
+        print(json.dumps({"type": "pregenerate", **summary}))
+        return summary
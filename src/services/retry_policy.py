@@ -0,0 +1,145 @@
+import asyncio
+import json
+import random
+import time
+from utils import utc_timestamp
+from utils.http_client import HttpError, HttpTimeoutError
+from .itinerary_output import ItineraryParseError
+from .llm_router import LLMUnavailableError, reset_call_deadline, set_call_deadline
+
+# error classes of a failed job attempt
+RETRYABLE = "retryable"
+AUTH_REFRESH = "auth_refresh"
+FATAL = "fatal"
+PARSE_REPAIRABLE = "parse_repairable"
+
+# waitUntil work is cancelled 30 seconds after the response: jobs run under it stop before
+WAIT_UNTIL_DEADLINE = 28
+# queue consumers and scheduled handlers have minutes of wall time
+BACKGROUND_DEADLINE = 600
+MAX_ATTEMPTS = 3
+BASE_DELAY = 1.0
+MAX_DELAY = 20.0
+# characters of the error message kept per attempt on the document, and attempts kept
+ERROR_CHARS = 300
+MAX_HISTORY = 20
+
+AUTH_STATUSES = (401, 403)
+
+
+def classify_error(error):
+    """
+    Class of the exception that failed a job attempt:
+    retryable: transient (timeouts, 408, 429, 5xx, no LLM provider answered), retried after a backoff;
+    auth_refresh: Firestore rejected the ID token, retried at once with a new token;
+    parse_repairable: the LLM answered with unusable output, retried at once as the next sample usually parses;
+    fatal: cannot succeed as is (other 4xx, an LLM API key rejected by every provider), not retried.
+    Unknown exceptions are retryable, as before the policy; a chained cause is classified instead.
+    """
+    if isinstance(error, (ItineraryParseError, json.JSONDecodeError)):
+        return PARSE_REPAIRABLE
+    if isinstance(error, LLMUnavailableError):
+        if not error.errors:
+            # every circuit was open
+            return RETRYABLE
+        classes = [classify_provider_error(provider_error) for provider_error in error.errors]
+        return RETRYABLE if RETRYABLE in classes else FATAL
+    if isinstance(error, HttpError):
+        if error.status in AUTH_STATUSES:
+            return AUTH_REFRESH
+        return RETRYABLE if error.retryable else FATAL
+    if isinstance(error, (HttpTimeoutError, asyncio.TimeoutError, OSError)):
+        return RETRYABLE
+    if error.__cause__ is not None:
+        return classify_error(error.__cause__)
+    return RETRYABLE
+
+
+def classify_provider_error(error):
+    # a 401/403 from an LLM provider is a bad API key: a new Firestore token does not help
+    if isinstance(error, HttpError):
+        return RETRYABLE if error.retryable else FATAL
+    return classify_error(error)
+
+
+class RetryPolicy:
+    """
+    Decides after each failed attempt of one job whether and when to try again.
+    Backoffs use decorrelated jitter, min(max_delay, uniform(base_delay, 3 * previous)),
+    unless the error carries a Retry-After; auth and parse failures retry at once.
+    The job has a deadline: an attempt is only started when the delay before it and
+    the duration of the last attempt fit in the time left, and attempts are bounded
+    by it. Every failure is recorded with its class and delay in `attempts`, after
+    the `history` of earlier runs of the job.
+    """
+
+    def __init__(
+        self,
+        deadline_seconds=BACKGROUND_DEADLINE,
+        max_attempts=MAX_ATTEMPTS,
+        base_delay=BASE_DELAY,
+        max_delay=MAX_DELAY,
+        classify=classify_error,
+        history=None,
+    ):
+        self.deadline = time.time() + deadline_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+        self.previous_delay = base_delay
+        self.attempts = list(history or [])[-MAX_HISTORY:]
+        self.reason = None
+
+    def remaining(self):
+        return self.deadline - time.time()
+
+    async def run(self, coroutine):
+        """
+        Await one attempt, cancelled when the deadline passes. LLM calls of the
+        attempt are cut short to leave time for their fallback provider.
+        """
+        token = set_call_deadline(self.deadline)
+        try:
+            return await asyncio.wait_for(coroutine, max(self.remaining(), 0.001))
+        finally:
+            reset_call_deadline(token)
+
+    def backoff(self, error_class, retry_after):
+        if error_class in (AUTH_REFRESH, PARSE_REPAIRABLE):
+            return 0.0
+        if retry_after is not None:
+            return float(retry_after)
+        self.previous_delay = min(self.max_delay, random.uniform(self.base_delay, self.previous_delay * 3))
+        return self.previous_delay
+
+    def on_failure(self, attempt, error, duration):
+        """
+        Record the failure of attempt `attempt` (1-based), which ran for `duration` seconds.
+        return (error class, delay before the next attempt), the delay is None to give up,
+        with the reason in self.reason.
+        """
+        error_class = self.classify(error)
+        delay = None
+        if error_class == FATAL:
+            self.reason = "fatal error"
+        elif attempt >= self.max_attempts:
+            self.reason = f"{attempt} attempts failed"
+        else:
+            delay = self.backoff(error_class, getattr(error, "retry_after", None))
+            # the next attempt would need about as long as this one
+            if delay + duration > self.remaining():
+                self.reason = "deadline exceeded"
+                delay = None
+        self.attempts = self.attempts[-(MAX_HISTORY - 1):]
+        self.attempts.append(
+            {
+                "attempt": attempt,
+                "class": error_class,
+                "error": (str(error) or type(error).__name__)[:ERROR_CHARS],
+                "durationMs": int(duration * 1000),
+                "delayMs": int(delay * 1000) if delay is not None else None,
+                "at": utc_timestamp(),
+            }
+        )
+        return error_class, delay
@@ -1,4 +1,25 @@
+from .cache import LayeredCache, LRUCache, InMemoryKVStore, WorkersKVStore, get_itinerary_cache
 from .gcp_helper import GCPAuthHelper
+from .http_client import HttpClient, HttpError, HttpTimeoutError, get_http_client, set_http_client
+from .token_manager import FirebaseTokenManager, get_token_manager
+from .time_helper import parse_timestamp, utc_timestamp
 from .url_helper import URLHelper
 
-__all__ = ["GCPAuthHelper", "URLHelper"]
\ No newline at end of file
+__all__ = [
+    "LayeredCache",
+    "LRUCache",
+    "InMemoryKVStore",
+    "WorkersKVStore",
+    "get_itinerary_cache",
+    "GCPAuthHelper",
+    "HttpClient",
+    "HttpError",
+    "HttpTimeoutError",
+    "get_http_client",
+    "set_http_client",
+    "FirebaseTokenManager",
+    "get_token_manager",
+    "parse_timestamp",
+    "utc_timestamp",
+    "URLHelper",
+]
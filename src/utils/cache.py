@@ -0,0 +1,175 @@
+import json
+import time
+import traceback
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Size-bounded in-isolate cache with optional per-entry TTL.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InMemoryKVStore:
+    """
+    Local stand-in for a Workers KV namespace, used when no binding is configured.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    async def get(self, key):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.time() >= expires_at:
+            del self._values[key]
+            return None
+        return value
+
+    async def put(self, key, value, ttl=None):
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    async def delete(self, key):
+        self._values.pop(key, None)
+
+
+class WorkersKVStore:
+    """
+    Edge store backed by a Workers KV namespace binding.
+    """
+
+    # KV rejects expirationTtl values below 60 seconds
+    MIN_TTL = 60
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    async def get(self, key):
+        value = await self.namespace.get(key)
+        return value if value else None
+
+    async def put(self, key, value, ttl=None):
+        if ttl:
+            from js import Object
+            from pyodide.ffi import to_js
+
+            options = to_js(
+                {"expirationTtl": max(int(ttl), self.MIN_TTL)},
+                dict_converter=Object.fromEntries,
+            )
+            await self.namespace.put(key, value, options)
+        else:
+            await self.namespace.put(key, value)
+
+    async def delete(self, key):
+        await self.namespace.delete(key)
+
+
+class LayeredCache:
+    """
+    Read-through cache: an in-isolate LRU in front of a shared KV store.
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, kv_store=None, max_size=256, prefix=""):
+        self.local = LRUCache(max_size)
+        self.kv_store = kv_store if kv_store is not None else InMemoryKVStore()
+        self.prefix = prefix
+        self.local_hits = 0
+        self.kv_hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        try:
+            raw = await self.kv_store.get(self.prefix + key)
+        except Exception:
+            print("LayeredCache get Error:", traceback.format_exc())
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.kv_hits += 1
+        value = json.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    async def set(self, key, value, ttl=None, persist=True):
+        """
+        Store value locally and, when `persist` is set, in the KV store too.
+        Short-lived values should pass persist=False to stay isolate-local.
+        """
+        self.local.set(key, value, ttl)
+        if not persist:
+            return
+        try:
+            await self.kv_store.put(self.prefix + key, json.dumps(value), ttl)
+        except Exception:
+            print("LayeredCache set Error:", traceback.format_exc())
+
+    async def delete(self, key):
+        self.local.delete(key)
+        try:
+            await self.kv_store.delete(self.prefix + key)
+        except Exception:
+            print("LayeredCache delete Error:", traceback.format_exc())
+
+    def stats(self):
+        hits = self.local_hits + self.kv_hits
+        total = hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "kv_hits": self.kv_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "local_size": len(self.local),
+        }
+
+
+_itinerary_cache = None
+
+
+def get_itinerary_cache(env):
+    """
+    Return the isolate-wide itinerary cache, backed by the ITINERARY_CACHE KV
+    binding when it is configured and by an in-memory store otherwise.
+    """
+    global _itinerary_cache
+    if _itinerary_cache is None:
+        namespace = getattr(env, "ITINERARY_CACHE", None)
+        kv_store = WorkersKVStore(namespace) if namespace is not None else None
+        _itinerary_cache = LayeredCache(kv_store, max_size=512, prefix="itinerary:")
+    return _itinerary_cache
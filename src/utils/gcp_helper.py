@@ -1,36 +1,81 @@
-from workers import handler, fetch, Response
-import json
 import traceback
+from .http_client import HttpError, get_http_client
 
 class GCPAuthHelper:
+    def __init__(self, http_client=None):
+        self.http_client = http_client or get_http_client()
+
     async def sign_in_with_password(self, email, password, api_key):
         """
         Sign in a user with email and password. get firebase api.
         return idToken value to use in other requests.
         """
+        identity_response = await self.sign_in(email, password, api_key)
+        if not identity_response:
+            return None
+        return identity_response["idToken"]
+
+    async def sign_in(self, email, password, api_key):
+        """
+        Sign in a user with email and password.
+        return the identity response (idToken, refreshToken, expiresIn, ...), or None
+        when the credentials are rejected. Transient failures (timeouts, 429, 5xx) raise.
+        """
         url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={api_key}"
 
         payload = {"email": email, "password": password, "returnSecureToken": True}
-        data = json.dumps(payload).encode("utf-8")
 
         try:
-            resp = await fetch(
+            resp = await self.http_client.request(
+                "POST",
                 url,
-                method="POST",
-                headers={"Content-Type": "application/json"},
-                body=data,
+                json_body=payload,
+                timeout=10,
+                idempotent=True,
+                endpoint="identitytoolkit.signIn",
             )
-            if resp.status != 200:
-                print("sign_in_with_password Error:", resp.body)
-                return None
-
-            identity_response = await resp.json()
-            print("Identity Response:", identity_response)
-            id_token = identity_response.get("idToken")
-            if not id_token:
+            identity_response = resp.json()
+            if not identity_response.get("idToken"):
                 raise ValueError("ID Token not found in response")
 
-            return id_token
+            return identity_response
+        except HttpError as e:
+            print("sign_in Error:", e.status)
+            if e.retryable:
+                raise
+            return None
+        except Exception as e:
+            print("sign_in Error:", traceback.format_exc())
+            raise
+
+    async def refresh_id_token(self, refresh_token, api_key):
+        """
+        Exchange a refresh token for a new idToken without re-sending the password.
+        return a dict with idToken, refreshToken and expiresIn, or None if the refresh token was rejected.
+        """
+        url = f"https://securetoken.googleapis.com/v1/token?key={api_key}"
+
+        payload = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+
+        try:
+            resp = await self.http_client.request(
+                "POST",
+                url,
+                json_body=payload,
+                timeout=10,
+                idempotent=True,
+                endpoint="securetoken.refresh",
+            )
+            token_response = resp.json()
+            # securetoken answers in snake_case, map it to the sign-in shape
+            return {
+                "idToken": token_response["id_token"],
+                "refreshToken": token_response["refresh_token"],
+                "expiresIn": token_response["expires_in"],
+            }
+        except HttpError as e:
+            print("refresh_id_token Error:", e.status)
+            return None
         except Exception as e:
-            print("sign_in_with_password Error:", traceback.format_exc())
-            raise
\ No newline at end of file
+            print("refresh_id_token Error:", traceback.format_exc())
+            raise
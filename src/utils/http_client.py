@@ -0,0 +1,322 @@
+import asyncio
+import bisect
+import json
+import random
+import time
+from .tracing import span
+
+# statuses worth retrying: the request was throttled or the upstream had a transient fault
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class HttpError(Exception):
+    """
+    Raised for non-2xx responses. Carries the status, body and parsed Retry-After.
+    """
+
+    def __init__(self, status, body=b"", headers=None, url=""):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.url = url
+        self.retry_after = parse_retry_after(self.headers.get("retry-after"))
+        super().__init__(f"HTTP {status} from {url.split('?')[0]}")
+
+    @property
+    def retryable(self):
+        return self.status in RETRYABLE_STATUSES
+
+
+class HttpTimeoutError(Exception):
+    """
+    Raised when a call does not complete before its deadline.
+    """
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header (delta seconds or HTTP date) into seconds, or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP dates are rare, keep email.utils out of the cold start
+    import email.utils
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpResponse:
+    def __init__(self, status, headers=None, body=b"", stream=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+        self.stream = stream
+
+    def text(self):
+        return self.body.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+    async def iter_bytes(self):
+        """
+        Iterate over the body as it arrives (stream=True requests), or yield it whole.
+        """
+        if self.stream is None:
+            yield self.body
+            return
+        async for chunk in self.stream:
+            yield chunk
+
+
+class WorkersFetchTransport:
+    """
+    Default transport: the Workers runtime fetch.
+    """
+
+    async def send(self, method, url, headers, body, stream=False):
+        from workers import fetch
+
+        resp = await fetch(url, method=method, headers=headers, body=body)
+        response_headers = {key.lower(): value for key, value in resp.js_object.headers.entries()}
+        if stream and 200 <= resp.status < 300:
+            return HttpResponse(resp.status, response_headers, stream=self._iter_body(resp))
+        body = (await resp.js_object.arrayBuffer()).to_bytes()
+        return HttpResponse(resp.status, response_headers, body)
+
+    async def _iter_body(self, resp):
+        reader = resp.js_object.body.getReader()
+        while True:
+            chunk = await reader.read()
+            if chunk.done:
+                break
+            yield chunk.value.to_bytes()
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (milliseconds) with approximate percentiles.
+    """
+
+    BOUNDS = (5, 10, 25, 50, 75, 100, 150, 250, 400, 600, 1000, 1500, 2500, 4000, 6000, 10000, 20000, 40000, 60000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, milliseconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+
+    def percentile(self, fraction):
+        """
+        return the upper bound of the bucket holding the given fraction of samples.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) else self.BOUNDS[-1]
+        return self.BOUNDS[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 2) if self.count else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+        }
+
+
+class HttpClient:
+    """
+    Async HTTP client shared by the repositories, auth helper and LLM calls.
+    Every call has a deadline; idempotent calls are retried on timeouts and
+    retryable statuses with Retry-After-aware full-jitter backoff; GETs may be
+    hedged with a duplicate request once they run past the endpoint's p95.
+    """
+
+    def __init__(
+        self,
+        transport=None,
+        timeout=30,
+        max_retries=2,
+        base_backoff=0.2,
+        max_backoff=8,
+        hedge_min_samples=20,
+        hedge_min_delay=0.05,
+    ):
+        self.transport = transport or WorkersFetchTransport()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.histograms = {}
+        self.retries = 0
+        self.hedges = 0
+
+    async def request(
+        self,
+        method,
+        url,
+        headers=None,
+        body=None,
+        json_body=None,
+        timeout=None,
+        idempotent=None,
+        retries=None,
+        hedge=False,
+        endpoint=None,
+        stream=False,
+    ):
+        """
+        Send a request and return the HttpResponse.
+        Raises HttpError for non-2xx statuses and HttpTimeoutError past the deadline.
+        """
+        headers = dict(headers or {})
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if retries is None:
+            retries = self.max_retries if idempotent else 0
+        endpoint = endpoint or f"{method} {url.split('://', 1)[-1].split('/', 1)[0]}"
+        deadline = time.time() + (timeout or self.timeout)
+
+        with span(endpoint, request_bytes=len(body or b"")) as request_span:
+            resp = await self._request(
+                method, url, headers, body, deadline, retries, hedge, endpoint, stream, request_span
+            )
+            request_span.set(status=resp.status, response_bytes=len(resp.body or b""))
+            return resp
+
+    async def _request(self, method, url, headers, body, deadline, retries, hedge, endpoint, stream, request_span):
+        attempt = 0
+        while True:
+            try:
+                if hedge and method == "GET" and not stream:
+                    resp = await self._send_hedged(method, url, headers, body, deadline, endpoint)
+                else:
+                    resp = await self._send(method, url, headers, body, deadline, endpoint, stream)
+                if 200 <= resp.status < 300:
+                    return resp
+                error = HttpError(resp.status, resp.body, resp.headers, url)
+                if not error.retryable:
+                    request_span.set(status=error.status, attempts=attempt + 1)
+                    raise error
+            except HttpError:
+                raise
+            except Exception as e:
+                # timeouts and connection failures
+                error = e
+
+            delay = self._backoff(attempt, getattr(error, "retry_after", None))
+            if attempt >= retries or time.time() + delay >= deadline:
+                request_span.set(status=getattr(error, "status", type(error).__name__), attempts=attempt + 1)
+                raise error
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2**attempt))
+
+    async def _send(self, method, url, headers, body, deadline, endpoint, stream=False):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise HttpTimeoutError(f"{endpoint} deadline exceeded")
+        started = time.time()
+        try:
+            resp = await asyncio.wait_for(
+                self.transport.send(method, url, headers, body, stream=stream), remaining
+            )
+        except asyncio.TimeoutError:
+            self.histogram(endpoint).record((time.time() - started) * 1000)
+            raise HttpTimeoutError(f"{endpoint} timed out after {remaining:.2f}s")
+        self.histogram(endpoint).record((time.time() - started) * 1000)
+        return resp
+
+    async def _send_hedged(self, method, url, headers, body, deadline, endpoint):
+        primary = asyncio.ensure_future(self._send(method, url, headers, body, deadline, endpoint))
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        hedged = asyncio.ensure_future(self._send(method, url, headers, body, deadline, endpoint))
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def hedge_delay(self, endpoint):
+        """
+        return how long to wait before hedging a GET, or None while there is too little data.
+        """
+        histogram = self.histograms.get(endpoint)
+        if histogram is None or histogram.count < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, histogram.percentile(0.95) / 1000)
+
+    def histogram(self, endpoint):
+        histogram = self.histograms.get(endpoint)
+        if histogram is None:
+            histogram = self.histograms[endpoint] = LatencyHistogram()
+        return histogram
+
+    def stats(self):
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "endpoints": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+
+_http_client = None
+
+
+def get_http_client():
+    """
+    Return the isolate-wide HTTP client, so latency histograms are shared.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = HttpClient()
+    return _http_client
+
+
+def set_http_client(client):
+    """
+    Replace the isolate-wide HTTP client, e.g. with one using a local fake transport.
+    """
+    global _http_client
+    _http_client = client
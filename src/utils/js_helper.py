@@ -0,0 +1,25 @@
+import asyncio
+
+
+def python_coroutine_to_js_promise(coro):
+    """Convert Python coroutine to JavaScript Promise"""
+    from js import Promise
+
+    async def wrapper():
+        try:
+            result = await coro
+            return result
+        except Exception as e:
+            print(f"💥 [WRAPPER] Error in background task: {e}")
+            raise e
+
+    # Create a JavaScript Promise that resolves the Python coroutine
+    return Promise.new(
+        lambda resolve, reject: asyncio.create_task(wrapper()).add_done_callback(
+            lambda task: (
+                resolve(None)
+                if task.exception() is None
+                else reject(task.exception())
+            )
+        )
+    )
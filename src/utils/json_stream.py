@@ -0,0 +1,81 @@
+import json
+import re
+
+# a comma right before a closing bracket, the most common way LLMs break JSON
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def loads_lenient(text):
+    """
+    json.loads that also accepts trailing commas.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(TRAILING_COMMA.sub(r"\1", text))
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for a top-level JSON array arriving in text chunks.
+    feed() returns the array elements that were completed by the chunk, so
+    each element is available as soon as its closing bracket arrives.
+    Text before the array (code fences, chatter, bracketed words like "[3-day]")
+    is skipped: the array starts at the first "[" followed by an object.
+    An element that cannot be parsed stops the parser with `failed` set, so the
+    elements before it can still be used.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.failed = False
+        self._candidate = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element = []
+
+    def feed(self, text):
+        elements = []
+        for char in text:
+            if self.finished or self.failed:
+                break
+            if not self.started:
+                if char == "[":
+                    self._candidate = True
+                elif self._candidate and not char.isspace():
+                    self._candidate = False
+                    if char == "{":
+                        self.started = True
+                        self._depth = 1
+                        self._element = [char]
+                continue
+
+            if self._depth > 0:
+                self._element.append(char)
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif char == "\\":
+                        self._escape = True
+                    elif char == '"':
+                        self._in_string = False
+                elif char == '"':
+                    self._in_string = True
+                elif char in "[{":
+                    self._depth += 1
+                elif char in "]}":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        try:
+                            elements.append(loads_lenient("".join(self._element)))
+                        except json.JSONDecodeError:
+                            self.failed = True
+                        self._element = []
+            elif char in "[{":
+                self._depth = 1
+                self._element = [char]
+            elif char == "]":
+                self.finished = True
+        return elements
@@ -0,0 +1,65 @@
+import codecs
+
+
+class SSEDecoder:
+    """
+    Decoder for a text/event-stream body. feed() takes raw chunks and returns
+    the data payload of every event completed by the chunk.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = ""
+        self._data = []
+
+    def feed(self, chunk):
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = self._decoder.decode(chunk)
+        self._buffer += chunk
+        events = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            line = line.rstrip("\r")
+            if not line:
+                if self._data:
+                    events.append("\n".join(self._data))
+                    self._data = []
+            elif line.startswith("data:"):
+                self._data.append(line[5:].lstrip(" "))
+        return events
+
+
+
+def encode_sse_event(data, event=None, event_id=None):
+    """
+    Encode one text/event-stream event. Multi-line data is split over data: lines.
+    """
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in str(data).split("\n"):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventStream:
+    """
+    Server-Sent Events response body backed by a Workers TransformStream.
+    Return `readable` as the Response body and write events from a background task.
+    """
+
+    def __init__(self):
+        from js import TextEncoder, TransformStream
+
+        stream = TransformStream.new()
+        self.readable = stream.readable
+        self._writer = stream.writable.getWriter()
+        self._encoder = TextEncoder.new()
+
+    async def send(self, data, event=None, event_id=None):
+        await self._writer.write(self._encoder.encode(encode_sse_event(data, event, event_id)))
+
+    async def close(self):
+        await self._writer.close()
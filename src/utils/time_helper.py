@@ -0,0 +1,21 @@
+import calendar
+import time
+
+
+def utc_timestamp(seconds=None):
+    """
+    Format epoch seconds (default now) as a Firestore timestampValue.
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def parse_timestamp(value):
+    """
+    Parse a Firestore timestampValue ("2024-01-01T10:00:00.123456Z") into epoch seconds.
+    """
+    value = value.rstrip("Z")
+    seconds, _, fraction = value.partition(".")
+    parsed = calendar.timegm(time.strptime(seconds, "%Y-%m-%dT%H:%M:%S"))
+    if fraction:
+        parsed += float("0." + fraction)
+    return parsed
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import traceback
+from .gcp_helper import GCPAuthHelper
+from .tracing import span
+
+
+class FirebaseTokenManager:
+    """
+    Keeps the Firebase idToken/refreshToken pair for the lifetime of the isolate.
+    The token is refreshed `refresh_margin` seconds before it expires and concurrent
+    callers share a single in-flight sign-in or refresh.
+    """
+
+    def __init__(self, email, password, api_key, refresh_margin=300, gcp_auth_helper=None):
+        self.email = email
+        self.password = password
+        self.api_key = api_key
+        self.refresh_margin = refresh_margin
+        self.gcp_auth_helper = gcp_auth_helper or GCPAuthHelper()
+        self.id_token = None
+        self.refresh_token = None
+        self.expires_at = 0
+        self._pending = None
+
+    def _is_fresh(self):
+        return self.id_token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    async def get_id_token(self):
+        """
+        Return a valid idToken, signing in or refreshing only when needed.
+        """
+        if self._is_fresh():
+            return self.id_token
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._renew())
+        pending = self._pending
+        try:
+            return await asyncio.shield(pending)
+        finally:
+            if self._pending is pending and pending.done():
+                self._pending = None
+
+    def invalidate(self, stale_token=None):
+        """
+        Drop the cached idToken. When `stale_token` is given the cache is only
+        dropped if it still holds that token, so a burst of 401s renews once.
+        """
+        if stale_token is not None and stale_token != self.id_token:
+            return
+        self.id_token = None
+        self.expires_at = 0
+
+    async def _renew(self):
+        with span("auth.renew") as renew_span:
+            return await self._renew_token(renew_span)
+
+    async def _renew_token(self, renew_span):
+        identity_response = None
+        if self.refresh_token:
+            renew_span.set(method="refresh")
+            try:
+                identity_response = await self.gcp_auth_helper.refresh_id_token(
+                    self.refresh_token, self.api_key
+                )
+            except Exception:
+                print("FirebaseTokenManager refresh Error:", traceback.format_exc())
+        if not identity_response:
+            renew_span.set(method="sign_in")
+            identity_response = await self.gcp_auth_helper.sign_in(
+                self.email, self.password, self.api_key
+            )
+        if not identity_response:
+            renew_span.status = "error"
+            self.refresh_token = None
+            return None
+
+        self.id_token = identity_response["idToken"]
+        self.refresh_token = identity_response.get("refreshToken")
+        self.expires_at = time.time() + int(identity_response.get("expiresIn", 3600))
+        return self.id_token
+
+
+_token_managers = {}
+
+
+def get_token_manager(env):
+    """
+    Return the isolate-wide token manager for the Firebase user configured in env.
+    """
+    key = (env.FIREBASE_EMAIL, env.FIREBASE_API_KEY)
+    token_manager = _token_managers.get(key)
+    if token_manager is None:
+        token_manager = FirebaseTokenManager(
+            env.FIREBASE_EMAIL, env.FIREBASE_PASSWORD, env.FIREBASE_API_KEY
+        )
+        _token_managers[key] = token_manager
+    return token_manager
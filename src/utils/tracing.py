@@ -0,0 +1,142 @@
+import contextvars
+import json
+import random
+import time
+
+DEFAULT_SAMPLE_RATE = 0.1
+
+# innermost open span of the trace running in the current task
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.children = []
+        self.start = time.time()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self):
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def to_dict(self, origin):
+        span = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration_ms, 2),
+            "status": self.status,
+        }
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.children:
+            span["children"] = [child.to_dict(origin) for child in self.children]
+        return span
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time()
+        if exc_type is not None and self.status == "ok":
+            self.status = "error"
+            self.attributes.setdefault("error", exc_type.__name__)
+        _current_span.reset(self._token)
+        return False
+
+
+class _NoopSpan:
+    """
+    Stands in for spans of unsampled work, so instrumentation costs a function call.
+    """
+
+    status = "ok"
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """
+    Root span of a sampled request or job. end() closes it, logs the span tree as
+    one JSON line and returns it; server_timing() summarizes it for the header.
+    """
+
+    def __init__(self, name, attributes=None):
+        self.root = Span(name, attributes)
+        # never a child: the span inherited by a job comes from the request that started it
+        _current_span.set(None)
+        self.root.__enter__()
+
+    def end(self, **attributes):
+        self.root.set(**attributes)
+        if self.root.end is None:
+            self.root.__exit__(None, None, None)
+        line = {"type": "trace", **self.root.to_dict(self.root.start)}
+        print(json.dumps(line, default=str))
+        return line
+
+    def server_timing(self):
+        """
+        Server-Timing header value: total duration and duration per span name.
+        """
+        totals = {}
+
+        def collect(span):
+            for child in span.children:
+                name = child.name.replace(" ", "_")
+                duration, count = totals.get(name, (0.0, 0))
+                totals[name] = (duration + child.duration_ms, count + 1)
+                collect(child)
+
+        collect(self.root)
+        entries = [f"total;dur={self.root.duration_ms:.1f}"]
+        for name, (duration, count) in totals.items():
+            entries.append(f'{name};dur={duration:.1f};desc="{count}x"')
+        return ", ".join(entries)
+
+
+def start_trace(name, sample_rate=DEFAULT_SAMPLE_RATE, **attributes):
+    """
+    Start a trace for the current task with probability sample_rate.
+    return the Trace, or None when the work is not sampled.
+    Either way the task leaves the trace it inherited: background jobs started
+    under waitUntil or the in-memory queue copy the context of the request, whose
+    trace is emitted when the response is sent.
+    """
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        _current_span.set(None)
+        return None
+    return Trace(name, attributes)
+
+
+def span(name, **attributes):
+    """
+    Context manager timing a unit of work as a child of the current span.
+    Outside a sampled trace this is a no-op.
+    """
+    if _current_span.get() is None:
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+def get_sample_rate(env):
+    return float(getattr(env, "TRACE_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
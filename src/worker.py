@@ -1,16 +1,119 @@
+import asyncio
 import time
-from workers import handler, fetch, Response
-import os, json
+from workers import Response
+import json
+from urllib.parse import unquote
+import hashlib
 import traceback
-from repositories import ItineraryRepository
-from utils import GCPAuthHelper, URLHelper
-from services import ItineraryService
+from repositories import InvalidPageToken, decode_itinerary_fields, decode_value, get_itinerary_repository
+from utils import HttpError, HttpTimeoutError, URLHelper, get_http_client, get_itinerary_cache, get_token_manager, parse_timestamp, utc_timestamp
+from utils.js_helper import python_coroutine_to_js_promise
+from utils.sse import EventStream
+from utils.tracing import get_sample_rate, start_trace
+# services is imported lazily: ItineraryService and its prompt and planner modules
+# are only loaded by the first request that creates an itinerary, not by polls
+from services import get_job_notifier
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# bodies of the constant responses, encoded once per isolate
+INVALID_ENDPOINT_BODY = json.dumps({"error": "Invalid endpoint"})
+UNAUTHENTICATED_BODY = json.dumps({"error": "Failed to authenticate"})
+AUTH_UNAVAILABLE_BODY = json.dumps({"error": "Authentication service unavailable, retry later"})
+INTERNAL_ERROR_BODY = json.dumps({"error": "Internal server error"})
+ID_REQUIRED_BODY = json.dumps({"error": "id is required"})
+IDS_REQUIRED_BODY = json.dumps({"error": "ids is required"})
+INVALID_WAIT_BODY = json.dumps({"error": "wait must be a non-negative number of seconds"})
+NOT_FOUND_BODY = json.dumps({
+    "success": 'false',
+    "status": "not_found",
+    "message": "Itinerary not found"
+})
+INVALID_CREATE_BODY = json.dumps({"error": "Invalid input: 'destination' and 'durationDays' are required"})
+# how a create request was answered: a new job, a job already in flight, or an
+# itinerary that is already complete (clients need not poll those)
+CREATE_MESSAGES = {
+    "created": "Itinerary generation started",
+    "deduplicated": "Itinerary generation already in progress",
+    "completed": "Itinerary already generated",
+    "derived": "Itinerary derived from an existing itinerary",
+}
+READY_CREATE_STATUSES = ("completed", "derived")
+# trips longer than this are refused: every range of CHUNK_DAYS days is a paid LLM call
+MAX_DURATION_DAYS = 30
+DURATION_DAYS_ERROR = f"'durationDays' must be a whole number of days from 1 to {MAX_DURATION_DAYS}"
+INVALID_DURATION_BODY = json.dumps({"error": f"Invalid input: {DURATION_DAYS_ERROR}"})
+INVALID_BATCH_BODY = json.dumps({"error": "Invalid input: 'items' must be a non-empty list"})
+BACKLOG_FULL_BODY = json.dumps({"error": "Too many itineraries are being generated, retry later"})
+STREAM_NOT_FOUND_EVENT = json.dumps({"status": "not_found"})
+
+
+# smallest body worth compressing: below it the encoding saves less than it costs
+MIN_COMPRESS_BYTES = 1024
+# content codings offered, by preference
+RESPONSE_ENCODINGS = ("br", "gzip")
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick the Content-Encoding of a response from the Accept-Encoding header: the
+    offered coding with the highest q-value, br first on ties, None for identity.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, *params = item.split(";")
+        weight = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for coding in RESPONSE_ENCODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def encoding_headers(request, body):
+    """
+    Headers compressing a response body for the client. The Workers runtime encodes
+    the body according to Content-Encoding, natively and off the Python heap, so the
+    body is handed over uncompressed.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    if body and len(body) >= MIN_COMPRESS_BYTES:
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            headers["Content-Encoding"] = encoding
+    return headers
+
+
+def json_response(body, status=200, headers=None):
+    """
+    Response for an already encoded JSON body.
+    """
+    return Response(body, status=status, headers={**JSON_HEADERS, **headers} if headers else JSON_HEADERS)
+
 
 async def on_fetch(request, env, ctx):
-    FIREBASE_EMAIL = env.FIREBASE_EMAIL
-    FIREBASE_PASSWORD = env.FIREBASE_PASSWORD
-    FIREBASE_API_KEY = env.FIREBASE_API_KEY
-    gcp_auth_helper=GCPAuthHelper()
+    trace = start_trace("fetch", get_sample_rate(env))
+    response = await handle_fetch(request, env, ctx)
+    if trace:
+        # spans of work outliving the response (SSE pump, background jobs) are not logged here
+        response.headers.set("Server-Timing", trace.server_timing())
+        trace.end(method=request.method, path=URLHelper(request.url).pathname, status=response.status)
+    return response
+
+
+async def handle_fetch(request, env, ctx):
+    token_manager = get_token_manager(env)
 
     try:
         
@@ -18,156 +121,629 @@ async def on_fetch(request, env, ctx):
         method = request.method
         path = URLHelper(url).pathname
         print(f"on_fetch: {method} {path}")
-        if not ((path == "/itinerary" and method == "GET") or (path == "/create" and method == "POST")):
-            return Response(
-                json.dumps({"error": f"Invalid endpoint"}),
-                status=404,
-                headers={"Content-Type": "application/json"},
-            )
-        id_token = await gcp_auth_helper.sign_in_with_password(
-            FIREBASE_EMAIL, FIREBASE_PASSWORD, FIREBASE_API_KEY
-        )
+        route = ROUTES.get((method, path))
+        if route is None:
+            return json_response(INVALID_ENDPOINT_BODY, status=404)
+        try:
+            id_token = await token_manager.get_id_token()
+        except (HttpError, HttpTimeoutError) as e:
+            # Firebase Auth failed transiently, the credentials were not rejected
+            print("on_fetch sign-in Error:", repr(e))
+            retry_after = getattr(e, "retry_after", None)
+            headers = {"Retry-After": str(int(retry_after))} if retry_after else None
+            return json_response(AUTH_UNAVAILABLE_BODY, status=503, headers=headers)
         if not id_token:
-            return Response(
-                json.dumps({"error": f"Failed to authenticate"}),
-                status=401,
-                headers={"Content-Type": "application/json"},
-            )
-        if path == "/itinerary" and method == "GET":
-            return await get_itinerary(request, env, id_token)
-        elif path == "/create" and method == "POST":
-            return await create_itinerary(request, env, ctx, id_token)
+            return json_response(UNAUTHENTICATED_BODY, status=401)
+        return await route(request, env, ctx, id_token)
 
     except Exception as e:
         print("on_fetch Error:", traceback.format_exc())
-        return Response(
-            json.dumps({"error": f"Internal server error"}),
-            status=500,
-                headers={"Content-Type": "application/json"},
-        )
+        return json_response(INTERNAL_ERROR_BODY, status=500)
 
 
-async def get_itinerary(request, env, id_token):
+async def on_queue(batch, env, ctx):
     """
-    Handle GET request to retrieve an itinerary by job_id.
+    Cloudflare Queues consumer: run the itinerary jobs of a message batch,
+    at most QUEUE_CONSUMER_CONCURRENCY at a time.
     """
-    try:
-        FIREBASE_PROJECT_ID = env.FIREBASE_PROJECT_ID
-        FIRESTORE_COLLECTION = env.FIRESTORE_COLLECTION
-        itinerary_repository = ItineraryRepository()
-        search_params=URLHelper(request.url).searchParams
-        if 'id' not in search_params:
-            return Response(
-                json.dumps({"error": "id is required"}),
-                status=400,
-                headers={"Content-Type": "application/json"},
-            )
-        id = search_params.get("id")
-        if not id:
-            return Response(
-                json.dumps({"error": "id is required"}),
-                headers={"Content-Type": "application/json"},
-                status=400,
-            )
+    from services import CloudflareMessage, get_itinerary_service
 
-        document = await itinerary_repository.get_document(
-            id_token, FIREBASE_PROJECT_ID, FIRESTORE_COLLECTION, id
+    itinerary_service = get_itinerary_service(env)
+    messages = [CloudflareMessage(message) for message in batch.messages]
+    await itinerary_service.job_consumer().handle_batch(messages)
+
+
+async def on_scheduled(controller, env, ctx):
+    """
+    Cron trigger: resume the jobs whose isolate was evicted mid-run (see JobReaper),
+    then, in the off-peak hours, pre-generate popular itineraries (see Pregenerator).
+    """
+    from services import get_itinerary_service
+
+    try:
+        id_token = await get_token_manager(env).get_id_token()
+        if not id_token:
+            print("on_scheduled: failed to authenticate")
+            return
+        itinerary_service = get_itinerary_service(env)
+        await itinerary_service.job_reaper().sweep(
+            id_token, env.FIREBASE_PROJECT_ID, env.FIRESTORE_COLLECTION, env.LLM_API_KEY, ctx
         )
-        if not document:
-            return Response(
-                json.dumps({
-                    "success": 'false',
-                    "status": "not_found",
-                    "message": "Itinerary not found"
-                }),
-                status=404,
-                headers={"Content-Type": "application/json"},
-            )
-        status = document.get('fields', {}).get('status', {}).get('stringValue', '')
-        if status=='processing':
-            return Response(
-                json.dumps({
-                    "success": 'false',
-                    "status": "generating",
-                    "message": "Itinerary is still being generated"
-                }),
-                status=202,
-                headers={"Content-Type": "application/json"},
-            )
-        elif status=='completed':
-            return Response(
-                json.dumps({
+        await itinerary_service.pregenerator().sweep(
+            id_token, env.FIREBASE_PROJECT_ID, env.FIRESTORE_COLLECTION, env.LLM_API_KEY, ctx
+        )
+    except Exception as e:
+        print("on_scheduled Error:", traceback.format_exc())
+
+
+# how long a non-terminal response may be served from the isolate cache
+PROCESSING_CACHE_TTL = 2
+# completed and failed documents never change again
+TERMINAL_CACHE_TTL = 24 * 60 * 60
+# upper bound of items in one batch request, well below Firestore's 500 writes per commit
+MAX_BATCH_ITEMS = 100
+TOO_MANY_ITEMS_BODY = json.dumps({"error": f"Invalid input: at most {MAX_BATCH_ITEMS} items per batch"})
+TOO_MANY_IDS_BODY = json.dumps({"error": f"at most {MAX_BATCH_ITEMS} ids per request"})
+# GET /itineraries listing: page sizes without and with the itinerary bodies
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_ITINERARY_PAGE_SIZE = 50
+LIST_STATUSES = ("processing", "partial", "completed", "failed")
+# long-poll and SSE limits, and the Firestore polling interval for jobs of other isolates
+MAX_LONG_POLL_SECONDS = 25
+MAX_STREAM_SECONDS = 90
+POLL_MIN_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 4
+# fields read first to answer polls, and the fields only completed and partial responses need
+STATUS_FIELDS = ["status", "error"]
+ITINERARY_FIELDS = [
+    "status", "error", "destination", "durationDays", "daysGenerated", "itineraries", "itinerariesFormat"
+]
+
+
+def build_itinerary_response(document):
+    """
+    Build the cacheable response for a Firestore itinerary document.
+    return dict with status, body, etag and terminal flag, or None for an unknown status.
+    """
+    status = document.get('fields', {}).get('status', {}).get('stringValue', '')
+    if status=='processing':
+        body = {
+            "success": 'false',
+            "status": "generating",
+            "message": "Itinerary is still being generated"
+        }
+    elif status=='completed':
+        body = {
             "success": 'true',
             "status": "completed",
             "data": {
                 "destination": document['fields']['destination']['stringValue'],
-                "duration_days": document['fields']['durationDays']['integerValue'],
-                "itinerary": document['fields']['itineraries']['stringValue']
+                "duration_days": decode_value(document['fields']['durationDays']),
+                "itinerary": decode_itinerary_fields(document['fields'])
             }
-            }),
-                status=202,
-                headers={"Content-Type": "application/json"},
-            )
-        elif status=='failed':
-            return Response(
-                json.dumps({
-                    "success": 'false',
-                    "status": "failed",
-                    "message": f"Itinerary generation failed. {document['fields']['error']['stringValue'] if 'error' in document['fields'] else 'Unknown error'}"
-                }),
-                status=202,
-                headers={"Content-Type": "application/json"},
-            )
+        }
+    elif status=='partial':
+        body = {
+            "success": 'false',
+            "status": "partial",
+            "message": "Itinerary is still being generated, returning the days generated so far",
+            "data": {
+                "destination": document['fields']['destination']['stringValue'],
+                "duration_days": decode_value(document['fields']['durationDays']),
+                "days_generated": int(document['fields'].get('daysGenerated', {}).get('integerValue', 0)),
+                "itinerary": decode_itinerary_fields(document['fields'])
+            }
+        }
+    elif status=='failed':
+        body = {
+            "success": 'false',
+            "status": "failed",
+            "message": f"Itinerary generation failed. {document['fields']['error']['stringValue'] if 'error' in document['fields'] else 'Unknown error'}"
+        }
+    else:
+        return None
+
+    body = json.dumps(body)
+    return {
+        "status": 202,
+        "body": body,
+        "etag": '"' + hashlib.sha1(body.encode("utf-8")).hexdigest()[:20] + '"',
+        "terminal": status in ('completed', 'failed'),
+    }
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
 
-        return Response(
-            json.dumps({"error": "Internal server error"}),
-            status=500,
-                headers={"Content-Type": "application/json"},
+
+async def load_itinerary_response(env, id_token, id, use_cache=True):
+    """
+    Load the response for an itinerary through the itinerary cache.
+    return (response, cache_status); response is None when the document does not exist.
+    """
+    itinerary_cache = get_itinerary_cache(env)
+    # read before the document, so a write landing meanwhile outdates the entry
+    version = get_job_notifier().version(id)
+    if use_cache:
+        cached = await get_cached_response(itinerary_cache, id)
+        if cached:
+            return cached, "HIT"
+
+    itinerary_repository = get_itinerary_repository(env)
+    # status first: most polls only need to know the job is still running
+    document = await itinerary_repository.get_document(
+        id_token, env.FIREBASE_PROJECT_ID, env.FIRESTORE_COLLECTION, id, field_paths=STATUS_FIELDS
+    )
+    if not document:
+        return None, "MISS"
+    status = document.get('fields', {}).get('status', {}).get('stringValue', '')
+    if status in ('completed', 'partial'):
+        document = await itinerary_repository.get_document(
+            id_token, env.FIREBASE_PROJECT_ID, env.FIRESTORE_COLLECTION, id, field_paths=ITINERARY_FIELDS
         )
+        if not document:
+            return None, "MISS"
+    cached = build_itinerary_response(document)
+    if not cached:
+        raise ValueError(f"Itinerary {id} has an unknown status")
+    if cached["terminal"]:
+        await itinerary_cache.set(id, cached, ttl=TERMINAL_CACHE_TTL)
+    elif PROCESSING_CACHE_TTL:
+        cached = {**cached, "version": version}
+        await itinerary_cache.set(id, cached, ttl=PROCESSING_CACHE_TTL, persist=False)
+    return cached, "MISS"
+
+
+async def get_cached_response(itinerary_cache, id):
+    """
+    The cached response of an itinerary, or None. The non-terminal response of a
+    job run by this isolate is dropped as soon as the job writes again: process_job
+    notifies every partial and final write, which bumps the job's version.
+    """
+    cached = await itinerary_cache.get(id)
+    if cached and not cached["terminal"] and cached.get("version", 0) != get_job_notifier().version(id):
+        return None
+    return cached
+
+
+async def watch_itinerary(env, id_token, id, timeout, response=None):
+    """
+    Yield the itinerary response every time it changes, until it is terminal,
+    missing (yields None) or `timeout` seconds have passed.
+    Jobs run by this isolate wake the watcher directly through the job notifier;
+    other jobs are polled from Firestore with a growing interval.
+    """
+    job_notifier = get_job_notifier()
+    deadline = time.time() + timeout
+    interval = POLL_MIN_INTERVAL
+    last_etag = None
+    while True:
+        version = job_notifier.version(id)
+        if response is None:
+            response, _ = await load_itinerary_response(env, id_token, id, use_cache=False)
+        if response is None:
+            yield None
+            return
+        if response["etag"] != last_etag:
+            last_etag = response["etag"]
+            yield response
+        if response["terminal"]:
+            return
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        if job_notifier.is_local(id):
+            await job_notifier.wait(id, version, remaining)
+        else:
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+        response = None
+
+
+def itinerary_not_found():
+    return json_response(NOT_FOUND_BODY, status=404)
+
+
+def parse_wait(value):
+    """
+    Long-poll seconds of the wait parameter, clamped to MAX_LONG_POLL_SECONDS;
+    0 when absent, None when it is not a non-negative number.
+    """
+    if not value:
+        return 0
+    try:
+        wait = float(value)
+    except ValueError:
+        return None
+    if wait != wait or wait < 0:
+        return None
+    return min(wait, MAX_LONG_POLL_SECONDS)
+
+
+async def get_itinerary(request, env, ctx, id_token):
+    """
+    Handle GET request to retrieve an itinerary by job_id.
+    Terminal documents are served from the itinerary cache with ETag support.
+    With wait=<seconds> the request is held until the itinerary changes (long-poll).
+    """
+    try:
+        search_params=URLHelper(request.url).searchParams
+        id = search_params.get("id")
+        if not id:
+            return json_response(ID_REQUIRED_BODY, status=400)
+        wait = parse_wait(search_params.get("wait"))
+        if wait is None:
+            return json_response(INVALID_WAIT_BODY, status=400)
+
+        cached, cache_status = await load_itinerary_response(env, id_token, id)
+        if not cached:
+            return itinerary_not_found()
+
+        if_none_match = request.headers.get("If-None-Match")
+        if wait > 0 and not cached["terminal"]:
+            seen_etag = cached["etag"] if not if_none_match else None
+            async for response in watch_itinerary(env, id_token, id, wait, cached):
+                if response is None:
+                    return itinerary_not_found()
+                cached = response
+                if response["etag"] != seen_etag and not etag_matches(if_none_match, response["etag"]):
+                    break
+
+        headers = {
+            "Content-Type": "application/json",
+            "ETag": cached["etag"],
+            "X-Cache": cache_status,
+            "Cache-Control": "private, max-age=0, must-revalidate",
+        }
+        if etag_matches(if_none_match, cached["etag"]):
+            del headers["Content-Type"]
+            return Response(None, status=304, headers=headers)
+        headers.update(encoding_headers(request, cached["body"]))
+        return Response(cached["body"], status=cached["status"], headers=headers)
         
     except Exception as e:
         print("get_itinerary Error:", traceback.format_exc())
-        return Response(
-            json.dumps({"error": f"Internal server error"}),
-            status=500,
-                headers={"Content-Type": "application/json"},
-        )
+        return json_response(INTERNAL_ERROR_BODY, status=500)
+
+
+def parse_duration_days(value):
+    """
+    durationDays of a create request as an int: a whole number, also as a float or
+    a string of digits, from 1 to MAX_DURATION_DAYS. return None when it is not.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, int) or not 1 <= value <= MAX_DURATION_DAYS:
+        return None
+    return value
+
+
+async def stream_itinerary(request, env, ctx, id_token):
+    """
+    Handle GET /itinerary/stream: Server-Sent Events with one "status" event per
+    change of the itinerary, closed once it is completed or failed.
+    """
+    id = URLHelper(request.url).searchParams.get("id")
+    if not id:
+        return json_response(ID_REQUIRED_BODY, status=400)
+
+    event_stream = EventStream()
+
+    async def pump():
+        try:
+            async for response in watch_itinerary(env, id_token, id, MAX_STREAM_SECONDS):
+                if response is None:
+                    await event_stream.send(STREAM_NOT_FOUND_EVENT, event="error")
+                    return
+                await event_stream.send(response["body"], event="status", event_id=response["etag"])
+        except Exception:
+            print("stream_itinerary Error:", traceback.format_exc())
+            await event_stream.send(INTERNAL_ERROR_BODY, event="error")
+        finally:
+            await event_stream.close()
+
+    ctx.waitUntil(python_coroutine_to_js_promise(pump()))
+    return Response(
+        event_stream.readable,
+        status=200,
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        },
+    )
+
+
+def backlog_full_response(error):
+    return json_response(BACKLOG_FULL_BODY, status=429, headers={"Retry-After": str(error.retry_after)})
 
 
 async def create_itinerary(request, env, ctx, id_token):
+    from services import BacklogFullError, get_itinerary_service
+
     try:
         FIREBASE_PROJECT_ID = env.FIREBASE_PROJECT_ID
         FIRESTORE_COLLECTION = env.FIRESTORE_COLLECTION
         LLM_API_KEY = env.LLM_API_KEY
-        itinerary_service = ItineraryService(env, ctx)
 
         request_data = await request.json()
         if hasattr(request_data, 'to_py'):
             request_data = request_data.to_py()
             
-        if not request_data or 'destination' not in request_data or 'durationDays' not in request_data:
-            return Response(
-                json.dumps({"error": "Invalid input: 'destination' and 'durationDays' are required"}),
-                status=400,
-                headers={"Content-Type": "application/json"},
-            )
+        if (
+            not isinstance(request_data, dict)
+            or not isinstance(request_data.get('destination'), str)
+            or not request_data['destination'].strip()
+            or 'durationDays' not in request_data
+        ):
+            return json_response(INVALID_CREATE_BODY, status=400)
         destination = request_data['destination']
-        duration_days = request_data['durationDays']
+        duration_days = parse_duration_days(request_data['durationDays'])
+        if duration_days is None:
+            return json_response(INVALID_DURATION_BODY, status=400)
 
-        document_id = await itinerary_service.create_itinerary(
-            destination, duration_days, id_token, FIREBASE_PROJECT_ID, FIRESTORE_COLLECTION, LLM_API_KEY
+        document_id, status = await get_itinerary_service(env).create_itinerary(
+            destination, duration_days, id_token, FIREBASE_PROJECT_ID, FIRESTORE_COLLECTION, LLM_API_KEY, ctx
         )
 
-        return Response(
+        return json_response(
             json.dumps({"success": 'true',
   "id": document_id,
-  "message": "Itinerary generation started"
-                }), status=202, headers={"Content-Type": "application/json"}
+  "status": status,
+  "message": CREATE_MESSAGES[status]
+                }), status=200 if status in READY_CREATE_STATUSES else 202
         )
+    except BacklogFullError as e:
+        return backlog_full_response(e)
     except Exception as e:
         print("on_fetch Error:", traceback.format_exc())
-        return Response(
-            json.dumps({"error": "Internal server error"}),
-            status=500,
-            headers={"Content-Type": "application/json"},
-        )
+        return json_response(INTERNAL_ERROR_BODY, status=500)
+
+
+async def create_itineraries_batch(request, env, ctx, id_token):
+    """
+    Handle POST /create/batch: {"items": [{"destination": ..., "durationDays": ...}, ...]}.
+    All new processing documents are inserted in one Firestore commit.
+    """
+    from services import BacklogFullError, get_itinerary_service
+
+    try:
+        itinerary_service = get_itinerary_service(env)
+
+        request_data = await request.json()
+        if hasattr(request_data, 'to_py'):
+            request_data = request_data.to_py()
+
+        items = request_data.get('items') if isinstance(request_data, dict) else None
+        if not isinstance(items, list) or not items:
+            return json_response(INVALID_BATCH_BODY, status=400)
+        if len(items) > MAX_BATCH_ITEMS:
+            return json_response(TOO_MANY_ITEMS_BODY, status=400)
+
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            if (
+                not isinstance(item, dict)
+                or not isinstance(item.get('destination'), str)
+                or not item['destination'].strip()
+                or 'durationDays' not in item
+            ):
+                results[index] = {
+                    "index": index,
+                    "status": "invalid",
+                    "error": "'destination' and 'durationDays' are required",
+                }
+            elif parse_duration_days(item['durationDays']) is None:
+                results[index] = {"index": index, "status": "invalid", "error": DURATION_DAYS_ERROR}
+            else:
+                valid.append(index)
+
+        if valid:
+            created = await itinerary_service.create_itineraries_batch(
+                [(items[index]['destination'], parse_duration_days(items[index]['durationDays'])) for index in valid],
+                id_token,
+                env.FIREBASE_PROJECT_ID,
+                env.FIRESTORE_COLLECTION,
+                env.LLM_API_KEY,
+                ctx,
+            )
+            for index, result in zip(valid, created):
+                results[index] = {"index": index, **result}
+
+        return json_response(json.dumps({"success": 'true', "items": results}), status=202)
+    except BacklogFullError as e:
+        return backlog_full_response(e)
+    except Exception as e:
+        print("create_itineraries_batch Error:", traceback.format_exc())
+        return json_response(INTERNAL_ERROR_BODY, status=500)
+
+
+async def get_itineraries(request, env, ctx, id_token):
+    """
+    Handle GET /itineraries: the itineraries of `ids`, or without ids a page of the listing.
+    """
+    if URLHelper(request.url).searchParams.get("ids") is None:
+        return await list_itineraries(request, env, ctx, id_token)
+    return await get_itineraries_batch(request, env, ctx, id_token)
+
+
+def bad_request(message):
+    return json_response(json.dumps({"error": message}), status=400)
+
+
+def parse_since(value):
+    """
+    createdAt lower bound of the listing from epoch seconds, a date or an ISO timestamp.
+    """
+    if value.replace(".", "", 1).isdigit():
+        return utc_timestamp(float(value))
+    if len(value) == 10:
+        value += "T00:00:00Z"
+    parse_timestamp(value)
+    return value if value.endswith("Z") else value + "Z"
+
+
+def build_list_item(document):
+    """
+    Item of the listing: the id and the projected fields, timestamps as ISO strings.
+    """
+    fields = document.get("fields", {})
+    item = {"id": document["name"].split("/")[-1]}
+    for key, value in fields.items():
+        if key in ("itineraries", "itinerariesFormat"):
+            continue
+        item[key] = value["timestampValue"] if "timestampValue" in value else decode_value(value)
+    if "itineraries" in fields:
+        item["itinerary"] = decode_itinerary_fields(fields)
+    return item
+
+
+async def list_itineraries(request, env, ctx, id_token):
+    """
+    Handle GET /itineraries?status=&destination=&since=&pageSize=&pageToken=&include=itinerary:
+    itineraries newest first, one page per request. Items hold the job fields without the
+    itinerary unless include=itinerary; nextPageToken, when set, fetches the next page
+    with the same filters.
+    """
+    try:
+        search_params = URLHelper(request.url).searchParams
+        params = {key: unquote(value.replace("+", " ")) for key, value in search_params.items()}
+
+        status = params.get("status") or None
+        if status is not None and status not in LIST_STATUSES:
+            return bad_request(f"status must be one of {', '.join(LIST_STATUSES)}")
+        destination_key = None
+        if params.get("destination"):
+            from services import canonical_destination
+
+            destination_key = canonical_destination(params["destination"])
+        since = None
+        if params.get("since"):
+            try:
+                since = parse_since(params["since"])
+            except ValueError:
+                return bad_request("since must be epoch seconds or an ISO 8601 date or timestamp")
+        include_itinerary = params.get("include") == "itinerary"
+        max_page_size = MAX_ITINERARY_PAGE_SIZE if include_itinerary else MAX_PAGE_SIZE
+        try:
+            page_size = int(params.get("pageSize") or DEFAULT_PAGE_SIZE)
+        except ValueError:
+            return bad_request("pageSize must be an integer")
+        if not 1 <= page_size <= max_page_size:
+            return bad_request(f"pageSize must be between 1 and {max_page_size}")
+
+        try:
+            documents, next_page_token = await get_itinerary_repository(env).list_documents(
+                id_token,
+                env.FIREBASE_PROJECT_ID,
+                env.FIRESTORE_COLLECTION,
+                status=status,
+                destination_key=destination_key,
+                since=since,
+                page_size=page_size,
+                page_token=params.get("pageToken") or None,
+                include_itinerary=include_itinerary,
+            )
+        except InvalidPageToken as e:
+            return bad_request(str(e))
+
+        body = json.dumps({
+            "success": 'true',
+            "items": [build_list_item(document) for document in documents],
+            "nextPageToken": next_page_token,
+        })
+        return json_response(body, headers=encoding_headers(request, body))
+    except Exception as e:
+        print("list_itineraries Error:", traceback.format_exc())
+        return json_response(INTERNAL_ERROR_BODY, status=500)
+
+
+async def get_itineraries_batch(request, env, ctx, id_token):
+    """
+    Handle GET /itineraries?ids=a,b,c: cached itineraries are served from the cache,
+    the rest are read with one Firestore batchGet.
+    """
+    try:
+        ids = unquote(URLHelper(request.url).searchParams.get("ids", ""))
+        ids = list(dict.fromkeys(id for id in ids.split(",") if id))
+        if not ids:
+            return json_response(IDS_REQUIRED_BODY, status=400)
+        if len(ids) > MAX_BATCH_ITEMS:
+            return json_response(TOO_MANY_IDS_BODY, status=400)
+
+        itinerary_cache = get_itinerary_cache(env)
+        responses = {}
+        for id in ids:
+            responses[id] = await get_cached_response(itinerary_cache, id)
+
+        missing = [id for id in ids if responses[id] is None]
+        if missing:
+            itinerary_repository = get_itinerary_repository(env)
+            documents = await itinerary_repository.batch_get_documents(
+                id_token, env.FIREBASE_PROJECT_ID, env.FIRESTORE_COLLECTION, missing
+            )
+            for id, document in documents.items():
+                if document is None:
+                    continue
+                response = build_itinerary_response(document)
+                if response and response["terminal"]:
+                    await itinerary_cache.set(id, response, ttl=TERMINAL_CACHE_TTL)
+                responses[id] = response
+
+        items = []
+        for id in ids:
+            response = responses[id]
+            if response is None:
+                items.append({"id": id, "success": 'false', "status": "not_found"})
+            else:
+                items.append({"id": id, **json.loads(response["body"])})
+
+        body = json.dumps({"success": 'true', "items": items})
+        return json_response(body, headers=encoding_headers(request, body))
+    except Exception as e:
+        print("get_itineraries_batch Error:", traceback.format_exc())
+        return json_response(INTERNAL_ERROR_BODY, status=500)
+
+
+async def get_metrics(request, env, ctx, id_token):
+    """
+    Handle GET /metrics: counters of this isolate, among them the dedup hits and the
+    reuse rate of completed itineraries, LLM provider health and upstream latencies.
+    """
+    from services import (
+        get_admission_controller,
+        get_dedup_registry,
+        get_demand_tracker,
+        get_destination_index,
+        get_llm_router,
+    )
+
+    return json_response(json.dumps({
+        "dedup": get_dedup_registry().stats(),
+        "reuse": get_destination_index().stats(),
+        "demand": get_demand_tracker(env).stats(),
+        "admission": get_admission_controller(env).stats(),
+        "llm": get_llm_router(env).snapshot(),
+        "http": get_http_client().stats(),
+    }))
+
+
+# (method, path) -> handler(request, env, ctx, id_token)
+ROUTES = {
+    ("GET", "/itinerary"): get_itinerary,
+    ("GET", "/itinerary/stream"): stream_itinerary,
+    ("GET", "/itineraries"): get_itineraries,
+    ("POST", "/create"): create_itinerary,
+    ("POST", "/create/batch"): create_itineraries_batch,
+    ("GET", "/metrics"): get_metrics,
+}
@@ -0,0 +1,12 @@
+"""
+Unit tests run under CPython like the benchmarks: importing bench puts src/ and
+the fake Workers runtime (bench/runtime) on sys.path.
+"""
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import bench  # noqa: E402,F401
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from services.destination_index import (
+    DestinationIndex,
+    canonical_destination,
+    edit_distance,
+    select_days,
+)
+
+PROMPT_VERSION = "v1"
+
+
+@pytest.mark.parametrize(
+    "destination, key",
+    [
+        ("Paris", "paris"),
+        ("  PARIS. ", "paris"),
+        ("Paris, France", "paris"),
+        ("NYC", "new york"),
+        ("New York City", "new york"),
+        ("New York, USA", "new york"),
+        ("Roma, Italia", "rome"),
+        ("München", "munich"),
+        ("Córdoba, Argentina", "cordoba, argentina"),
+        ("Paris, Texas", "paris, texas"),
+        ("Portland, USA", "portland, united states"),
+    ],
+)
+def test_canonical_destination(destination, key):
+    assert canonical_destination(destination) == key
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("Córdoba, Argentina", "Córdoba, Spain"),
+        ("Paris, Texas", "Paris, France"),
+        ("Portland, Oregon", "Portland, Maine"),
+        ("Valencia, Venezuela", "Valencia, Spain"),
+    ],
+)
+def test_different_cities_keep_different_keys(first, second):
+    assert canonical_destination(first) != canonical_destination(second)
+
+
+def test_edit_distance():
+    assert edit_distance("barcelona", "barcelona", 2) == 0
+    assert edit_distance("barcelona", "barcelone", 2) == 1
+    assert edit_distance("barcelona", "barcleona", 2) == 1
+    assert edit_distance("paris", "parish", 1) == 1
+    assert edit_distance("kyoto", "tokyo", 1) == 2
+    assert edit_distance("a", "abcdef", 2) == 3
+
+
+def make_index():
+    index = DestinationIndex()
+    now = time.time()
+    index.add("Paris", 5, "paris-doc", now, PROMPT_VERSION)
+    index.add("Barcelona", 7, "barcelona-doc", now, PROMPT_VERSION)
+    index.add("District 1", 3, "district-doc", now, PROMPT_VERSION)
+    return index
+
+
+def test_match_exact_and_typo():
+    index = make_index()
+    entry, similarity = index.match("paris, france", 3, PROMPT_VERSION)
+    assert (entry["documentId"], similarity) == ("paris-doc", 1.0)
+    entry, similarity = index.match("Barcelone", 4, PROMPT_VERSION)
+    assert entry["documentId"] == "barcelona-doc"
+    assert similarity < 1.0
+
+
+def test_match_rejects_non_typos():
+    index = make_index()
+    assert index.match("Parish", 3, PROMPT_VERSION) is None
+    assert index.match("District 11", 3, PROMPT_VERSION) is None
+
+
+def test_match_needs_enough_days_and_same_prompt():
+    index = make_index()
+    assert index.match("Paris", 6, PROMPT_VERSION) is None
+    assert index.match("Paris", 3, "v2") is None
+
+
+def test_select_days():
+    days = [{"day": n, "activities": []} for n in range(1, 6)]
+    assert [day["day"] for day in select_days(days, 3)] == [1, 2, 3]
@@ -0,0 +1,91 @@
+import base64
+import json
+import zlib
+from datetime import datetime, timezone
+
+import pytest
+
+from repositories.firestore_codec import (
+    ITINERARY_FORMAT_NATIVE,
+    ITINERARY_FORMAT_ZLIB,
+    decode_fields,
+    decode_itinerary,
+    decode_itinerary_fields,
+    decode_value,
+    encode_fields,
+    encode_itinerary,
+    encode_value,
+)
+
+DAYS = [
+    {
+        "day": 1,
+        "theme": "Vieux Québec",
+        "activities": [{"time": "09:00", "description": "Château Frontenac", "location": "Québec"}],
+    },
+    {"day": 2, "theme": "", "activities": [{"time": "", "description": "Montmorency falls", "location": ""}]},
+]
+
+
+def test_encode_scalar_values():
+    assert encode_value("a") == {"stringValue": "a"}
+    assert encode_value(True) == {"booleanValue": True}
+    assert encode_value(7) == {"integerValue": "7"}
+    assert encode_value(1.5) == {"doubleValue": 1.5}
+    assert encode_value(None) == {"nullValue": None}
+
+
+def test_encode_unknown_type():
+    with pytest.raises(TypeError):
+        encode_value(object())
+
+
+def test_round_trip():
+    values = {
+        "name": "Lyon",
+        "count": 3,
+        "ratio": 0.25,
+        "ok": False,
+        "missing": None,
+        "tags": ["a", 1, [True]],
+        "nested": {"inner": {"x": "y"}},
+        "raw": b"\x00\xff",
+        "at": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+    }
+    assert decode_fields(encode_fields(values)) == values
+
+
+def test_decode_timestamp_with_nanoseconds():
+    value = decode_value({"timestampValue": "2024-05-01T12:30:15.123456789Z"})
+    assert value == datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+def test_native_itinerary():
+    fields = encode_itinerary(DAYS)
+    assert "arrayValue" in fields["itineraries"]
+    assert decode_value(fields["itinerariesFormat"]) == ITINERARY_FORMAT_NATIVE
+    assert decode_itinerary_fields(fields) == DAYS
+
+
+def test_zlib_itinerary():
+    fields = encode_itinerary(DAYS, ITINERARY_FORMAT_ZLIB)
+    data = zlib.decompress(base64.b64decode(fields["itineraries"]["bytesValue"]))
+    assert json.loads(data) == DAYS
+    assert decode_value(fields["itinerariesFormat"]) == ITINERARY_FORMAT_ZLIB
+    assert decode_itinerary_fields(fields) == DAYS
+
+
+def test_legacy_json_string_itinerary():
+    assert decode_itinerary_fields({"itineraries": {"stringValue": json.dumps(DAYS)}}) == DAYS
+
+
+def test_missing_itinerary():
+    assert decode_itinerary_fields({}) is None
+
+
+def test_unknown_formats():
+    with pytest.raises(ValueError):
+        encode_itinerary(DAYS, 9)
+    fields = encode_itinerary(DAYS, ITINERARY_FORMAT_ZLIB)
+    with pytest.raises(ValueError):
+        decode_itinerary(fields["itineraries"], ITINERARY_FORMAT_NATIVE)
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from utils.gcp_helper import GCPAuthHelper
+from utils.http_client import HttpClient, HttpError, HttpResponse, HttpTimeoutError
+
+URL = "https://example.com/items"
+
+
+class FakeTransport:
+    """
+    Answers each request with the next scripted (delay, status, headers) step,
+    the last step repeating. An exception as status is raised instead.
+    """
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def send(self, method, url, headers, body, stream=False):
+        delay, status, response_headers = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if isinstance(status, Exception):
+            raise status
+        return HttpResponse(status, response_headers, b'{"ok": true}')
+
+
+def make_client(transport, **options):
+    return HttpClient(transport, base_backoff=0.001, max_backoff=0.01, **options)
+
+
+def test_retries_retryable_statuses():
+    transport = FakeTransport((0, 503, {}), (0, 429, {}), (0, 200, {}))
+    client = make_client(transport)
+    resp = asyncio.run(client.request("GET", URL))
+    assert resp.json() == {"ok": True}
+    assert transport.calls == 3
+    assert client.retries == 2
+
+
+def test_gives_up_after_max_retries():
+    transport = FakeTransport((0, 503, {}))
+    with pytest.raises(HttpError) as raised:
+        asyncio.run(make_client(transport, max_retries=2).request("GET", URL))
+    assert raised.value.status == 503
+    assert transport.calls == 3
+
+
+def test_does_not_retry_client_errors_or_non_idempotent_calls():
+    transport = FakeTransport((0, 404, {}))
+    with pytest.raises(HttpError):
+        asyncio.run(make_client(transport).request("GET", URL))
+    assert transport.calls == 1
+
+    transport = FakeTransport((0, 503, {}), (0, 200, {}))
+    with pytest.raises(HttpError):
+        asyncio.run(make_client(transport).request("POST", URL, json_body={}))
+    assert transport.calls == 1
+
+
+def test_retry_after_is_honoured():
+    transport = FakeTransport((0, 429, {"retry-after": "0.2"}), (0, 200, {}))
+    client = make_client(transport)
+    started = asyncio.run(timed(client.request("GET", URL)))
+    assert started >= 0.2
+    assert transport.calls == 2
+
+
+def test_connection_errors_are_retried():
+    transport = FakeTransport((0, ConnectionResetError("reset"), {}), (0, 200, {}))
+    resp = asyncio.run(make_client(transport).request("GET", URL))
+    assert resp.status == 200
+    assert transport.calls == 2
+
+
+def test_deadline_covers_every_attempt():
+    transport = FakeTransport((1, 200, {}))
+    with pytest.raises(HttpTimeoutError):
+        asyncio.run(make_client(transport).request("GET", URL, timeout=0.05))
+    # the attempt used the whole deadline, so there is no time left to retry
+    assert transport.calls == 1
+
+
+def test_slow_gets_are_hedged_past_the_p95():
+    transport = FakeTransport((0, 200, {}))
+    client = make_client(transport, hedge_min_samples=5, hedge_min_delay=0.01)
+
+    async def run():
+        for _ in range(5):
+            await client.request("GET", URL, hedge=True, endpoint="items")
+        # the primary hangs, the hedged duplicate answers at once
+        transport.steps = [(5, 200, {}), (0, 200, {})]
+        transport.calls = 0
+        return await timed(client.request("GET", URL, hedge=True, endpoint="items"))
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 1
+    assert client.hedges == 1
+    assert transport.calls == 2
+
+
+def test_no_hedging_without_enough_samples():
+    transport = FakeTransport((0.05, 200, {}))
+    client = make_client(transport, hedge_min_samples=5)
+    asyncio.run(client.request("GET", URL, hedge=True, endpoint="items"))
+    assert client.hedges == 0
+    assert transport.calls == 1
+
+
+def test_sign_in_rejected_credentials_and_transient_failures():
+    helper = GCPAuthHelper(make_client(FakeTransport((0, 400, {}))))
+    assert asyncio.run(helper.sign_in("user@example.com", "wrong", "key")) is None
+
+    helper = GCPAuthHelper(make_client(FakeTransport((0, 503, {}))))
+    with pytest.raises(HttpError):
+        asyncio.run(helper.sign_in("user@example.com", "secret", "key"))
+
+
+async def timed(coroutine):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await coroutine
+    return loop.time() - started
@@ -0,0 +1,93 @@
+import json
+
+from services.itinerary_output import ItineraryOutputParser, parse_itinerary_output, validate_day
+from utils.json_stream import JSONArrayStreamParser, loads_lenient
+
+
+def make_day(number):
+    return {
+        "day": number,
+        "theme": f"Day {number}",
+        "activities": [{"time": "09:00", "description": f"Visit {number}", "location": "Center"}],
+    }
+
+
+DAYS = [make_day(1), make_day(2), make_day(3)]
+
+
+def test_plain_array():
+    days, complete = parse_itinerary_output(json.dumps(DAYS))
+    assert days == DAYS
+    assert complete
+
+
+def test_fenced_output():
+    content = f"```json\n{json.dumps(DAYS, indent=2)}\n```"
+    assert parse_itinerary_output(content) == (DAYS, True)
+
+
+def test_chatty_output_with_bracketed_words():
+    content = f"Here is your [3-day] plan [draft]:\n{json.dumps(DAYS)}\nEnjoy [the trip]!"
+    assert parse_itinerary_output(content) == (DAYS, True)
+
+
+def test_truncated_output_keeps_leading_days():
+    content = json.dumps(DAYS)
+    cut = content.index('{"day": 3') + 20
+    days, complete = parse_itinerary_output(content[:cut])
+    assert days == DAYS[:2]
+    assert not complete
+
+
+def test_trailing_commas_are_repaired():
+    content = '[{"day": 1, "theme": "A", "activities": [{"time": "9", "description": "x", "location": "y"},],},]'
+    days, complete = parse_itinerary_output(content)
+    assert [day["day"] for day in days] == [1]
+    assert complete
+
+
+def test_schema_violation_stops_at_the_bad_day():
+    bad = {"day": 2, "theme": "B", "activities": []}
+    days, complete = parse_itinerary_output(json.dumps([make_day(1), bad, make_day(3)]))
+    assert days == [make_day(1)]
+    assert not complete
+
+
+def test_malformed_element_stops_the_parser():
+    content = json.dumps([make_day(1)])[:-1] + ', {"day": 2, "theme": oops}]'
+    days, complete = parse_itinerary_output(content)
+    assert days == [make_day(1)]
+    assert not complete
+
+
+def test_empty_or_missing_content():
+    assert parse_itinerary_output(None) == ([], False)
+    assert parse_itinerary_output("Sorry, I cannot help with that.") == ([], False)
+
+
+def test_streamed_chunks_yield_days_as_they_close():
+    content = "```json\n" + json.dumps(DAYS) + "\n```"
+    parser = ItineraryOutputParser()
+    completed = []
+    for start in range(0, len(content), 7):
+        completed.extend(parser.feed(content[start:start + 7]))
+    assert completed == DAYS
+    assert parser.complete
+
+
+def test_strings_with_brackets_and_escapes():
+    parser = JSONArrayStreamParser()
+    elements = parser.feed('[{"a": "x ] } \\" [ {"}, {"b": 1}]')
+    assert elements == [{"a": 'x ] } " [ {'}, {"b": 1}]
+    assert parser.finished and not parser.failed
+
+
+def test_validate_day_fills_optional_fields():
+    day = validate_day({"day": "2", "activities": [{"description": "Museum"}]})
+    assert day == {"day": 2, "theme": "", "activities": [{"time": "", "description": "Museum", "location": ""}]}
+    assert validate_day({"day": 1, "activities": [{"description": " "}]}) is None
+    assert validate_day(["not", "a", "day"]) is None
+
+
+def test_loads_lenient():
+    assert loads_lenient('{"a": [1, 2,], }') == {"a": [1, 2]}
@@ -0,0 +1,111 @@
+import asyncio
+
+from services.job_queue import InMemoryJobQueue, InMemoryMessage, JobConsumer
+from utils.http_client import HttpError
+
+
+class FlakyJob:
+    """
+    Fails the first `failures` runs of each job, then succeeds.
+    """
+
+    def __init__(self, failures=0, error=None):
+        self.failures = failures
+        self.error = error or HttpError(503)
+        self.runs = {}
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, body):
+        self.runs[body["jobId"]] = self.runs.get(body["jobId"], 0) + 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            if self.runs[body["jobId"]] <= self.failures:
+                raise self.error
+        finally:
+            self.running -= 1
+
+
+def run_queue(consumer, jobs):
+    queue = InMemoryJobQueue(max_batch_size=10)
+
+    async def run():
+        await queue.send_batch([{"jobId": str(number)} for number in range(jobs)])
+        await queue.drain(consumer.handle_batch)
+
+    asyncio.run(run())
+    return queue
+
+
+def test_runs_every_job_with_bounded_concurrency():
+    process = FlakyJob()
+    consumer = JobConsumer(process, concurrency=3)
+    queue = run_queue(consumer, 8)
+    assert len(queue) == 0
+    assert consumer.processed == 8
+    assert process.runs == {str(number): 1 for number in range(8)}
+    assert process.max_running == 3
+
+
+def test_failed_jobs_are_redelivered():
+    process = FlakyJob(failures=2)
+    consumer = JobConsumer(process, max_attempts=3, retry_delay=0)
+    run_queue(consumer, 2)
+    assert consumer.processed == 2
+    assert consumer.retried == 4
+    assert consumer.dead_lettered == 0
+    assert process.runs == {"0": 3, "1": 3}
+
+
+def test_jobs_failing_every_attempt_are_dead_lettered():
+    dead = []
+
+    async def on_dead_letter(body, error):
+        dead.append((body["jobId"], error.status))
+
+    dead_letter_queue = InMemoryJobQueue()
+    process = FlakyJob(failures=10)
+    consumer = JobConsumer(
+        process, max_attempts=3, retry_delay=0, on_dead_letter=on_dead_letter, dead_letter_queue=dead_letter_queue
+    )
+    queue = run_queue(consumer, 1)
+    assert len(queue) == 0
+    assert process.runs == {"0": 3}
+    assert consumer.dead_lettered == 1
+    assert dead == [("0", 503)]
+    assert len(dead_letter_queue) == 1
+
+
+def test_retry_delay_grows_and_follows_retry_after():
+    consumer = JobConsumer(FlakyJob(failures=1), retry_delay=10)
+    message = InMemoryMessage("1", {"jobId": "a"}, attempts=2)
+    asyncio.run(consumer.handle_batch([message]))
+    assert not message.acked
+    assert message.retry_delay == 20
+
+    consumer = JobConsumer(FlakyJob(failures=1, error=HttpError(429, headers={"retry-after": "45.5"})), retry_delay=10)
+    message = InMemoryMessage("2", {"jobId": "b"})
+    asyncio.run(consumer.handle_batch([message]))
+    assert message.retry_delay == 46
+
+
+def test_unacked_messages_come_back_after_their_delay():
+    queue = InMemoryJobQueue()
+    deliveries = []
+
+    async def handler(messages):
+        for message in messages:
+            deliveries.append(message.attempts)
+            if message.attempts == 1:
+                message.retry({"delaySeconds": 0.05})
+            else:
+                message.ack()
+
+    async def run():
+        await queue.send({"jobId": "a"})
+        await queue.drain(handler)
+
+    asyncio.run(run())
+    assert deliveries == [1, 2]
@@ -0,0 +1,168 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+from services.admission_controller import AdmissionController
+from services.llm_providers import FakeLLMProvider
+from services.llm_router import (
+    LLMRouter,
+    LLMUnavailableError,
+    ProviderHealth,
+    reset_call_deadline,
+    set_call_deadline,
+)
+
+MESSAGES = [{"role": "user", "content": "**Destination:** Lisbon\n**Duration:** 2 days"}]
+
+
+def make_router(*providers, failure_threshold=2, open_seconds=0.05):
+    router = LLMRouter(types.SimpleNamespace(), list(providers), AdmissionController())
+    for provider in providers:
+        router.health[provider.name] = ProviderHealth(failure_threshold=failure_threshold, open_seconds=open_seconds)
+    return router
+
+
+def complete(router):
+    return asyncio.run(router.complete(MESSAGES, "key"))
+
+
+def stream(router):
+    async def run():
+        return "".join([delta async for delta in router.stream(MESSAGES, "key")])
+
+    return asyncio.run(run())
+
+
+def test_primary_answers():
+    primary, secondary = FakeLLMProvider("primary"), FakeLLMProvider("secondary")
+    router = make_router(primary, secondary)
+    completion = complete(router)
+    assert "Lisbon day 2" in completion["choices"][0]["message"]["content"]
+    assert (primary.calls, secondary.calls, router.fallbacks) == (1, 0, 0)
+
+
+def test_failed_call_falls_back():
+    primary, secondary = FakeLLMProvider("primary", failing=True), FakeLLMProvider("secondary")
+    router = make_router(primary, secondary)
+    assert complete(router)["choices"]
+    assert (primary.calls, secondary.calls, router.fallbacks) == (1, 1, 1)
+
+
+def test_failed_stream_falls_back_before_the_first_delta():
+    primary, secondary = FakeLLMProvider("primary", failing=True), FakeLLMProvider("secondary")
+    router = make_router(primary, secondary)
+    assert "Lisbon day 1" in stream(router)
+    assert (primary.calls, secondary.calls) == (1, 1)
+
+
+def test_every_provider_failing():
+    router = make_router(FakeLLMProvider("primary", failing=True), FakeLLMProvider("secondary", failing=True))
+    with pytest.raises(LLMUnavailableError) as raised:
+        complete(router)
+    assert len(raised.value.errors) == 2
+
+
+def test_circuit_opens_and_half_opens():
+    primary = FakeLLMProvider("primary", failing=True)
+    router = make_router(primary)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            complete(router)
+    assert router.health["primary"].state == "open"
+
+    # open: the provider is not called
+    with pytest.raises(LLMUnavailableError):
+        complete(router)
+    assert primary.calls == 2
+
+    # half-open after the cooldown: one probe, which closes the circuit on success
+    asyncio.run(asyncio.sleep(0.06))
+    primary.failing = False
+    assert complete(router)["choices"]
+    assert primary.calls == 3
+    assert router.health["primary"].state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    primary = FakeLLMProvider("primary", failing=True)
+    router = make_router(primary)
+    health = router.health["primary"]
+    health.state, health.opened_at = "open", 0.0
+    with pytest.raises(LLMUnavailableError):
+        complete(router)
+    assert primary.calls == 1
+    assert health.state == "open"
+    assert not health.available()
+
+
+def test_open_circuit_goes_to_the_fallback():
+    primary, secondary = FakeLLMProvider("primary"), FakeLLMProvider("secondary")
+    router = make_router(primary, secondary, open_seconds=30)
+    health = router.health["primary"]
+    health.state, health.opened_at = "open", time.time()
+    assert complete(router)["choices"]
+    assert (primary.calls, secondary.calls) == (0, 1)
+
+
+def test_single_probe_in_flight():
+    primary = FakeLLMProvider("primary", latency_ms=50)
+    secondary = FakeLLMProvider("secondary")
+    router = make_router(primary, secondary)
+    health = router.health["primary"]
+    health.state, health.opened_at = "open", 0.0
+
+    async def run():
+        return await asyncio.gather(router.complete(MESSAGES, "key"), router.complete(MESSAGES, "key"))
+
+    asyncio.run(run())
+    assert (primary.calls, secondary.calls) == (1, 1)
+    assert health.state == "closed"
+
+
+def test_all_circuits_open():
+    router = make_router(FakeLLMProvider("primary"), open_seconds=30)
+    health = router.health["primary"]
+    health.state, health.opened_at = "open", time.time()
+    with pytest.raises(LLMUnavailableError) as raised:
+        complete(router)
+    assert raised.value.errors == []
+    assert 0 < raised.value.retry_after <= 30
+
+
+def test_cancelled_probe_is_released():
+    primary = FakeLLMProvider("primary", latency_ms=1000)
+    router = make_router(primary)
+    health = router.health["primary"]
+    health.state, health.opened_at = "open", 0.0
+
+    async def run():
+        call = asyncio.ensure_future(router.complete(MESSAGES, "key"))
+        await asyncio.sleep(0.02)
+        assert health.probing
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    asyncio.run(run())
+    assert not health.probing
+    assert health.state == "open"
+
+
+def test_job_deadline_leaves_time_for_the_fallback():
+    primary = FakeLLMProvider("primary", latency_ms=5000)
+    secondary = FakeLLMProvider("secondary", latency_ms=10)
+    router = make_router(primary, secondary)
+
+    async def run():
+        token = set_call_deadline(time.time() + 0.3)
+        try:
+            return await router.complete(MESSAGES, "key")
+        finally:
+            reset_call_deadline(token)
+
+    started = time.time()
+    assert asyncio.run(run())["choices"]
+    assert time.time() - started < 0.3
+    assert (primary.calls, secondary.calls) == (1, 1)
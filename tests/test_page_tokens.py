@@ -0,0 +1,23 @@
+import pytest
+
+from repositories.itinerary_repository import InvalidPageToken, ItineraryRepository
+
+CREATED_AT = "2024-05-01T12:30:15.123456Z"
+
+
+def test_round_trip():
+    token = ItineraryRepository.encode_page_token(CREATED_AT, "abc123", "f1")
+    assert "=" not in token
+    assert ItineraryRepository.decode_page_token(token, "f1") == (CREATED_AT, "abc123")
+
+
+def test_other_filters():
+    token = ItineraryRepository.encode_page_token(CREATED_AT, "abc123", "f1")
+    with pytest.raises(InvalidPageToken):
+        ItineraryRepository.decode_page_token(token, "f2")
+
+
+@pytest.mark.parametrize("token", ["garbage", "!!!", "W10", "bnVsbA", "WzEsMl0"])
+def test_garbage(token):
+    with pytest.raises(InvalidPageToken):
+        ItineraryRepository.decode_page_token(token, "f1")
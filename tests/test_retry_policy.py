@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+
+from services.itinerary_output import ItineraryParseError
+from services.llm_router import LLMUnavailableError
+from services.retry_policy import (
+    AUTH_REFRESH,
+    FATAL,
+    MAX_HISTORY,
+    PARSE_REPAIRABLE,
+    RETRYABLE,
+    RetryPolicy,
+    classify_error,
+)
+from utils.http_client import HttpError, HttpTimeoutError
+
+
+def test_classify_http_errors():
+    assert classify_error(HttpError(503)) == RETRYABLE
+    assert classify_error(HttpError(429)) == RETRYABLE
+    assert classify_error(HttpError(408)) == RETRYABLE
+    assert classify_error(HttpError(401)) == AUTH_REFRESH
+    assert classify_error(HttpError(403)) == AUTH_REFRESH
+    assert classify_error(HttpError(400)) == FATAL
+    assert classify_error(HttpError(404)) == FATAL
+
+
+def test_classify_timeouts_and_parse_errors():
+    assert classify_error(HttpTimeoutError("slow")) == RETRYABLE
+    assert classify_error(asyncio.TimeoutError()) == RETRYABLE
+    assert classify_error(ItineraryParseError("no days")) == PARSE_REPAIRABLE
+    assert classify_error(json.JSONDecodeError("bad", "x", 0)) == PARSE_REPAIRABLE
+
+
+def test_classify_llm_unavailable():
+    # every circuit open
+    assert classify_error(LLMUnavailableError([])) == RETRYABLE
+    # a rejected API key is not fixed by a new Firestore token
+    assert classify_error(LLMUnavailableError([HttpError(401), HttpError(400)])) == FATAL
+    assert classify_error(LLMUnavailableError([HttpError(401), HttpError(503)])) == RETRYABLE
+
+
+def test_classify_chained_and_unknown_errors():
+    try:
+        try:
+            raise HttpError(400)
+        except HttpError as error:
+            raise RuntimeError("wrapped") from error
+    except RuntimeError as error:
+        assert classify_error(error) == FATAL
+    assert classify_error(RuntimeError("unknown")) == RETRYABLE
+
+
+def test_backoff_respects_retry_after():
+    policy = RetryPolicy(deadline_seconds=60)
+    error_class, delay = policy.on_failure(1, HttpError(429, headers={"retry-after": "4"}), 0.1)
+    assert (error_class, delay) == (RETRYABLE, 4.0)
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(deadline_seconds=600, max_attempts=50, base_delay=1.0, max_delay=5.0)
+    for attempt in range(1, 20):
+        _, delay = policy.on_failure(attempt, HttpError(503), 0.0)
+        assert 1.0 <= delay <= 5.0
+
+
+def test_auth_and_parse_failures_retry_at_once():
+    policy = RetryPolicy(deadline_seconds=60)
+    assert policy.on_failure(1, HttpError(401), 0.1) == (AUTH_REFRESH, 0.0)
+    assert policy.on_failure(2, ItineraryParseError("no days"), 0.1) == (PARSE_REPAIRABLE, 0.0)
+
+
+def test_gives_up():
+    policy = RetryPolicy(deadline_seconds=60, max_attempts=2)
+    assert policy.on_failure(1, HttpError(400), 0.1) == (FATAL, None)
+    assert policy.reason == "fatal error"
+
+    policy = RetryPolicy(deadline_seconds=60, max_attempts=2)
+    assert policy.on_failure(2, HttpError(503), 0.1) == (RETRYABLE, None)
+    assert policy.reason == "2 attempts failed"
+
+    policy = RetryPolicy(deadline_seconds=5)
+    assert policy.on_failure(1, HttpError(503, headers={"retry-after": "3"}), 3.0) == (RETRYABLE, None)
+    assert policy.reason == "deadline exceeded"
+
+
+def test_attempts_history():
+    history = [{"attempt": n, "class": RETRYABLE} for n in range(1, MAX_HISTORY + 5)]
+    policy = RetryPolicy(deadline_seconds=60, history=history)
+    assert len(policy.attempts) == MAX_HISTORY
+    policy.on_failure(1, HttpError(503, url="https://example.com/x?key=secret"), 0.25)
+    assert len(policy.attempts) == MAX_HISTORY
+    last = policy.attempts[-1]
+    assert last["class"] == RETRYABLE
+    assert last["durationMs"] == 250
+    assert "secret" not in last["error"]
+    assert policy.attempts[-2] == history[-1]
+
+
+def test_run_is_cut_at_the_deadline():
+    policy = RetryPolicy(deadline_seconds=0.05)
+    started = time.time()
+    try:
+        asyncio.run(policy.run(asyncio.sleep(5)))
+    except asyncio.TimeoutError:
+        pass
+    else:
+        raise AssertionError("the attempt outlived the deadline")
+    assert time.time() - started < 1